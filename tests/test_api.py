@@ -0,0 +1,83 @@
+import http.client
+import json
+import threading
+
+import pytest
+
+from watermark import config
+from watermark.api import ApiServer
+from watermark.jobs import JobStore
+
+
+@pytest.fixture
+def server(tmp_path):
+    server = ApiServer(("127.0.0.1", 0), JobStore(tmp_path), worker=None)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def request(server, method, path, body=None, token=None):
+    conn = http.client.HTTPConnection(*server.server_address)
+    headers = {"Content-Type": "application/json"}
+    if token:
+        headers["X-Session-Token"] = token
+    conn.request(method, path, body=body, headers=headers)
+    response = conn.getresponse()
+    return response.status, response.read()
+
+
+def test_requests_without_a_valid_token_are_rejected(server):
+    payload = json.dumps({"items": [{"name": "a.png"}]})
+    assert request(server, "POST", "/jobs", payload)[0] == 401
+    assert request(server, "POST", "/jobs", payload, token=server.issue_token() + "x")[0] == 401
+    assert request(server, "POST", "/jobs", payload, token=server.issue_token())[0] == 201
+
+
+@pytest.mark.parametrize("body", ["[]", '"text"', "1", "null", "{", '{"items": {"name": "a"}}', '{"items": []}'])
+def test_create_job_rejects_malformed_payloads(server, body):
+    status, data = request(server, "POST", "/jobs", body, token=server.issue_token())
+    assert status == 400
+    assert json.loads(data)["error"]["message"]
+
+
+def test_client_metrics_rejects_non_object(server):
+    assert request(server, "POST", "/metrics/client", "[]", token=server.issue_token())[0] == 400
+
+
+def test_jobs_are_scheduled_under_the_token_session_not_the_body(server):
+    token = server.issue_token()
+    for claimed in ("a", "b"):
+        payload = json.dumps({"session": claimed, "items": [{"name": "a.png"}]})
+        assert request(server, "POST", "/jobs", payload, token=token)[0] == 201
+    sessions = {r["session"] for r in server.store._query("SELECT session FROM jobs")}
+    assert sessions == {token.rpartition(".")[0]}
+
+
+def test_named_tokens_carry_their_session(server):
+    assert server.token_session(server.issue_token("nightly-cli")) == "nightly-cli"
+    assert server.token_session("nightly-cli.forged") is None
+
+
+def create_job(server, token):
+    status, data = request(server, "POST", "/jobs", json.dumps({"items": [{"name": "a.mp4"}]}), token=token)
+    assert status == 201
+    return json.loads(data)["jobId"]
+
+
+def test_upload_is_written_to_the_job_directory(server):
+    token = server.issue_token()
+    job_id = create_job(server, token)
+    body = bytes(range(256)) * 5000
+    assert request(server, "PUT", f"/jobs/{job_id}/items/0", body, token=token)[0] == 204
+    assert server.store.input_path(job_id, 0).read_bytes() == body
+
+
+def test_uploads_over_the_limit_are_rejected(server, monkeypatch):
+    monkeypatch.setattr(config, "MAX_UPLOAD_BYTES", 1000)
+    token = server.issue_token()
+    job_id = create_job(server, token)
+    assert request(server, "PUT", f"/jobs/{job_id}/items/0", b"x" * 1001, token=token)[0] == 413
+    assert not server.store.input_path(job_id, 0).exists()
+    assert request(server, "PUT", f"/jobs/{job_id}/items/0", b"x" * 1000, token=token)[0] == 204
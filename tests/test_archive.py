@@ -0,0 +1,57 @@
+import io
+import zipfile
+
+from watermark.archive import write_archive
+from watermark.jobs import JobStore, Task
+
+
+class Unseekable(io.RawIOBase):
+    """模擬 HTTP 回應的 socket：只能往後寫，不能 seek 或 tell。"""
+
+    def __init__(self):
+        self.buf = io.BytesIO()
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        return self.buf.write(data)
+
+    def seekable(self):
+        return False
+
+    def tell(self):
+        raise OSError("unseekable")
+
+
+def test_streams_a_readable_zip_to_an_unseekable_socket(tmp_path):
+    store = JobStore(tmp_path)
+    items = [("photo", "image/png"), ("photo", "image/png"), ("scan", "image/bmp"), ("broken", "image/png")]
+    job_id = store.create_job("session", "gemini", items)
+    store._execute("UPDATE jobs SET status = 'running' WHERE id = ?", (job_id,))
+    png, bmp = b"\x89PNG" + bytes(4096), b"BM" + bytes(4096)
+    for idx, data, mime in ((0, png, "image/png"), (1, png, "image/png"), (2, bmp, "image/bmp")):
+        store.complete_item(Task(job_id, idx, items[idx][0], items[idx][1], "gemini", None), data, mime, False)
+    store.fail_item(Task(job_id, 3, "broken", "image/png", "gemini", None), 500, "failed")
+
+    out = Unseekable()
+    assert write_archive(store, job_id, out, poll_interval=0) == 3
+
+    with zipfile.ZipFile(io.BytesIO(out.buf.getvalue())) as zf:
+        assert zf.testzip() is None
+        entries = {info.filename: info for info in zf.infolist()}
+        assert sorted(entries) == ["photo_Clean (1).png", "photo_Clean.png", "scan_Clean.bmp"]
+        assert zf.read("photo_Clean.png") == png
+        assert zf.read("scan_Clean.bmp") == bmp
+        # 已壓縮的格式直接存放，其他格式才壓縮
+        assert entries["photo_Clean.png"].compress_type == zipfile.ZIP_STORED
+        assert entries["scan_Clean.bmp"].compress_type == zipfile.ZIP_DEFLATED
+        assert entries["scan_Clean.bmp"].compress_size < len(bmp)
+        # 無法回頭補寫檔頭，大小改記在每個檔案後面的 data descriptor
+        assert all(info.flag_bits & 0x08 for info in entries.values())
+
+
+def test_missing_job_writes_an_empty_archive(tmp_path):
+    out = io.BytesIO()
+    assert write_archive(JobStore(tmp_path), "missing", out, poll_interval=0) == 0
+    assert zipfile.ZipFile(out).namelist() == []
@@ -0,0 +1,93 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from watermark.cache import ResultCache, cache_key
+
+
+def test_cache_key_depends_on_model_prompt_and_image():
+    base = cache_key(b"image", "prompt", "model")
+    assert base == cache_key(b"image", "prompt", "model")
+    assert len({base, cache_key(b"other", "prompt", "model"), cache_key(b"image", "other", "model"),
+                cache_key(b"image", "prompt", "other")}) == 4
+    # 欄位之間有分隔，不會因為串接而相撞
+    assert cache_key(b"image", "ab", "c") != cache_key(b"image", "b", "ca")
+
+
+def test_put_then_get_round_trips_data_and_mime_type(tmp_path):
+    cache = ResultCache(tmp_path, 1024)
+    cache.put("a", b"png-bytes", "image/png")
+    cache.put("b", b"jpeg-bytes", "image/jpeg")
+    assert cache.get("a") == (b"png-bytes", "image/png")
+    assert cache.get("b") == (b"jpeg-bytes", "image/jpeg")
+    assert cache.get("missing") is None
+
+
+def test_evicts_least_recently_used_first(tmp_path):
+    cache = ResultCache(tmp_path, 10)
+    cache.put("a", b"1234", "image/png")
+    cache.put("b", b"1234", "image/png")
+    assert cache.get("a") is not None
+    cache.put("c", b"1234", "image/png")
+    assert cache.get("b") is None
+    assert cache.get("a") is not None
+    assert cache.get("c") is not None
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["a.png", "c.png"]
+
+
+def test_overwriting_a_key_updates_size_and_format(tmp_path):
+    cache = ResultCache(tmp_path, 10)
+    cache.put("a", b"12345678", "image/png")
+    cache.put("a", b"12", "image/jpeg")
+    cache.put("b", b"12345678", "image/png")
+    assert cache.get("a") == (b"12", "image/jpeg")
+    assert not (tmp_path / "a.png").exists()
+
+
+def test_keeps_newest_entry_even_when_larger_than_capacity(tmp_path):
+    cache = ResultCache(tmp_path, 4)
+    cache.put("a", b"12", "image/png")
+    cache.put("big", b"123456789", "image/png")
+    assert cache.get("a") is None
+    assert cache.get("big") == (b"123456789", "image/png")
+
+
+def test_restart_keeps_lru_order_from_mtime(tmp_path):
+    cache = ResultCache(tmp_path, 100)
+    cache.put("old", b"1234", "image/png")
+    cache.put("new", b"1234", "image/png")
+    os.utime(tmp_path / "old.png", (1, 1))
+    reopened = ResultCache(tmp_path, 6)
+    assert reopened.get("old") is None
+    assert reopened.get("new") == (b"1234", "image/png")
+
+
+def test_concurrent_writers_of_one_key_do_not_collide(tmp_path):
+    cache = ResultCache(tmp_path, 1 << 20)
+
+    def write(n):
+        for _ in range(100):
+            cache.put("same", b"x" * (n + 1), "image/png")
+
+    with ThreadPoolExecutor(4) as pool:
+        list(pool.map(write, range(4)))
+    assert cache.get("same")[0] in {b"x" * (n + 1) for n in range(4)}
+    assert [p.name for p in tmp_path.iterdir()] == ["same.png"]
+
+
+def test_failed_write_is_not_raised(tmp_path, monkeypatch):
+    cache = ResultCache(tmp_path, 1024)
+
+    def fail(src, dst):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(os, "replace", fail)
+    cache.put("a", b"data", "image/png")
+    assert cache.get("a") is None
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_contains_reports_existing_keys(tmp_path):
+    cache = ResultCache(tmp_path, 1024)
+    cache.put("a", b"", "application/octet-stream")
+    assert cache.contains("a")
+    assert not cache.contains("b")
@@ -0,0 +1,15 @@
+from watermark import cli
+
+
+class BrokenPipeline:
+    def process(self, *args):
+        raise ValueError("unexpected")
+
+
+def test_process_file_records_unexpected_errors(tmp_path):
+    src = tmp_path / "photo.png"
+    src.write_bytes(b"not really a png")
+    record = cli.process_file(BrokenPipeline(), src, tmp_path / "out" / "photo", "gemini", {})
+    assert record["status"] == "error"
+    assert record["error"] == "ValueError: unexpected"
+    assert record["input"] == str(src)
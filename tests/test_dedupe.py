@@ -0,0 +1,39 @@
+import cv2
+import numpy as np
+
+from watermark import dedupe, preprocess
+
+
+def scene() -> np.ndarray:
+    rng = np.random.default_rng(3)
+    cells = rng.integers(0, 256, (6, 8, 3), dtype=np.uint8)
+    rgb = cv2.resize(cells, (640, 480), interpolation=cv2.INTER_NEAREST)
+    cv2.circle(rgb, (320, 240), 90, (250, 200, 40), -1)
+    return rgb
+
+
+def prints(*images: np.ndarray) -> list[dedupe.Fingerprint]:
+    result = []
+    for index, rgb in enumerate(images):
+        thumb = preprocess.resize(rgb, *preprocess.fit(rgb.shape[1], rgb.shape[0], 320))
+        result.append(dedupe.fingerprint(index, thumb, rgb.shape[0] * rgb.shape[1]))
+    return result
+
+
+def test_resaved_copy_is_grouped():
+    original = scene()
+    ok, jpeg = cv2.imencode(".jpg", cv2.resize(original, (480, 360), interpolation=cv2.INTER_AREA),
+                            [cv2.IMWRITE_JPEG_QUALITY, 80])
+    assert ok
+    copy = cv2.imdecode(jpeg, cv2.IMREAD_UNCHANGED)
+    assert dedupe.group(prints(original, copy), 6) == {1: 0}
+
+
+def test_colour_variants_are_not_grouped():
+    original = scene()
+    gray = np.repeat(cv2.cvtColor(original, cv2.COLOR_RGB2GRAY)[..., None], 3, axis=2)
+    tinted = np.clip(original.astype(np.int16) + (40, 0, -40), 0, 255).astype(np.uint8)
+    fps = prints(original, gray, tinted)
+    # 灰階雜湊相同，只有顏色不同
+    assert dedupe.hamming(fps[0].phash, fps[1].phash) <= 6
+    assert dedupe.group(fps, 6) == {}
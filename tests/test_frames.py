@@ -0,0 +1,61 @@
+import cv2
+import numpy as np
+import pytest
+from PIL import Image
+
+from watermark import config, frames
+
+
+def clip(count: int = 3) -> list[frames.Frame]:
+    return [(np.full((24, 32, 3), 40 * n, dtype=np.uint8), 80) for n in range(count)]
+
+
+@pytest.mark.parametrize("mime_type", sorted(frames.ANIMATION_FORMATS))
+def test_write_animation_keeps_every_frame(tmp_path, mime_type):
+    target = tmp_path / "out"
+    frames.write_animation(iter(clip()), target, mime_type, 0)
+    with Image.open(target) as img:
+        assert img.n_frames == 3
+        img.seek(2)
+        img.load()
+        assert img.info["duration"] == 80
+
+
+def test_process_clip_rejects_animations_too_large_to_encode(tmp_path, monkeypatch):
+    source = tmp_path / "in.gif"
+    head, *rest = [Image.fromarray(rgb) for rgb, _ in clip()]
+    head.save(source, "GIF", save_all=True, append_images=rest)
+    monkeypatch.setattr(config, "MAX_ANIMATION_BYTES", 24 * 32 * 3)
+    with pytest.raises(ValueError, match="too large"):
+        frames.process_clip(source, tmp_path / "out", "image/gif", clean=lambda crops, crop_mask: crops)
+
+
+def watermarked_webp(path, positions: list[tuple[int, int]]) -> None:
+    rng = np.random.default_rng(1)
+    images = []
+    for at in positions:
+        coarse = rng.uniform(0, 255, (6, 8, 3)).astype(np.float32)
+        rgb = cv2.resize(coarse, (320, 240), interpolation=cv2.INTER_CUBIC).clip(0, 255).astype(np.uint8)
+        cv2.putText(rgb, "LOGO", at, cv2.FONT_HERSHEY_SIMPLEX, 1.2, (255, 255, 255), 3)
+        images.append(Image.fromarray(rgb))
+    images[0].save(path, "WEBP", save_all=True, append_images=images[1:], duration=50, quality=95)
+
+
+def test_masks_are_re_estimated_per_segment(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "MASK_SEGMENT_FRAMES", 24)
+    source = tmp_path / "in.webp"
+    watermarked_webp(source, [(16, 50)] * 24 + [(170, 220)] * 24)
+    masks = frames.estimate_masks(source, "image/webp", frames.probe(source, "image/webp"))
+    assert len(masks) == 2
+    assert masks[0].box[0] < 0.5 and masks[0].box[1] < 0.5
+    assert masks[1].box[0] > 0.5 and masks[1].box[1] > 0.5
+    result = frames.process_clip(source, tmp_path / "out", "image/webp", clean=lambda crops, crop_mask: crops)
+    assert result.masks == 2
+
+
+def test_static_watermark_keeps_one_mask_across_segments(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "MASK_SEGMENT_FRAMES", 24)
+    source = tmp_path / "in.webp"
+    watermarked_webp(source, [(16, 50)] * 48)
+    result = frames.process_clip(source, tmp_path / "out", "image/webp", clean=lambda crops, crop_mask: crops)
+    assert result.masks == 1
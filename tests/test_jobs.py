@@ -0,0 +1,102 @@
+import sqlite3
+import time
+
+from watermark.jobs import JobStore, JobWorker
+from watermark.pipeline import Result
+
+
+def make_job(store, status, age_hours, item_status="pending"):
+    job_id = store.create_job("session", "gemini", [("a.png", "image/png")])
+    store._execute("UPDATE jobs SET status = ?, created_at = ? WHERE id = ?",
+                   (status, time.time() - age_hours * 3600, job_id))
+    store._execute("UPDATE items SET status = ? WHERE job_id = ?", (item_status, job_id))
+    return job_id
+
+
+def test_purge_keeps_unfinished_jobs(tmp_path):
+    store = JobStore(tmp_path)
+    queued = make_job(store, "queued", 48)
+    preparing = make_job(store, "preparing", 48)
+    running = make_job(store, "running", 48, "running")
+    finished = make_job(store, "running", 48, "done")
+    abandoned = make_job(store, "uploading", 48)
+    recent = make_job(store, "running", 1, "done")
+
+    store.purge(24)
+
+    for job_id in (queued, preparing, running, recent):
+        assert store.get_job(job_id) is not None
+        assert (tmp_path / job_id).exists()
+    for job_id in (finished, abandoned):
+        assert store.get_job(job_id) is None
+        assert not (tmp_path / job_id).exists()
+
+
+def test_retry_item_only_restarts_finished_items(tmp_path):
+    store = JobStore(tmp_path)
+    job_id = make_job(store, "running", 0, "running")
+    assert not store.retry_item(job_id, 0)
+    store._execute("UPDATE items SET status = 'error' WHERE job_id = ?", (job_id,))
+    assert store.retry_item(job_id, 0)
+    assert store.get_job(job_id)["items"][0]["status"] == "pending"
+
+
+def test_claim_queued_job_prefers_sessions_not_already_preparing(tmp_path):
+    store = JobStore(tmp_path)
+    big = [store.create_job("big", "gemini", [("a.png", "image/png")]) for _ in range(2)]
+    small = store.create_job("small", "gemini", [("b.png", "image/png")])
+    for job_id in (*big, small):
+        store._execute("UPDATE jobs SET status = 'queued' WHERE id = ?", (job_id,))
+
+    assert store.claim_queued_job() == big[0]
+    assert store.claim_queued_job() == small
+    assert store.claim_queued_job() == big[1]
+    assert store.claim_queued_job() is None
+
+
+class FakePipeline:
+    def process(self, data, mime_type, engine, shared):
+        return Result(b"out", "image/png")
+
+
+def test_unexpected_errors_fail_the_item_instead_of_leaving_it_running(tmp_path, monkeypatch):
+    store = JobStore(tmp_path)
+    job_id = make_job(store, "running", 0)
+    store.save_input(job_id, 0, b"image")
+    task = store.claim_item("session")
+    worker = JobWorker(store, FakePipeline(), threads=1, claim=lambda: None)
+
+    def broken(*args):
+        raise sqlite3.OperationalError("database is locked")
+
+    monkeypatch.setattr(store, "complete_item", broken)
+    worker._run(task)
+    item = store.get_job(job_id)["items"][0]
+    assert (item["status"], item["errorStatus"]) == ("error", 500)
+
+
+def test_failed_duplicate_reuse_does_not_block_other_duplicates(tmp_path):
+    store = JobStore(tmp_path)
+    job_id = store.create_job("session", "gemini", [(f"{n}.png", "image/png") for n in range(3)])
+    store._execute("UPDATE jobs SET status = 'running' WHERE id = ?", (job_id,))
+    store.set_duplicates(job_id, {1: 0, 2: 0})
+    for idx in (0, 2):  # 1 號的原圖不見了
+        store.save_input(job_id, idx, b"image")
+
+    class ReusingPipeline(FakePipeline):
+        def reuse(self, result, data, mime_type):
+            return Result(result.data, mime_type, cached=True)
+
+    worker = JobWorker(store, ReusingPipeline(), threads=1, claim=lambda: None)
+    worker._run(store.claim_item("session"))
+    items = store.get_job(job_id)["items"]
+    assert [i["status"] for i in items] == ["done", "error", "done"]
+    assert items[1]["errorStatus"] == 500
+
+
+def test_stop_waits_for_background_threads(tmp_path):
+    store = JobStore(tmp_path)
+    worker = JobWorker(store, FakePipeline(), threads=2, claim=lambda: None, prepare_threads=2).start()
+    worker.stop(timeout=5)
+    assert not any(thread.is_alive() for thread in worker._threads)
+    store.close()
@@ -0,0 +1,57 @@
+import io
+
+import numpy as np
+from PIL import Image
+
+from watermark.output import EXIF_ORIENTATION, encode_output, jpeg_quality, target_mime
+
+
+def image_bytes(fmt, size=(64, 48), **params):
+    rng = np.random.default_rng(0)
+    img = Image.fromarray(rng.integers(0, 256, (size[1], size[0], 3), dtype=np.uint8))
+    buf = io.BytesIO()
+    img.save(buf, fmt, **params)
+    return buf.getvalue()
+
+
+def test_target_mime_keeps_supported_sources_and_falls_back_to_png():
+    assert target_mime("image/jpeg", "source") == "image/jpeg"
+    assert target_mime("image/bmp", "source") == "image/png"
+    assert target_mime("image/png", "jpg") == "image/jpeg"
+
+
+def test_jpeg_quality_estimates_the_source_quality():
+    for quality in (50, 75, 95):
+        with Image.open(io.BytesIO(image_bytes("JPEG", quality=quality))) as img:
+            assert abs(jpeg_quality(img) - quality) <= 1
+    with Image.open(io.BytesIO(image_bytes("PNG"))) as img:
+        assert jpeg_quality(img) is None
+
+
+def test_jpeg_output_reuses_source_quality():
+    source = image_bytes("JPEG", quality=60)
+    out = encode_output(image_bytes("PNG"), source, "image/jpeg")
+    with Image.open(io.BytesIO(out)) as img:
+        assert img.format == "JPEG"
+        assert abs(jpeg_quality(img) - 60) <= 1
+
+
+def test_exif_is_kept_but_orientation_is_reset():
+    exif = Image.Exif()
+    exif[EXIF_ORIENTATION] = 6
+    exif[0x010F] = "Camera"  # Make
+    source = image_bytes("JPEG", exif=exif.tobytes())
+    # 結果已經轉正過 (寬高互換)
+    out = encode_output(image_bytes("PNG", size=(48, 64)), source, "image/jpeg")
+    with Image.open(io.BytesIO(out)) as img:
+        assert img.size == (48, 64)
+        kept = img.getexif()
+        assert kept[EXIF_ORIENTATION] == 1
+        assert kept[0x010F] == "Camera"
+
+
+def test_composite_output_has_the_source_resolution():
+    source = image_bytes("PNG", size=(400, 300))
+    out = encode_output(image_bytes("PNG", size=(200, 150)), source, "image/png", composite=True)
+    with Image.open(io.BytesIO(out)) as img:
+        assert (img.format, img.size) == ("PNG", (400, 300))
@@ -0,0 +1,104 @@
+import base64
+from concurrent.futures import Future
+
+import pytest
+
+from watermark import config, local_engine
+from watermark.cache import ResultCache
+from watermark.pipeline import ModelError, Pipeline, Result
+from watermark.ratelimit import RateController
+
+
+@pytest.fixture
+def pipeline(tmp_path):
+    return Pipeline("key", ResultCache(tmp_path, 1 << 20), local_pool=None, limiter=RateController(6000, 10, 2))
+
+
+def test_generate_calls_once_when_retries_disabled(pipeline, monkeypatch):
+    monkeypatch.setattr(config, "MAX_RETRIES", 0)
+    calls = []
+
+    def call(payload):
+        calls.append(payload)
+        return {"data": base64.b64encode(b"out").decode(), "mimeType": "image/png"}
+
+    monkeypatch.setattr(pipeline, "_call", call)
+    result = pipeline._generate(b"image", "image/png")
+    assert (result.data, result.mime_type, len(calls)) == (b"out", "image/png", 1)
+
+
+def test_generate_raises_model_error_when_retries_disabled(pipeline, monkeypatch):
+    monkeypatch.setattr(config, "MAX_RETRIES", 0)
+
+    def call(payload):
+        raise ModelError(503, {"error": {"message": "unavailable"}})
+
+    monkeypatch.setattr(pipeline, "_call", call)
+    with pytest.raises(ModelError, match="unavailable"):
+        pipeline._generate(b"image", "image/png")
+
+
+def test_generate_uses_cache_before_calling(pipeline, monkeypatch):
+    monkeypatch.setattr(pipeline, "_call", lambda payload: {"data": base64.b64encode(b"out").decode()})
+    pipeline._generate(b"image", "image/png")
+    monkeypatch.setattr(pipeline, "_call", lambda payload: pytest.fail("should hit the cache"))
+    assert pipeline._generate(b"image", "image/png").cached
+
+
+
+class InlinePool:
+    def submit(self, fn, *args):
+        future = Future()
+        try:
+            future.set_result(fn(*args))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+
+@pytest.fixture
+def verifying(pipeline, monkeypatch):
+    """_clean 依序回傳 outputs，score_image 依 scores 對照表評分；回傳每次 _clean 的 refresh 參數。"""
+    pipeline.local_pool = InlinePool()
+    calls, outputs, scores = [], [], {}
+
+    def clean(image, mime_type, engine, mask=None, refresh=False):
+        calls.append(refresh)
+        return Result(outputs.pop(0), "image/png", cached=not refresh)
+
+    def score(data):
+        if isinstance(scores[data], Exception):
+            raise scores[data]
+        return scores[data]
+
+    monkeypatch.setattr(pipeline, "_clean", clean)
+    monkeypatch.setattr(pipeline, "_encode", lambda result, image, mime_type: result)
+    monkeypatch.setattr(local_engine, "score_image", score)
+    monkeypatch.setattr(config, "VERIFY_RETRIES", 1)
+    return calls, outputs, scores
+
+
+def test_process_regenerates_cached_results_that_still_show_a_watermark(pipeline, verifying):
+    calls, outputs, scores = verifying
+    outputs += [b"bad", b"good"]
+    scores.update({b"bad": 0.9, b"good": 0.0})
+    assert pipeline.process(b"image", "image/png").data == b"good"
+    assert calls == [False, True]
+
+
+def test_process_does_not_recheck_verified_results(pipeline, verifying):
+    calls, outputs, scores = verifying
+    outputs += [b"good", b"good"]
+    scores[b"good"] = 0.0
+    pipeline.process(b"image", "image/png")
+    scores[b"good"] = RuntimeError("should not score again")
+    assert pipeline.process(b"image", "image/png").data == b"good"
+    assert calls == [False, False]
+
+
+def test_process_regenerates_undecodable_results(pipeline, verifying):
+    calls, outputs, scores = verifying
+    outputs += [b"broken", b"good"]
+    scores.update({b"broken": OSError("cannot identify image file"), b"good": 0.0})
+    assert pipeline.process(b"image", "image/png").data == b"good"
+    assert calls == [False, True]
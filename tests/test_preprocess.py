@@ -0,0 +1,57 @@
+import numpy as np
+
+from watermark.preprocess import Box, Plan, assemble, composite, resize, tile_boxes
+
+
+def test_small_image_is_a_single_tile():
+    assert tile_boxes(800, 600, 1024, 128) == [Box(0, 0, 800, 600)]
+
+
+def test_tiles_cover_the_image_with_at_least_the_requested_overlap():
+    boxes = tile_boxes(2048, 1500, 1024, 128)
+    xs = sorted({(b.x, b.w) for b in boxes})
+    ys = sorted({(b.y, b.h) for b in boxes})
+    assert len(boxes) == len(xs) * len(ys)
+    for spans, length in ((xs, 2048), (ys, 1500)):
+        assert spans[0][0] == 0
+        assert spans[-1][0] + spans[-1][1] == length
+        assert all(size <= 1024 for _, size in spans)
+        for (a, a_size), (b, _) in zip(spans, spans[1:]):
+            assert a + a_size - b >= 128
+
+
+def test_assemble_blends_identical_tiles_back_to_the_work_image():
+    rng = np.random.default_rng(0)
+    work = rng.integers(0, 256, (300, 500, 3), dtype=np.uint8)
+    plan = Plan(work, tile_boxes(500, 300, 256, 64))
+    assert len(plan.tiles) > 1
+    assert np.array_equal(assemble(plan, plan.parts()), work)
+
+
+def test_assemble_feathers_seams_between_tiles():
+    work = np.zeros((256, 448, 3), np.uint8)
+    plan = Plan(work, tile_boxes(448, 256, 256, 64))
+    assert [b.x for b in plan.tiles] == [0, 192]
+    outputs = [np.zeros((256, 256, 3), np.uint8), np.full((256, 256, 3), 200, np.uint8)]
+    row = assemble(plan, outputs)[128, :, 0].astype(int)
+    overlap = row[192:256]
+    # 重疊區內由左塊線性過渡到右塊，不會出現硬切邊
+    assert row[0] == 0 and row[-1] == 200
+    assert np.all(np.diff(overlap) >= 0)
+    assert 0 < overlap[0] < overlap[-1] < 200
+
+
+def test_composite_keeps_untouched_detail_and_applies_the_edit():
+    rng = np.random.default_rng(1)
+    original = rng.integers(40, 216, (400, 600, 3), dtype=np.uint8)
+    work = resize(original, 300, 200)
+    cleaned = work.copy()
+    cleaned[50:100, 100:200] = 255
+
+    merged = composite(original, cleaned)
+    assert merged.shape == original.shape
+    # 未修改的區域保留原尺寸細節，而不是縮圖再放大的模糊結果
+    assert np.abs(merged[300:, 400:].astype(int) - original[300:, 400:]).max() <= 2
+    # 修改區域的修改量放大回原尺寸疊加 (原圖平均約 128，修改後接近 255)
+    assert merged[110:190, 210:390].mean() > 230
+    assert original[110:190, 210:390].mean() < 140
@@ -0,0 +1,99 @@
+import pytest
+
+from watermark import ratelimit
+from watermark.ratelimit import RateController, TokenBucket, backoff_delay, retry_after_seconds
+
+
+class FakeClock:
+    """取代 ratelimit 模組的 time.monotonic / time.sleep，sleep 只推進時間。"""
+
+    def __init__(self):
+        self.now = 1000.0
+        self.slept = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(ratelimit.time, "monotonic", fake.monotonic)
+    monkeypatch.setattr(ratelimit.time, "sleep", fake.sleep)
+    return fake
+
+
+def test_bucket_allows_burst_then_paces_at_rate(clock):
+    bucket = TokenBucket(rate_per_minute=60, capacity=3)
+    for _ in range(3):
+        bucket.take()
+    assert clock.slept == []
+    bucket.take()
+    assert clock.slept == [pytest.approx(1.0)]
+
+
+def test_bucket_refills_up_to_capacity(clock):
+    bucket = TokenBucket(rate_per_minute=60, capacity=2)
+    bucket.take()
+    bucket.take()
+    clock.now += 60
+    bucket.take()
+    bucket.take()
+    assert clock.slept == []
+    assert bucket.tokens == pytest.approx(0)
+
+
+def test_throttle_halves_limit_once_per_cooldown(clock):
+    limiter = RateController(600, 4, max_concurrency=8)
+    limiter.on_throttle(5)
+    assert limiter.limit == 4
+    limiter.on_throttle(5)
+    assert limiter.limit == 4
+    assert limiter.cooldown_until == pytest.approx(clock.now + 5)
+    clock.now += 6
+    limiter.on_throttle(5)
+    assert limiter.limit == 2
+
+
+def test_throttle_never_drops_below_one(clock):
+    limiter = RateController(600, 4, max_concurrency=1)
+    limiter.on_throttle(1)
+    assert limiter.limit == 1
+
+
+def test_success_increases_additively_up_to_max(clock):
+    limiter = RateController(600, 4, max_concurrency=4)
+    limiter.on_throttle(1)
+    assert limiter.limit == 2
+    limiter.on_success()
+    assert limiter.limit == pytest.approx(2.5)
+    for _ in range(20):
+        limiter.on_success()
+    assert limiter.limit == 4
+
+
+def test_slot_waits_out_cooldown_and_tracks_in_flight(clock):
+    limiter = RateController(600, 4, max_concurrency=2)
+    limiter.on_throttle(3)
+    with limiter.slot():
+        assert limiter.in_flight == 1
+        assert sum(clock.slept) == pytest.approx(3)
+    assert limiter.in_flight == 0
+
+
+def test_backoff_delay_is_jittered_within_bounds():
+    for attempt in range(8):
+        cap = min(ratelimit.BACKOFF_MAX, ratelimit.BACKOFF_BASE * 2 ** attempt)
+        assert cap / 2 <= backoff_delay(attempt) <= cap
+
+
+def test_retry_after_seconds_reads_header_and_retry_info():
+    assert retry_after_seconds("7", {}) == 7
+    assert retry_after_seconds("Wed, 21 Oct 2015 07:28:00 GMT", {}) == 0
+    data = {"error": {"details": [{"@type": "type.googleapis.com/google.rpc.RetryInfo", "retryDelay": "12s"}]}}
+    assert retry_after_seconds(None, data) == 12
+    assert retry_after_seconds(None, {}) is None
@@ -0,0 +1,48 @@
+from watermark.jobs import JobStore
+from watermark.scheduler import FairScheduler
+
+
+def add_job(store, session, count):
+    job_id = store.create_job(session, "gemini", [(f"{n}.png", "image/png") for n in range(count)])
+    store._execute("UPDATE jobs SET status = 'running' WHERE id = ?", (job_id,))
+    return job_id
+
+
+def sessions_of(store, tasks):
+    owners = {r["id"]: r["session"] for r in store._query("SELECT id, session FROM jobs")}
+    return [owners[task.job_id] for task in tasks]
+
+
+def test_sessions_are_interleaved_instead_of_first_come_first_served(tmp_path):
+    store = JobStore(tmp_path)
+    add_job(store, "a", 4)
+    add_job(store, "b", 2)
+    scheduler = FairScheduler(store, max_running=10)
+    tasks = [scheduler.claim() for _ in range(6)]
+    assert sessions_of(store, tasks) == ["a", "b", "a", "b", "a", "a"]
+    assert scheduler.claim() is None
+
+
+def test_weights_scale_each_sessions_share(tmp_path):
+    store = JobStore(tmp_path)
+    add_job(store, "a", 10)
+    add_job(store, "b", 10)
+    scheduler = FairScheduler(store, weights={"a": 2.0}, max_running=10)
+    claimed = sessions_of(store, [scheduler.claim() for _ in range(6)])
+    assert (claimed.count("a"), claimed.count("b")) == (4, 2)
+
+
+def test_running_cap_yields_to_other_waiting_sessions(tmp_path):
+    store = JobStore(tmp_path)
+    add_job(store, "a", 5)
+    add_job(store, "b", 5)
+    # a 的權重大得多，沒有上限時會連續拿到好幾張
+    scheduler = FairScheduler(store, weights={"a": 100.0}, max_running=1)
+    assert sessions_of(store, [scheduler.claim(), scheduler.claim()]) == ["a", "b"]
+
+
+def test_running_cap_does_not_idle_a_lone_session(tmp_path):
+    store = JobStore(tmp_path)
+    add_job(store, "a", 3)
+    scheduler = FairScheduler(store, max_running=1)
+    assert sessions_of(store, [scheduler.claim() for _ in range(3)]) == ["a", "a", "a"]
@@ -0,0 +1 @@
+"""AI 去浮水印的伺服器端模組 (快取、API 服務等)。"""
@@ -0,0 +1,310 @@
+"""給瀏覽器端元件呼叫的內部 HTTP API。
+
+Streamlit 無法自訂路由，因此在同一個程序內另開一個執行緒跑 HTTP 服務，
+API Key 也因此只留在伺服器端。服務只綁在本機，瀏覽器經由 watermark.gateway 以同源的 /api/ 呼叫；
+每個請求都要帶 app.py 發給該 Streamlit session 的權杖 (X-Session-Token 標頭，下載連結用 ?token=)，
+否則回 401。批次以工作 (job) 的形式交給背景執行緒處理：
+
+    POST /detect                        串接的縮圖 + X-Image-Sizes: 各張位元組數 → {scores, watermarked} (預先勾選用)
+    POST /jobs                          {engine, items: [{name, mimeType}]} → {jobId} (公平排程的 session 取自權杖)
+    PUT  /jobs/<id>/items/<n>           原圖的二進位內容 (不經 base64，上傳量少約 1/3；上限 MAX_UPLOAD_BYTES)
+    POST /jobs/<id>/start               全部上傳後開始處理
+    GET  /jobs/<id>                     工作與各項目狀態
+    GET  /jobs/<id>/items/<n>/result    處理結果 (圖片)
+    GET  /jobs/<id>/archive             所有結果的 ZIP (串流，處理中會持續送出)
+    GET  /metrics                       Prometheus 文字格式的處理統計 (不需權杖)
+    POST /metrics/client                {spans: {stage: [秒...]}} 瀏覽器端各階段耗時
+    POST /jobs/<id>/items/<n>/retry     重新處理單張
+"""
+
+import hashlib
+import hmac
+import json
+import logging
+import re
+import secrets
+import shutil
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from . import config, metrics
+from .archive import ARCHIVE_NAME, CHUNK_SIZE, write_archive
+from .jobs import JobStore, JobWorker
+from .pipeline import ENGINES, create_pipeline
+from .ratelimit import RateController
+from .scheduler import FairScheduler
+
+log = logging.getLogger(__name__)
+
+
+class RequestError(Exception):
+    """請求本身不合格 (例如本文過大)；本文可能沒讀完，回應後關閉連線。"""
+
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+ROUTES = [
+    ("POST", re.compile(r"/detect"), "_detect"),
+    ("POST", re.compile(r"/jobs"), "_create_job"),
+    ("PUT", re.compile(r"/jobs/(\w+)/items/(\d+)"), "_upload_item"),
+    ("POST", re.compile(r"/jobs/(\w+)/start"), "_start_job"),
+    ("GET", re.compile(r"/jobs/(\w+)"), "_get_job"),
+    ("GET", re.compile(r"/jobs/(\w+)/items/(\d+)/result"), "_get_result"),
+    ("POST", re.compile(r"/jobs/(\w+)/items/(\d+)/retry"), "_retry_item"),
+    ("GET", re.compile(r"/jobs/(\w+)/archive"), "_get_archive"),
+    ("GET", re.compile(r"/metrics"), "_get_metrics"),
+    ("POST", re.compile(r"/metrics/client"), "_client_metrics"),
+]
+# 不需要權杖的路由：Prometheus 抓取用，只有累計的統計數字
+PUBLIC_ROUTES = frozenset({"_get_metrics"})
+
+
+class ApiServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address: tuple[str, int], store: JobStore, worker: JobWorker):
+        super().__init__(address, ApiHandler)
+        self.store = store
+        self.worker = worker
+        # 簽發權杖的金鑰只存在記憶體，程序重啟後舊權杖一律失效
+        self._secret = secrets.token_bytes(32)
+
+    def _sign(self, nonce: str) -> str:
+        return hmac.new(self._secret, nonce.encode(), hashlib.sha256).hexdigest()
+
+    def issue_token(self, session: str | None = None) -> str:
+        """session 為公平排程用的名稱 (對應 SESSION_WEIGHTS)；未指定時每個權杖各自是一個 session。"""
+        nonce = session or secrets.token_urlsafe(16)
+        return f"{nonce}.{self._sign(nonce)}"
+
+    def token_session(self, token: str) -> str | None:
+        """有效權杖所屬的 session (即簽章過的 nonce)；無效時回傳 None。"""
+        nonce, _, signature = token.rpartition(".")
+        return nonce if nonce and hmac.compare_digest(signature, self._sign(nonce)) else None
+
+
+class ApiHandler(BaseHTTPRequestHandler):
+    server: ApiServer
+    session: str | None = None  # 這個請求的權杖所屬的 session
+
+    def log_message(self, format, *args):
+        log.debug("%s - " + format, self.address_string(), *args)
+
+    def do_OPTIONS(self):
+        self.send_response(204)
+        self._send_cors_headers()
+        self.end_headers()
+
+    def do_GET(self):
+        self._dispatch("GET")
+
+    def do_POST(self):
+        self._dispatch("POST")
+
+    def do_PUT(self):
+        self._dispatch("PUT")
+
+    def _dispatch(self, method: str):
+        url = urlsplit(self.path)
+        for route_method, pattern, handler in ROUTES:
+            match = pattern.fullmatch(url.path)
+            if route_method == method and match:
+                self.session = self._session(url.query)
+                if handler not in PUBLIC_ROUTES and self.session is None:
+                    return self._send_error(401, "Missing or invalid session token")
+                try:
+                    return getattr(self, handler)(*match.groups())
+                except RequestError as e:
+                    self.close_connection = True
+                    return self._send_error(e.status, str(e))
+        self._send_error(404, "Not found")
+
+    def _session(self, query: str) -> str | None:
+        token = self.headers.get("X-Session-Token") or next(iter(parse_qs(query).get("token", [])), "")
+        return self.server.token_session(token)
+
+    def _detect(self):
+        body = self._read_body()
+        try:
+            sizes = [int(n) for n in self.headers.get("X-Image-Sizes", "").split(",")]
+        except ValueError:
+            return self._send_error(400, "Invalid X-Image-Sizes header")
+        if any(n <= 0 for n in sizes) or sum(sizes) != len(body):
+            return self._send_error(400, "Image sizes do not match the body")
+        images, start = [], 0
+        for n in sizes:
+            images.append(body[start:start + n])
+            start += n
+        scores = self.server.worker.pipeline.detect(images)
+        self._send_json(200, {
+            "scores": scores,
+            "watermarked": [s is None or s >= config.WATERMARK_THRESHOLD for s in scores],
+        })
+
+    def _create_job(self):
+        try:
+            body = self._read_json()
+            engine = body.get("engine") or "gemini"
+            items = [(str(i["name"]), str(i.get("mimeType") or "image/png")) for i in body["items"]]
+        except (ValueError, KeyError, TypeError):
+            return self._send_error(400, "Invalid job payload")
+        if engine not in ENGINES:
+            return self._send_error(400, f"Unknown engine: {engine}")
+        if not items:
+            return self._send_error(400, "No items")
+        self._send_json(201, {"jobId": self.server.store.create_job(self.session, engine, items)})
+
+    def _upload_item(self, job_id: str, idx: str):
+        # 原圖與影片直接分段寫到磁碟，不整個讀進記憶體
+        length = self._content_length()
+        if not length:
+            return self._send_error(400, "Empty image")
+        try:
+            saved = self.server.store.save_input(job_id, int(idx), self.rfile, length)
+        except ConnectionError as e:
+            log.debug("Upload of %s/%s aborted: %s", job_id, idx, e)
+            self.close_connection = True
+            return
+        if not saved:
+            self.close_connection = True  # 本文沒讀
+            return self._send_error(404, "Unknown job item")
+        self._send_json(204, None)
+
+    def _start_job(self, job_id: str):
+        if not self.server.store.start_job(job_id):
+            return self._send_error(409, "Job is missing uploads")
+        self.server.worker.notify()
+        self._send_json(202, self.server.store.get_job(job_id))
+
+    def _get_job(self, job_id: str):
+        job = self.server.store.get_job(job_id)
+        if job is None:
+            return self._send_error(404, "Unknown job")
+        self._send_json(200, job)
+
+    def _get_result(self, job_id: str, idx: str):
+        found = self.server.store.get_result(job_id, int(idx))
+        if found is None:
+            return self._send_error(404, "Result not ready")
+        path, mime_type = found
+        # 影片可能很大，分段送出而不整個讀進記憶體
+        self.send_response(200)
+        self._send_cors_headers()
+        self.send_header("Content-Type", mime_type)
+        self.send_header("Content-Length", str(path.stat().st_size))
+        self.end_headers()
+        with path.open("rb") as f:
+            shutil.copyfileobj(f, self.wfile, CHUNK_SIZE)
+
+    def _get_archive(self, job_id: str):
+        if self.server.store.get_job(job_id) is None:
+            return self._send_error(404, "Unknown job")
+        # 總大小事先未知：不送 Content-Length，寫完後關閉連線
+        self.send_response(200)
+        self._send_cors_headers()
+        self.send_header("Content-Type", "application/zip")
+        self.send_header("Content-Disposition", f'attachment; filename="{ARCHIVE_NAME}"')
+        self.send_header("Cache-Control", "no-store")
+        self.end_headers()
+        self.close_connection = True
+        try:
+            write_archive(self.server.store, job_id, self.wfile)
+        except (BrokenPipeError, ConnectionResetError):
+            log.debug("Archive download for %s cancelled", job_id)
+
+    def _retry_item(self, job_id: str, idx: str):
+        if not self.server.store.retry_item(job_id, int(idx)):
+            return self._send_error(409, "Item is not finished")
+        self.server.worker.notify()
+        self._send_json(202, None)
+
+    def _get_metrics(self):
+        body = metrics.render().encode()
+        self.send_response(200)
+        self._send_cors_headers()
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _client_metrics(self):
+        try:
+            metrics.record_client_spans(self._read_json()["spans"])
+        except (ValueError, KeyError, TypeError, AttributeError):
+            return self._send_error(400, "Invalid spans payload")
+        self._send_json(204, None)
+
+    def _content_length(self) -> int:
+        try:
+            length = int(self.headers.get("Content-Length") or 0)
+        except ValueError:
+            raise RequestError(400, "Invalid Content-Length") from None
+        if length < 0:
+            raise RequestError(400, "Invalid Content-Length")
+        if length > config.MAX_UPLOAD_BYTES:
+            raise RequestError(413, f"Request body exceeds {config.MAX_UPLOAD_BYTES} bytes")
+        return length
+
+    def _read_body(self) -> bytes:
+        return self.rfile.read(self._content_length())
+
+    def _read_json(self) -> dict:
+        """只接受 JSON 物件；其他型別 (陣列、字串...) 與格式錯誤一樣丟出 ValueError，由呼叫端回 400。"""
+        body = json.loads(self._read_body())
+        if not isinstance(body, dict):
+            raise ValueError("JSON body must be an object")
+        return body
+
+    def _send_cors_headers(self):
+        # 經由 gateway 同源呼叫時不需要 CORS；只有明確列在 API_ALLOWED_ORIGINS 的來源可以跨來源呼叫
+        origin = self.headers.get("Origin")
+        if origin not in config.API_ALLOWED_ORIGINS:
+            return
+        self.send_header("Access-Control-Allow-Origin", origin)
+        self.send_header("Vary", "Origin")
+        self.send_header("Access-Control-Allow-Methods", "GET, POST, PUT, OPTIONS")
+        self.send_header("Access-Control-Allow-Headers", "Content-Type, X-Image-Sizes, X-Session-Token")
+
+    def _send_error(self, status: int, message: str):
+        self._send_json(status, {"error": {"message": message}})
+
+    def _send_json(self, status: int, obj):
+        body = json.dumps(obj).encode() if obj is not None else b""
+        self.send_response(status)
+        self._send_cors_headers()
+        if body:
+            self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def register_gauges(store: JobStore, limiter: RateController) -> None:
+    def queue() -> dict:
+        backlog = store.session_backlog().values()
+        return {(("status", "pending"),): sum(p for p, _ in backlog), (("status", "running"),): sum(r for _, r in backlog)}
+
+    metrics.register_gauge("watermark_queue_items", "Images waiting or being processed.", queue)
+    metrics.register_gauge("watermark_queue_sessions", "Sessions with images waiting.",
+                           lambda: {(): sum(1 for p, _ in store.session_backlog().values() if p)})
+    metrics.register_gauge("watermark_gemini_concurrency_limit", "Current AIMD concurrency limit.",
+                           lambda: {(): limiter.limit})
+    metrics.register_gauge("watermark_gemini_in_flight", "Gemini requests in flight.",
+                           lambda: {(): limiter.in_flight})
+
+
+def start_api_server(api_key: str) -> ApiServer:
+    # 所有使用者共用同一組處理執行緒、Gemini 速率控制與公平排程
+    limiter = RateController(config.RATE_LIMIT_RPM, config.RATE_LIMIT_BURST, config.MAX_CONCURRENCY)
+    store = JobStore(config.JOBS_DIR)
+    scheduler = FairScheduler(store, config.SESSION_WEIGHTS)
+    register_gauges(store, limiter)
+    worker = JobWorker(store, create_pipeline(api_key, limiter), config.WORKER_THREADS, scheduler.claim,
+                       config.PREPARE_THREADS).start()
+    server = ApiServer((config.API_HOST, config.API_PORT), store, worker)
+    threading.Thread(target=server.serve_forever, name="api-server", daemon=True).start()
+    log.info("API server listening on %s:%s", config.API_HOST, config.API_PORT)
+    return server
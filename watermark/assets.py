@@ -0,0 +1,75 @@
+"""前端元件的靜態資源：把 static/ 內的 HTML、CSS、JS 組成 components.html 使用的單一頁面。
+
+components.html 以 srcdoc iframe 載入，無法用相對路徑引用檔案，因此 CSS 與 JS 一律內嵌。
+Tailwind 使用預先產生的 tailwind.css，不再於瀏覽器端下載並執行 cdn.tailwindcss.com 的 JIT 編譯器；
+頁面在每個程序只組一次 (app.py 以 st.cache_resource 快取)。
+
+    python -m watermark.assets    # 列出 HTML/JS 用到、但 CSS 尚未定義的 class
+"""
+
+import json
+import re
+import sys
+from pathlib import Path
+
+STATIC_DIR = Path(__file__).parent / "static"
+STYLESHEETS = ("tailwind.css", "app.css")
+
+_CLASS_ATTR = re.compile(r"""class(?:Name)?\s*=\s*["'`]([^"'`]*)["'`]""")
+_CLASS_LIST = re.compile(r"classList\.(?:add|remove|toggle|replace)\(([^)]*)\)")
+_QUOTED = re.compile(r"""['"]([^'"]+)['"]""")
+_SELECTOR = re.compile(r"\.((?:\\.|[\w-])+)")
+# 只作為標記、不需要樣式的 class
+MARKER_CLASSES = frozenset({"group"})
+
+
+def read(name: str) -> str:
+    return (STATIC_DIR / name).read_text(encoding="utf-8")
+
+
+def minify_css(css: str) -> str:
+    css = re.sub(r"/\*.*?\*/", "", css, flags=re.S)
+    css = re.sub(r"\s+", " ", css)
+    return re.sub(r"\s*([{}:;,>])\s*", r"\1", css).replace(";}", "}").strip()
+
+
+def minify_markup(text: str) -> str:
+    """去掉縮排與空行；不動行內內容，以免改到 JS 的字串或樣板。"""
+    return "\n".join(line.strip() for line in text.splitlines() if line.strip())
+
+
+def build_html(server_config: dict) -> str:
+    """組出完整頁面；server_config 取代 app.js 開頭的 SERVER_CONFIG。"""
+    css = minify_css("\n".join(read(name) for name in STYLESHEETS))
+    script = read("app.js").replace("const SERVER_CONFIG = {};",
+                                    f"const SERVER_CONFIG = {json.dumps(server_config)};", 1)
+    html = read("index.html")
+    html = html.replace("<style>/* STYLES */</style>", f"<style>{css}</style>")
+    html = html.replace("<script>/* SCRIPT */</script>", f"<script>\n{minify_markup(script)}\n</script>")
+    return minify_markup(html)
+
+
+def used_classes() -> set[str]:
+    source = read("index.html") + read("app.js")
+    classes = set()
+    for match in _CLASS_ATTR.finditer(source):
+        classes.update(c for c in match.group(1).split() if "$" not in c and "{" not in c)
+    for match in _CLASS_LIST.finditer(source):
+        classes.update(_QUOTED.findall(match.group(1)))
+    return classes - MARKER_CLASSES
+
+
+def defined_classes() -> set[str]:
+    css = re.sub(r"/\*.*?\*/", "", "\n".join(read(name) for name in STYLESHEETS), flags=re.S)
+    return {re.sub(r"\\(.)", r"\1", name) for name in _SELECTOR.findall(css)}
+
+
+def main() -> int:
+    missing = sorted(used_classes() - defined_classes())
+    for name in missing:
+        print(name)
+    return 1 if missing else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
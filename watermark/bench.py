@@ -0,0 +1,193 @@
+"""端對端吞吐量壓測：以本機 Gemini 替身跑完整的批次流程
+(JobStore → FairScheduler → JobWorker → Pipeline)，不消耗 API 配額。
+
+    python -m watermark.bench --sizes 10,50,200 --resolutions 1024,3000 --latency 1.5 --throttle 0.05
+
+每個 (解析度, 批次大小) 組合使用全新的工作資料夾與快取，回報每秒張數、
+單張處理延遲 p50/p95/p99、重試次數 (Pipeline 實際重試的次數，auto 引擎改用本機時不算)、
+失敗張數與主程序的尖峰記憶體。
+"""
+
+import argparse
+import io
+import json
+import logging
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from . import config, gemini, metrics, stub_server
+from .cache import ResultCache
+from .jobs import JobStore, JobWorker
+from .pipeline import ENGINES, Pipeline
+from .ratelimit import RateController
+from .scheduler import FairScheduler
+
+log = logging.getLogger(__name__)
+
+
+def synthetic_images(count: int, side: int, seed: int = 0, watermark: bool = False) -> list[bytes]:
+    """產生互不相似的 4:3 JPEG (避免被近似重複偵測合併)；watermark 時疊上半透明文字。
+    色塊數固定，不同解析度是同一種畫面，各解析度的結果才能互相比較。"""
+    rng = np.random.default_rng(seed)
+    width, height = side, side * 3 // 4
+    images = []
+    for n in range(count):
+        coarse = rng.uniform(0, 255, (14, 18, 3)).astype(np.float32)
+        rgb = cv2.resize(coarse, (width, height), interpolation=cv2.INTER_CUBIC).clip(0, 255).astype(np.uint8)
+        if watermark:
+            overlay = rgb.copy()
+            cv2.putText(overlay, f"SAMPLE {n}", (width // 8, height // 2), cv2.FONT_HERSHEY_SIMPLEX,
+                        side / 400, (255, 255, 255), max(2, side // 300))
+            rgb = cv2.addWeighted(rgb, 0.6, overlay, 0.4, 0)
+        buf = io.BytesIO()
+        Image.fromarray(rgb).save(buf, "JPEG", quality=90)
+        images.append(buf.getvalue())
+    return images
+
+
+def percentile(values: list[float], q: float) -> float | None:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, round(q / 100 * len(ordered)) - 1))]
+
+
+class PeakMemory:
+    """在背景取樣主程序的 RSS；沒有 /proc 時退回 ru_maxrss (整個程序生命週期的尖峰)。"""
+
+    def __init__(self, interval: float = 0.05):
+        self.interval = interval
+        self.peak = 0
+        self._done = threading.Event()
+
+    @staticmethod
+    def rss() -> int | None:
+        try:
+            with open("/proc/self/statm") as f:
+                return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+        except (OSError, ValueError):
+            return None
+
+    def _sample(self) -> None:
+        while not self._done.wait(self.interval):
+            self.peak = max(self.peak, self.rss() or 0)
+
+    def __enter__(self) -> "PeakMemory":
+        self.peak = self.rss() or 0
+        threading.Thread(target=self._sample, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._done.set()
+        if self.rss() is None:
+            self.peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def run_case(stub: stub_server.StubServer, pool: ProcessPoolExecutor, args: argparse.Namespace,
+             size: int, side: int) -> dict:
+    images = synthetic_images(size, side, seed=side * 100_000 + size, watermark=args.watermark)
+    with tempfile.TemporaryDirectory(prefix="watermark-bench-") as tmp:
+        limiter = RateController(args.limit_rpm, args.burst, args.concurrency)
+        pipeline = Pipeline("bench", ResultCache(Path(tmp, "cache"), config.CACHE_MAX_BYTES), pool, limiter)
+        store = JobStore(Path(tmp, "jobs"))
+        worker = JobWorker(store, pipeline, args.threads, FairScheduler(store).claim, config.PREPARE_THREADS).start()
+        try:
+            job_id = store.create_job("bench", args.engine, [(f"bench_{n}.jpg", "image/jpeg") for n in range(size)])
+            for n, data in enumerate(images):
+                store.save_input(job_id, n, data)
+            stub.reset_stats()
+            retries = sum(metrics.RETRIES.values().values())
+
+            with PeakMemory() as memory:
+                start = time.time()
+                store.start_job(job_id)
+                worker.notify()
+                while (job := store.get_job(job_id))["status"] != "done":
+                    if time.time() - start > args.timeout:
+                        log.warning("Timed out after %ss with %s/%s finished", args.timeout, job["finished"], size)
+                        break
+                    time.sleep(0.05)
+                elapsed = time.time() - start
+        finally:
+            # 等背景執行緒結束才能刪除暫存資料夾，也不會留到下一個組合繼續搶 CPU 與計數
+            worker.stop()
+            store.close()
+        retries = sum(metrics.RETRIES.values().values()) - retries
+
+    done = [i for i in job["items"] if i["status"] == "done"]
+    latencies = [i["finishedAt"] - i["startedAt"] for i in done]
+    stats = stub.snapshot()
+    return {
+        "resolution": side,
+        "images": size,
+        "engine": args.engine,
+        "seconds": round(elapsed, 3),
+        "images_per_second": round(len(done) / elapsed, 3) if elapsed else None,
+        **{f"p{q}": round(v, 3) if (v := percentile(latencies, q)) is not None else None for q in (50, 95, 99)},
+        "requests": stats.get("requests", 0),
+        "retries": retries,
+        "failed": size - len(done),
+        "peak_rss_mb": round(memory.peak / 2**20, 1),
+    }
+
+
+def print_row(row: dict) -> None:
+    def ms(v):
+        return f"{v * 1000:8.0f}" if v is not None else f"{'-':>8}"
+
+    print(f"{row['resolution']:>6} {row['images']:>6} {row['seconds']:>8.2f} {row['images_per_second'] or 0:>7.2f}"
+          f" {ms(row['p50'])} {ms(row['p95'])} {ms(row['p99'])} {row['requests']:>6} {row['retries']:>6}"
+          f" {row['failed']:>6} {row['peak_rss_mb']:>9.1f}", flush=True)
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m watermark.bench", description="批次流程端對端壓測")
+    parser.add_argument("--sizes", default="10,50", help="批次張數，以逗號分隔")
+    parser.add_argument("--resolutions", default="1024,3000", help="圖片長邊 (像素)，以逗號分隔")
+    parser.add_argument("--engine", choices=ENGINES, default="gemini")
+    parser.add_argument("--threads", type=int, default=config.WORKER_THREADS, help="處理執行緒數")
+    parser.add_argument("--limit-rpm", type=float, default=600, help="RateController 每分鐘請求數 (替身配額另見 --rpm)")
+    parser.add_argument("--burst", type=int, default=config.RATE_LIMIT_BURST)
+    parser.add_argument("--concurrency", type=int, default=config.MAX_CONCURRENCY, help="同時進行的 API 請求上限")
+    parser.add_argument("--watermark", action="store_true", help="圖片疊上文字 (會觸發結果檢查後的重新生成)")
+    parser.add_argument("--timeout", type=float, default=600, help="單一組合的逾時 (秒)")
+    parser.add_argument("--json", type=Path, help="另外把每個組合的結果以 JSONL 寫入此檔")
+    stub_server.add_options(parser)
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.WARNING, format="%(message)s")
+
+    stub = stub_server.start_stub_server(stub_server.options_from_args(args))
+    gemini.GEMINI_BASE_URL = stub.base_url
+    pool = ProcessPoolExecutor(config.LOCAL_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+
+    print(f"{'res':>6} {'images':>6} {'seconds':>8} {'img/s':>7} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}"
+          f" {'reqs':>6} {'retry':>6} {'failed':>6} {'peak MB':>9}")
+    out = args.json.open("a", encoding="utf-8") if args.json else None
+    try:
+        for side in (int(s) for s in args.resolutions.split(",")):
+            for size in (int(s) for s in args.sizes.split(",")):
+                row = run_case(stub, pool, args, size, side)
+                print_row(row)
+                if out:
+                    out.write(json.dumps(row) + "\n")
+    finally:
+        if out:
+            out.close()
+        pool.shutdown()
+        stub.shutdown()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
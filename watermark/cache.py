@@ -0,0 +1,112 @@
+"""以圖片內容雜湊為鍵的結果快取 (本機磁碟，LRU 淘汰)。"""
+
+import hashlib
+import logging
+import mimetypes
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+from . import metrics
+
+log = logging.getLogger(__name__)
+
+def cache_key(image: bytes, prompt: str, model: str) -> str:
+    h = hashlib.sha256()
+    h.update(model.encode())
+    h.update(b"\0")
+    h.update(prompt.encode())
+    h.update(b"\0")
+    h.update(image)
+    return h.hexdigest()
+
+
+class ResultCache:
+    """每筆結果存成一個檔案，檔名為鍵、副檔名記錄 MIME 類型。
+
+    最近使用順序以檔案 mtime 保存，因此重新啟動後仍能延續 LRU。
+    """
+
+    def __init__(self, root: str | os.PathLike, max_bytes: int):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        # key -> (路徑, 大小)，順序即最近使用順序
+        self._entries: OrderedDict[str, tuple[Path, int]] = OrderedDict()
+        self._total = 0
+        stats = []
+        for p in self.root.iterdir():
+            if p.name.endswith(".tmp"):
+                p.unlink(missing_ok=True)  # 上次程序中斷時沒寫完的暫存檔
+            elif p.is_file():
+                stats.append((p, p.stat()))
+        for path, st in sorted(stats, key=lambda s: s[1].st_mtime):
+            self._entries[path.stem] = (path, st.st_size)
+            self._total += st.st_size
+        with self._lock:
+            self._evict_locked()
+
+    def get(self, key: str) -> tuple[bytes, str] | None:
+        found = self._read(key)
+        metrics.CACHE.inc(result="hit" if found else "miss")
+        return found
+
+    def contains(self, key: str) -> bool:
+        """只確認鍵是否存在 (並更新最近使用順序)，不讀檔、不計入命中率。"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return False
+            self._entries.move_to_end(key)
+        try:
+            os.utime(entry[0])
+        except FileNotFoundError:
+            return False
+        return True
+
+    def _read(self, key: str) -> tuple[bytes, str] | None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+        path = entry[0]
+        try:
+            data = path.read_bytes()
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return data, mimetypes.guess_type(path.name)[0] or "application/octet-stream"
+
+    def put(self, key: str, data: bytes, mime_type: str) -> None:
+        """寫入失敗只記錄警告：結果已經拿到，不能因為快取寫不進去而讓整張圖失敗。"""
+        path = self.root / f"{key}{mimetypes.guess_extension(mime_type) or '.bin'}"
+        # 每次寫入用各自的暫存檔，同一個鍵同時有多個寫入者時才不會搶同一個檔名
+        fd, tmp = tempfile.mkstemp(dir=self.root, prefix=f"{key}.", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+        except OSError as e:
+            log.warning("Cannot write cache entry %s: %s", key, e)
+            Path(tmp).unlink(missing_ok=True)
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._total -= old[1]
+                if old[0] != path:
+                    old[0].unlink(missing_ok=True)
+            self._entries[key] = (path, len(data))
+            self._total += len(data)
+            self._evict_locked()
+
+    def _evict_locked(self) -> None:
+        # 至少保留最新的一筆，避免單筆超過容量時剛寫入就被刪除
+        while self._total > self.max_bytes and len(self._entries) > 1:
+            _, (path, size) = self._entries.popitem(last=False)
+            self._total -= size
+            path.unlink(missing_ok=True)
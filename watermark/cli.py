@@ -0,0 +1,210 @@
+"""命令列批次處理 (不需開瀏覽器)。
+
+    python -m watermark.cli photos/ "more/**/*.jpg" -o cleaned/
+
+每處理完一個檔案就寫出結果並在 manifest (JSONL) 追加一行；
+中斷後以相同參數重新執行，manifest 中已成功的檔案會被略過。
+"""
+
+import argparse
+import glob
+import json
+import logging
+import mimetypes
+import os
+import sys
+import time
+import tomllib
+from collections.abc import Iterator
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from itertools import takewhile
+from pathlib import Path
+
+from . import config, frames, mask, preprocess
+from .pipeline import ENGINES, ModelError, Pipeline, create_pipeline
+from .ratelimit import RateController
+
+log = logging.getLogger(__name__)
+
+# 與前端 handleFiles 接受的副檔名一致
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".webp", ".gif", ".bmp", ".mp4", ".webm", ".mov", ".mkv"}
+
+
+def iter_inputs(patterns: list[str]) -> Iterator[tuple[Path, Path]]:
+    """逐一產生 (輸入檔, 輸出用的相對路徑)，不會一次列出全部檔案。"""
+    for pattern in patterns:
+        root = Path(pattern)
+        if root.is_dir():
+            for dirpath, dirnames, filenames in os.walk(root):
+                dirnames.sort()
+                for name in sorted(filenames):
+                    path = Path(dirpath, name)
+                    if path.suffix.lower() in IMAGE_EXTENSIONS:
+                        yield path, path.relative_to(root)
+        else:
+            # 輸出路徑相對於樣式中第一個萬用字元之前的資料夾
+            base = Path(*takewhile(lambda part: not glob.has_magic(part), root.parts[:-1]))
+            for name in glob.iglob(pattern, recursive=True):
+                path = Path(name)
+                if path.is_file() and path.suffix.lower() in IMAGE_EXTENSIONS:
+                    yield path, path.relative_to(base)
+
+
+def load_manifest(path: Path) -> set[str]:
+    """回傳 manifest 中已成功處理的輸入檔路徑。"""
+    done = set()
+    if path.exists():
+        with path.open(encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue  # 上次中斷時寫到一半的行
+                if record.get("status") == "ok":
+                    done.add(record["input"])
+    return done
+
+
+def estimate_masks(patterns: list[str], samples: int) -> dict[float, mask.SharedMask]:
+    """取前 samples 張圖的縮圖，依長寬比分組估計共用遮罩。"""
+    groups: dict[float, list] = {}
+    for path, _ in iter_inputs(patterns):
+        if samples <= 0:
+            break
+        if frames.is_animated(path, mimetypes.guess_type(path.name)[0] or ""):
+            continue
+        try:
+            thumb = preprocess.load_thumbnail(path.read_bytes())
+        except OSError:
+            continue
+        groups.setdefault(mask.aspect_key(thumb.shape[1], thumb.shape[0]), []).append(thumb)
+        samples -= 1
+    masks = {}
+    for aspect, thumbs in groups.items():
+        if len(thumbs) < config.MASK_MIN_IMAGES or (shared := mask.estimate(thumbs)) is None:
+            continue
+        if sum(mask.matches(shared, thumb) for thumb in thumbs) >= config.MASK_MIN_IMAGES:
+            masks[aspect] = shared
+    return masks
+
+
+def process_file(pipeline: Pipeline, src: Path, dst_base: Path, engine: str,
+                 masks: dict[float, mask.SharedMask]) -> dict:
+    record = {"input": str(src), "engine": engine}
+    start = time.perf_counter()
+    try:
+        mime_type = mimetypes.guess_type(src.name)[0] or "image/png"
+        if frames.is_animated(src, mime_type):
+            record.update(process_clip(pipeline, src, dst_base, engine, mime_type))
+        else:
+            record.update(process_image(pipeline, src, dst_base, engine, mime_type, masks))
+    except (ModelError, OSError) as e:
+        record.update(status="error", error=str(e))
+    except Exception as e:
+        # 其他錯誤 (DecompressionBombError、ValueError...) 同樣記在紀錄檔，不中斷整批
+        log.exception("Processing %s failed", src)
+        record.update(status="error", error=f"{type(e).__name__}: {e}")
+    record["seconds"] = round(time.perf_counter() - start, 3)
+    record["finished_at"] = time.strftime("%Y-%m-%dT%H:%M:%S%z")
+    return record
+
+
+def process_image(pipeline: Pipeline, src: Path, dst_base: Path, engine: str, mime_type: str,
+                  masks: dict[float, mask.SharedMask]) -> dict:
+    data = src.read_bytes()
+    shared = None
+    if masks:
+        # 與估計時相同大小的縮圖；沒有這個浮水印的圖整張處理
+        thumb = preprocess.load_thumbnail(data)
+        shared = masks.get(mask.aspect_key(thumb.shape[1], thumb.shape[0]))
+        if shared is not None and not mask.matches(shared, thumb):
+            shared = None
+    result = pipeline.process(data, mime_type, engine, shared)
+
+    dst = dst_base.with_name(f"{dst_base.name}_Clean{mimetypes.guess_extension(result.mime_type) or '.png'}")
+    dst.parent.mkdir(parents=True, exist_ok=True)
+    dst.write_bytes(result.data)
+    return {"status": "ok", "output": str(dst), "bytes_in": len(data), "bytes_out": len(result.data),
+            "cached": result.cached, "roi": shared is not None}
+
+
+def process_clip(pipeline: Pipeline, src: Path, dst_base: Path, engine: str, mime_type: str) -> dict:
+    """動畫與影片逐格寫到暫存檔，完成後依輸出格式改名。"""
+    dst_base.parent.mkdir(parents=True, exist_ok=True)
+    tmp = dst_base.with_name(f"{dst_base.name}_Clean.tmp")
+    try:
+        clip = pipeline.process_animation(src, tmp, mime_type, engine)
+    except Exception:
+        tmp.unlink(missing_ok=True)
+        raise
+    dst = tmp.with_suffix(mimetypes.guess_extension(clip.mime_type) or ".bin")
+    tmp.replace(dst)
+    return {"status": "ok", "output": str(dst), "bytes_in": src.stat().st_size, "bytes_out": dst.stat().st_size,
+            "cached": False, "roi": True, "clip_masks": clip.masks}
+
+
+def read_api_key() -> str | None:
+    """環境變數 GOOGLE_API_KEY，否則讀 Streamlit 的 .streamlit/secrets.toml。"""
+    key = os.environ.get("GOOGLE_API_KEY")
+    secrets = Path(".streamlit/secrets.toml")
+    if not key and secrets.exists():
+        with secrets.open("rb") as f:
+            key = tomllib.load(f).get("GOOGLE_API_KEY")
+    return key
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m watermark.cli", description="批次移除圖片浮水印")
+    parser.add_argument("inputs", nargs="+", help="圖片資料夾或 glob 樣式")
+    parser.add_argument("-o", "--output", required=True, type=Path, help="輸出資料夾")
+    parser.add_argument("--manifest", type=Path, help="JSONL 紀錄檔 (預設為 OUTPUT/manifest.jsonl)")
+    parser.add_argument("--engine", choices=ENGINES, default="gemini")
+    parser.add_argument("-j", "--concurrency", type=int, help="同時處理的檔案數")
+    parser.add_argument("--shared-mask", action="store_true", help="先以前幾張圖估計整批共用的浮水印遮罩")
+    parser.add_argument("--mask-samples", type=int, default=32)
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    api_key = read_api_key()
+    if args.engine != "local" and not api_key:
+        parser.error("未設定 GOOGLE_API_KEY")
+
+    manifest = args.manifest or args.output / "manifest.jsonl"
+    manifest.parent.mkdir(parents=True, exist_ok=True)
+    done = load_manifest(manifest)
+    concurrency = args.concurrency or (config.LOCAL_WORKERS if args.engine == "local" else config.MAX_CONCURRENCY)
+    limiter = RateController(config.RATE_LIMIT_RPM, config.RATE_LIMIT_BURST, config.MAX_CONCURRENCY)
+    pipeline = create_pipeline(api_key or "", limiter)
+    masks = estimate_masks(args.inputs, args.mask_samples) if args.shared_mask else {}
+
+    counts = {"ok": 0, "error": 0, "skipped": 0}
+    with manifest.open("a", encoding="utf-8") as out, ThreadPoolExecutor(concurrency) as pool:
+        def record(future):
+            rec = future.result()
+            counts[rec["status"]] += 1
+            out.write(json.dumps(rec, ensure_ascii=False) + "\n")
+            out.flush()
+            log.info("[%s] %s (%.1fs)%s", rec["status"], rec["input"], rec["seconds"],
+                     f" {rec['error']}" if "error" in rec else "")
+
+        # 最多只讓 2 倍併發數的工作排隊，記憶體用量與總檔案數無關
+        pending = set()
+        for src, rel in iter_inputs(args.inputs):
+            if str(src) in done:
+                counts["skipped"] += 1
+                continue
+            if len(pending) >= concurrency * 2:
+                finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    record(future)
+            pending.add(pool.submit(process_file, pipeline, src, args.output / rel, args.engine, masks))
+        for future in wait(pending).done:
+            record(future)
+
+    pipeline.local_pool.shutdown()
+    log.info("完成：成功 %(ok)d、失敗 %(error)d、略過 %(skipped)d", counts)
+    return 1 if counts["error"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,80 @@
+"""伺服器端設定，全部可由環境變數覆寫。"""
+
+import json
+import os
+
+# 內部 API 服務 (瀏覽器端的元件會呼叫它)；只綁在本機，對外由 watermark.gateway 以同源的 /api/ 轉送
+API_HOST = os.environ.get("API_HOST", "127.0.0.1")
+API_PORT = int(os.environ.get("API_PORT", "8502"))
+# 對外網址；留空時使用目前頁面同源的 /api，這個路徑只有經由 watermark.gateway 啟動時才存在。
+# 直接 streamlit run 時須另外對外開放 API (API_HOST=0.0.0.0) 並以此指定其網址，同時把頁面來源加進 API_ALLOWED_ORIGINS
+API_PUBLIC_URL = os.environ.get("API_PUBLIC_URL", "")
+# watermark.gateway 啟動 Streamlit 時設定的環境變數
+GATEWAY_ENV = "WATERMARK_GATEWAY"
+BEHIND_GATEWAY = os.environ.get(GATEWAY_ENV) == "1"
+# API_PUBLIC_URL 與頁面不同源時，允許跨來源呼叫的頁面來源 (以逗號分隔，例如 https://app.example.com)
+API_ALLOWED_ORIGINS = frozenset(o.strip() for o in os.environ.get("API_ALLOWED_ORIGINS", "").split(",") if o.strip())
+
+# 結果快取
+CACHE_DIR = os.environ.get("CACHE_DIR", ".cache/results")
+CACHE_MAX_BYTES = int(os.environ.get("CACHE_MAX_BYTES", str(1024 * 1024 * 1024)))
+
+# 前處理：模型的有效輸入解析度與分塊設定 (單位：像素，指最長邊)
+# 超過 MODEL_MAX_SIDE 時縮小後單次送出；超過 TILE_MIN_SIDE 的超大圖才縮到 TILE_MAX_SIDE 並分塊平行送出
+MODEL_MAX_SIDE = int(os.environ.get("MODEL_MAX_SIDE", "1024"))
+TILE_MIN_SIDE = int(os.environ.get("TILE_MIN_SIDE", "6000"))
+TILE_MAX_SIDE = int(os.environ.get("TILE_MAX_SIDE", "2048"))
+TILE_OVERLAP = int(os.environ.get("TILE_OVERLAP", "128"))
+
+# 本機 OpenCV 修補引擎
+LOCAL_WORKERS = int(os.environ.get("LOCAL_WORKERS", "0")) or os.cpu_count() or 1
+LOCAL_INPAINT_METHOD = os.environ.get("LOCAL_INPAINT_METHOD", "telea")  # telea 或 ns
+LOCAL_INPAINT_RADIUS = int(os.environ.get("LOCAL_INPAINT_RADIUS", "3"))
+
+# 輸出格式：source (沿用來源格式) / png / jpeg / webp；品質 0 表示依來源 JPEG 估計
+OUTPUT_FORMAT = os.environ.get("OUTPUT_FORMAT", "source")
+OUTPUT_QUALITY = int(os.environ.get("OUTPUT_QUALITY", "0"))
+
+# 浮水印偵測：分數 (0~1) 達門檻才預先勾選；結果仍超過門檻時略過快取重新生成的次數
+WATERMARK_THRESHOLD = float(os.environ.get("WATERMARK_THRESHOLD", "0.3"))
+VERIFY_RETRIES = int(os.environ.get("VERIFY_RETRIES", "1"))
+
+# 整批浮水印遮罩估計：至少幾張同比例且都有這個浮水印的圖片才共用遮罩，以及裁切範圍外擴比例
+# (張數太少時隨機背景的梯度方向也會顯得一致，見 mask 模組)
+MASK_MIN_IMAGES = int(os.environ.get("MASK_MIN_IMAGES", "6"))
+MASK_ROI_MARGIN = float(os.environ.get("MASK_ROI_MARGIN", "0.05"))
+
+# 動畫 (GIF/WebP/APNG) 與短片：每批平行處理的影格數、遮罩範圍與上一格的平均差異 (0~255)
+# 在門檻內就沿用上一格的結果，以及單一檔案的影格數上限
+FRAME_BATCH_SIZE = int(os.environ.get("FRAME_BATCH_SIZE", "16"))
+FRAME_REUSE_THRESHOLD = float(os.environ.get("FRAME_REUSE_THRESHOLD", "1.5"))
+MAX_FRAMES = int(os.environ.get("MAX_FRAMES", "3000"))
+# 單一 API 請求 (上傳的原圖或影片、偵測用的縮圖) 的大小上限 (位元組)，超過回 413
+MAX_UPLOAD_BYTES = int(os.environ.get("MAX_UPLOAD_BYTES", str(256 * 1024 * 1024)))
+# 每隔幾格重新估計一次浮水印遮罩 (會換位置的浮水印在段與段之間跟上)，0 表示整段只估計一次
+MASK_SEGMENT_FRAMES = int(os.environ.get("MASK_SEGMENT_FRAMES", "240"))
+# GIF/WebP/APNG 寫出時 Pillow 會留住全部影格：預估佔用超過此值 (位元組) 的動畫直接拒絕
+MAX_ANIMATION_BYTES = int(os.environ.get("MAX_ANIMATION_BYTES", str(512 * 1024 * 1024)))
+
+# 近似重複圖片：pHash/dHash 漢明距離 (64 位元中) 不超過此值視為同一張，負數停用
+DEDUPE_MAX_DISTANCE = int(os.environ.get("DEDUPE_MAX_DISTANCE", "6"))
+
+# 伺服器端呼叫 Gemini 時的速率控制 (與前端的設定相同意義)
+RATE_LIMIT_RPM = float(os.environ.get("RATE_LIMIT_RPM", "10"))
+RATE_LIMIT_BURST = int(os.environ.get("RATE_LIMIT_BURST", "4"))
+MAX_CONCURRENCY = int(os.environ.get("MAX_CONCURRENCY", "4"))
+MAX_RETRIES = int(os.environ.get("MAX_RETRIES", "5"))
+
+# 伺服器端工作佇列 (SQLite) 與背景處理執行緒
+JOBS_DIR = os.environ.get("JOBS_DIR", ".cache/jobs")
+JOB_TTL_HOURS = float(os.environ.get("JOB_TTL_HOURS", "72"))
+WORKER_THREADS = int(os.environ.get("WORKER_THREADS", "0")) or max(MAX_CONCURRENCY, LOCAL_WORKERS)
+# 準備工作 (去重、估計遮罩) 的執行緒數：大批次準備時，其他使用者的小批次不必排在後面
+PREPARE_THREADS = int(os.environ.get("PREPARE_THREADS", "2"))
+
+# 多使用者公平排程：有其他使用者在等時，單一使用者最多同時佔用的處理執行緒數；
+# session 取自 API 權杖：瀏覽器的每個 Streamlit session 各一個，
+# 以 ApiServer.issue_token(session) 簽發的權杖則用該名稱。
+# SESSION_WEIGHTS 為 JSON，例如 {"nightly-cli": 0.5}，未列出的權重為 1
+SESSION_MAX_RUNNING = int(os.environ.get("SESSION_MAX_RUNNING", "0")) or max(1, WORKER_THREADS // 2)
+SESSION_WEIGHTS = json.loads(os.environ.get("SESSION_WEIGHTS", "{}"))
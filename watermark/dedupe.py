@@ -0,0 +1,106 @@
+"""以感知雜湊找出批次中的近似重複圖片 (重新存檔、縮放、重新匯出)。
+
+每組只把一張代表圖送去處理，其他圖直接沿用代表圖的結果 (縮放到各自的尺寸)。
+以 pHash 做 BK-tree 的漢明距離查詢，再用 dHash 確認，降低誤判。
+兩種雜湊都只看灰階，換色、轉黑白或調色調的版本雜湊幾乎相同，因此最後再比對 COLOR_GRID×COLOR_GRID
+的平均色塊，相差超過 COLOR_MAX_DISTANCE 的不算重複 (沿用代表圖的結果會把顏色換掉)。
+"""
+
+from dataclasses import dataclass
+
+import cv2
+import numpy as np
+
+from . import mask
+
+COLOR_GRID = 4
+COLOR_MAX_DISTANCE = 12.0  # 色塊的平均絕對差 (0–255)；重新存檔或縮放通常在 3 以內
+
+
+def dhash(gray: np.ndarray) -> int:
+    small = cv2.resize(gray, (9, 8), interpolation=cv2.INTER_AREA).astype(np.int16)
+    return _pack(small[:, 1:] > small[:, :-1])
+
+
+def phash(gray: np.ndarray) -> int:
+    small = cv2.resize(gray, (32, 32), interpolation=cv2.INTER_AREA).astype(np.float32)
+    low = cv2.dct(small)[:8, :8].flatten()
+    return _pack(low > np.median(low[1:]))
+
+
+def color_layout(rgb: np.ndarray) -> np.ndarray:
+    return cv2.resize(rgb, (COLOR_GRID, COLOR_GRID), interpolation=cv2.INTER_AREA).astype(np.int16)
+
+
+def color_distance(a: np.ndarray, b: np.ndarray) -> float:
+    return float(np.abs(a - b).mean())
+
+
+def _pack(bits: np.ndarray) -> int:
+    return int.from_bytes(np.packbits(bits.flatten()).tobytes(), "big")
+
+
+def hamming(a: int, b: int) -> int:
+    return (a ^ b).bit_count()
+
+
+class BKTree:
+    """漢明距離的 BK-tree：查詢半徑 r 內的鍵，只需走訪距離差不超過 r 的子樹。"""
+
+    def __init__(self):
+        self._root: list | None = None  # [key, value, {distance: child}]
+
+    def add(self, key: int, value) -> None:
+        node = [key, value, {}]
+        if self._root is None:
+            self._root = node
+            return
+        current = self._root
+        while True:
+            d = hamming(key, current[0])
+            child = current[2].get(d)
+            if child is None:
+                current[2][d] = node
+                return
+            current = child
+
+    def search(self, key: int, radius: int) -> list:
+        found, stack = [], [self._root] if self._root else []
+        while stack:
+            node_key, value, children = stack.pop()
+            d = hamming(key, node_key)
+            if d <= radius:
+                found.append((d, value))
+            stack.extend(child for dist, child in children.items() if d - radius <= dist <= d + radius)
+        return [value for _, value in sorted(found, key=lambda f: f[0])]
+
+
+@dataclass
+class Fingerprint:
+    index: int
+    aspect: float
+    area: int  # 原圖像素數，用來挑解析度最高的當代表
+    phash: int
+    dhash: int
+    color: np.ndarray  # color_layout 的結果
+
+
+def fingerprint(index: int, thumb: np.ndarray, area: int) -> Fingerprint:
+    gray = cv2.cvtColor(thumb, cv2.COLOR_RGB2GRAY)
+    return Fingerprint(index, mask.aspect_key(thumb.shape[1], thumb.shape[0]), area, phash(gray), dhash(gray),
+                       color_layout(thumb))
+
+
+def group(prints: list[Fingerprint], max_distance: int) -> dict[int, int]:
+    """回傳 {重複圖 index: 代表圖 index}；長寬比不同的圖不會被歸為同組 (結果無法直接縮放沿用)。"""
+    tree = BKTree()
+    duplicates = {}
+    for fp in sorted(prints, key=lambda p: (-p.area, p.index)):
+        match = next((rep for rep in tree.search(fp.phash, max_distance)
+                      if rep.aspect == fp.aspect and hamming(rep.dhash, fp.dhash) <= max_distance
+                      and color_distance(rep.color, fp.color) <= COLOR_MAX_DISTANCE), None)
+        if match is None:
+            tree.add(fp.phash, fp)
+        else:
+            duplicates[fp.index] = match.index
+    return duplicates
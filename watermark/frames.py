@@ -0,0 +1,313 @@
+"""動畫 (GIF / WebP / APNG) 與短片的逐格串流處理。
+
+影格逐格解碼，每 FRAME_BATCH_SIZE 格處理一批後立刻寫出，不把整段片子放進記憶體：
+
+1. 每 MASK_SEGMENT_FRAMES 格為一段，從段內均勻取樣縮圖，以 mask.estimate 估計該段的浮水印遮罩：
+   疊加的浮水印在段內固定在畫面同一處，各格在那裡的梯度方向一致，會動的畫面內容則互相抵銷。
+   估不出來的段 (畫面幾乎靜止、或段太短) 沿用相鄰段的遮罩，整段片子都估不出來時改用第一格的
+   local_engine.detect_mask。段內每一格都套用該段的遮罩，只處理遮罩周圍的區域。
+   這不是逐格追蹤：會換位置的浮水印只在段與段之間跟上，段內移動的部分不會被處理；
+   結果的 masks 是實際用到的不同遮罩數，大於 1 表示浮水印在片中換過位置。
+2. 遮罩區域與上一個實際處理的影格相差不到 FRAME_REUSE_THRESHOLD 時直接沿用該格的修補結果，
+   靜止或只有遮罩外在動的片段因此不必重算。
+3. 需要處理的區域整批交給 clean 平行處理，羽化後貼回原格。
+
+影片以 OpenCV 逐格寫成 WebM (VP8) 讓瀏覽器直接播放，不含音軌。
+GIF、WebP 與 APNG 由 Pillow 編碼，三種寫入器都會把全部影格留在記憶體直到寫完 (GIF 存調色盤後的影格，
+WebP 與 APNG 存完整的 RGB 影格，APNG 還會多複製一份)，因此處理前先依解碼後的大小估計寫入時的記憶體，
+超過 MAX_ANIMATION_BYTES 就拒絕，不能只靠 MAX_FRAMES 限制。
+"""
+
+import itertools
+from collections.abc import Callable, Iterator
+from dataclasses import dataclass
+from pathlib import Path
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from . import config, local_engine, mask, metrics, preprocess
+from .mask import SharedMask
+
+VIDEO_TYPES = frozenset({"video/mp4", "video/webm", "video/quicktime", "video/x-matroska"})
+# 可能含多格的圖片格式 → Pillow 存檔格式
+ANIMATION_FORMATS = {"image/gif": "GIF", "image/webp": "WEBP", "image/png": "PNG"}
+# 依序嘗試的影片編碼 (MIME, 副檔名, FourCC)；opencv-python 內建的 FFmpeg 沒有 H.264 編碼器
+VIDEO_CODECS = (("video/webm", ".webm", "VP80"), ("video/mp4", ".mp4", "mp4v"))
+MASK_SAMPLES = 16  # 估計遮罩時取樣的影格數
+# Pillow 寫入各格式時每格每像素約佔用的記憶體 (位元組，實測值)
+WRITER_BYTES_PER_PIXEL = {"GIF": 2, "WEBP": 7, "PNG": 8}
+SEGMENT_MERGE_OVERLAP = 0.5  # 相鄰段的遮罩重疊 (IoU) 達此值視為同一個浮水印，沿用上一段的遮罩
+
+# 一批同尺寸的遮罩區域 + 區域內的遮罩 → 修補後的區域
+Clean = Callable[[list[np.ndarray], np.ndarray], list[np.ndarray]]
+Frame = tuple[np.ndarray, float]  # (RGB, 顯示時間毫秒)
+
+
+@dataclass
+class ClipResult:
+    mime_type: str
+    masks: int  # 各段實際使用的不同遮罩數
+
+
+@dataclass
+class ClipInfo:
+    frames: int  # 影片的格數取自檔頭，可能不準或為 0
+    fps: float
+    loop: int
+    width: int
+    height: int
+
+
+def is_animated(path: Path, mime_type: str) -> bool:
+    if mime_type in VIDEO_TYPES:
+        return True
+    if mime_type not in ANIMATION_FORMATS:
+        return False
+    try:
+        with Image.open(path) as img:
+            return bool(getattr(img, "is_animated", False))
+    except OSError:
+        return False
+
+
+def _open_video(path: Path) -> cv2.VideoCapture:
+    capture = cv2.VideoCapture(str(path))
+    if not capture.isOpened():
+        raise OSError("Cannot open video")
+    return capture
+
+
+def probe(path: Path, mime_type: str) -> ClipInfo:
+    if mime_type in VIDEO_TYPES:
+        capture = _open_video(path)
+        try:
+            return ClipInfo(int(capture.get(cv2.CAP_PROP_FRAME_COUNT)), capture.get(cv2.CAP_PROP_FPS) or 25.0, 0,
+                            int(capture.get(cv2.CAP_PROP_FRAME_WIDTH)), int(capture.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+        finally:
+            capture.release()
+    with Image.open(path) as img:
+        return ClipInfo(getattr(img, "n_frames", 1), 0.0, img.info.get("loop", 0), *img.size)
+
+
+def writer_bytes(info: ClipInfo, mime_type: str) -> int:
+    """寫出動畫時 Pillow 預估佔用的記憶體；影片由 OpenCV 逐格寫出，不累積。"""
+    if mime_type in VIDEO_TYPES:
+        return 0
+    return info.width * info.height * info.frames * WRITER_BYTES_PER_PIXEL[ANIMATION_FORMATS[mime_type]]
+
+
+def read_frames(path: Path, mime_type: str, info: ClipInfo) -> Iterator[Frame]:
+    """逐格解碼；超過 MAX_FRAMES 時中止。"""
+    count = 0
+    if mime_type in VIDEO_TYPES:
+        capture = _open_video(path)
+        try:
+            while True:
+                ok, bgr = capture.read()
+                if not ok:
+                    break
+                count += 1
+                if count > config.MAX_FRAMES:
+                    raise ValueError(f"More than {config.MAX_FRAMES} frames")
+                yield cv2.cvtColor(bgr, cv2.COLOR_BGR2RGB), 1000 / info.fps
+        finally:
+            capture.release()
+        return
+    with Image.open(path) as img:
+        for n in range(getattr(img, "n_frames", 1)):
+            if n >= config.MAX_FRAMES:
+                raise ValueError(f"More than {config.MAX_FRAMES} frames")
+            img.seek(n)
+            yield np.asarray(img.convert("RGB")), img.info.get("duration", 100)
+
+
+def segment_frames(info: ClipInfo) -> int:
+    """每段的格數；格數不明的影片整段視為一段。"""
+    if info.frames <= 0 or config.MASK_SEGMENT_FRAMES <= 0:
+        return max(info.frames, MASK_SAMPLES)
+    return config.MASK_SEGMENT_FRAMES
+
+
+def sample_positions(info: ClipInfo, size: int) -> list[int]:
+    """各段內均勻取樣 MASK_SAMPLES 格的位置 (遞增)；格數不明的影片取開頭連續的 MASK_SAMPLES 格。"""
+    if info.frames <= 0:
+        return list(range(MASK_SAMPLES))
+    positions = set()
+    for start in range(0, info.frames, size):
+        end = min(start + size, info.frames)
+        positions.update(round(p) for p in np.linspace(start, end - 1, MASK_SAMPLES))
+    return sorted(positions)
+
+
+def sample_frames(path: Path, mime_type: str, info: ClipInfo,
+                  positions: list[int]) -> Iterator[tuple[int, np.ndarray]]:
+    """依序取出 positions 各格的縮圖；影片直接跳到取樣位置，不解碼中間的影格。"""
+    def thumb(rgb: np.ndarray) -> np.ndarray:
+        return preprocess.resize(rgb, *preprocess.fit(rgb.shape[1], rgb.shape[0], 320))
+
+    if mime_type in VIDEO_TYPES:
+        capture = _open_video(path)
+        try:
+            for n in positions:
+                if info.frames > 0:
+                    capture.set(cv2.CAP_PROP_POS_FRAMES, n)
+                ok, bgr = capture.read()
+                if not ok:
+                    break
+                yield n, thumb(cv2.cvtColor(bgr, cv2.COLOR_BGR2RGB))
+        finally:
+            capture.release()
+        return
+    with Image.open(path) as img:
+        for n in positions:
+            img.seek(n)
+            yield n, thumb(np.asarray(img.convert("RGB")))
+
+
+def _fill(masks: list[SharedMask | None]) -> list[SharedMask | None]:
+    """估不出來的段沿用前一段的遮罩，開頭的段沿用之後第一個估得出的遮罩。"""
+    filled, previous = [], None
+    for shared in masks:
+        previous = shared if shared is not None else previous
+        filled.append(previous)
+    following = next((shared for shared in filled if shared is not None), None)
+    return [shared if shared is not None else following for shared in filled]
+
+
+def estimate_masks(path: Path, mime_type: str, info: ClipInfo) -> list[SharedMask] | None:
+    """回傳各段的遮罩；位置與上一段幾乎相同的遮罩直接沿用上一段的物件。"""
+    size = segment_frames(info)
+    count = max(1, -(-info.frames // size))
+    estimates: list[SharedMask | None] = [None] * count
+    # 取樣位置遞增，GIF/WebP 只需從頭解碼一次；每段取樣完就估計，不留住整段片子的縮圖
+    samples = sample_frames(path, mime_type, info, sample_positions(info, size))
+    for index, group in itertools.groupby(samples, key=lambda sample: min(sample[0] // size, count - 1)):
+        thumbs = [thumb for _, thumb in group]
+        if len(thumbs) >= config.MASK_MIN_IMAGES:
+            estimates[index] = mask.estimate(thumbs)
+    masks = _fill(estimates)
+    if masks[0] is None:
+        first = next(read_frames(path, mime_type, info), None)
+        shared = mask.from_mask(local_engine.detect_mask(first[0])) if first is not None else None
+        if shared is None:
+            return None
+        masks = [shared] * count
+    merged = masks[:1]
+    for shared in masks[1:]:
+        same = mask.overlap(merged[-1], shared) >= SEGMENT_MERGE_OVERLAP
+        merged.append(merged[-1] if same else shared)
+    return merged
+
+
+def _batched(frames: Iterator[Frame], size: int) -> Iterator[list[Frame]]:
+    while batch := list(itertools.islice(frames, size)):
+        yield batch
+
+
+def _difference(a: np.ndarray, b: np.ndarray) -> float:
+    return float(np.abs(a.astype(np.int16) - b).mean())
+
+
+def clean_frames(frames: Iterator[Frame], masks: list[SharedMask], size: int, clean: Clean) -> Iterator[Frame]:
+    """masks[i] 用在第 i 段 (每段 size 格)；最後一段包含其餘所有影格 (影片檔頭的格數可能不準)。"""
+    current = region = crop_mask = None
+    reference, reference_result = None, None  # 上一個實際處理的區域與其結果
+    for i, shared in enumerate(masks):
+        segment = frames if i == len(masks) - 1 else itertools.islice(frames, size)
+        for batch in _batched(segment, config.FRAME_BATCH_SIZE):
+            if shared is not current:
+                height, width = batch[0][0].shape[:2]
+                box = shared.roi(width, height, config.MASK_ROI_MARGIN)
+                region = (slice(box.y, box.y + box.h), slice(box.x, box.x + box.w))
+                crop_mask = shared.resize(width, height)[region]
+                current, reference, reference_result = shared, None, None
+
+            # 每格的結果來源：todo 中的位置，-1 表示沿用前一批的 reference_result
+            crops, todo, sources, slot = [rgb[region] for rgb, _ in batch], [], [], -1
+            for crop in crops:
+                if reference is None or _difference(reference, crop) > config.FRAME_REUSE_THRESHOLD:
+                    todo.append(crop)
+                    reference, slot = crop, len(todo) - 1
+                sources.append(slot)
+            cleaned = clean(todo, crop_mask) if todo else []
+            metrics.FRAMES.inc(len(todo), result="processed")
+            metrics.FRAMES.inc(len(batch) - len(todo), result="reused")
+
+            with metrics.stage("assemble"):
+                for (rgb, duration), crop, source in zip(batch, crops, sources):
+                    merged = rgb.copy()
+                    merged[region] = mask.blend(crop, cleaned[source] if source >= 0 else reference_result,
+                                                crop_mask)
+                    yield merged, duration
+            if todo:
+                reference_result = cleaned[slot]
+
+
+def write_video(frames: Iterator[Frame], target: Path, fps: float) -> str:
+    """逐格寫到 target，回傳使用的 MIME 類型。"""
+    first = next(frames, None)
+    if first is None:
+        raise OSError("Video has no frames")
+    height, width = first[0].shape[:2]
+    for mime_type, suffix, fourcc in VIDEO_CODECS:
+        # OpenCV 依副檔名決定容器格式
+        path = target.with_name(target.name + suffix)
+        writer = cv2.VideoWriter(str(path), cv2.VideoWriter_fourcc(*fourcc), fps, (width, height))
+        if writer.isOpened():
+            break
+    else:
+        raise OSError("No usable video encoder")
+    try:
+        for rgb, _ in itertools.chain([first], frames):
+            with metrics.stage("encode"):
+                writer.write(cv2.cvtColor(rgb, cv2.COLOR_RGB2BGR))
+    finally:
+        writer.release()
+    path.replace(target)
+    return mime_type
+
+
+def write_animation(frames: Iterator[Frame], target: Path, mime_type: str, loop: int) -> str:
+    def image(rgb: np.ndarray, duration: float) -> Image.Image:
+        img = Image.fromarray(rgb)
+        img.info["duration"] = round(duration)
+        return img
+
+    first = next(frames, None)
+    if first is None:
+        raise OSError("Animation has no frames")
+    fmt = ANIMATION_FORMATS[mime_type]
+    head = image(*first)
+    params = {"save_all": True, "loop": loop}
+    if fmt == "GIF":
+        # GIF 只走訪 append_images 一次，可以直接給產生器；各格的顯示時間取自 info["duration"]
+        params["append_images"] = (image(*frame) for frame in frames)
+    else:
+        # WebP 與 APNG 會走訪 append_images 兩次 (先檢查尺寸與模式)，產生器到第二次已經空了
+        rest = [image(*frame) for frame in frames]
+        params["append_images"] = rest
+        if fmt == "WEBP":
+            params.update(duration=[img.info["duration"] for img in [head, *rest]], quality=90, method=4)
+    head.save(target, fmt, **params)
+    return mime_type
+
+
+def process_clip(source: Path, target: Path, mime_type: str, clean: Clean) -> ClipResult:
+    """處理 source 並寫到 target。"""
+    info = probe(source, mime_type)
+    if info.frames > config.MAX_FRAMES:
+        raise ValueError(f"More than {config.MAX_FRAMES} frames")
+    if writer_bytes(info, mime_type) > config.MAX_ANIMATION_BYTES:
+        raise ValueError(f"Animation too large to encode ({info.width}x{info.height}, {info.frames} frames)")
+    with metrics.stage("mask"):
+        masks = estimate_masks(source, mime_type, info)
+    if masks is None:
+        raise ValueError("No watermark found in frames")
+    frames = clean_frames(read_frames(source, mime_type, info), masks, segment_frames(info), clean)
+    if mime_type in VIDEO_TYPES:
+        output_mime = write_video(frames, target, info.fps)
+    else:
+        output_mime = write_animation(frames, target, mime_type, info.loop)
+    return ClipResult(output_mime, len({id(shared) for shared in masks}))
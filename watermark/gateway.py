@@ -0,0 +1,154 @@
+"""對外的單一入口：同一個埠同時提供 Streamlit 頁面與內部 API。
+
+內部 API 只綁在本機 (API_HOST 預設 127.0.0.1)，瀏覽器一律經由這裡以同源的 /api/ 路徑呼叫，
+頁面是 HTTPS 時 API 也跟著是 HTTPS，不需要另外開放第二個埠或設定 CORS：
+
+    python -m watermark.gateway --port $PORT                 # Heroku 等平台：TLS 由平台的路由層處理
+    python -m watermark.gateway --port 443 --certfile fullchain.pem --keyfile privkey.pem
+
+直接 streamlit run app.py (包括 Streamlit Community Cloud) 沒有同源的 /api/：除非另外以 API_PUBLIC_URL
+指定對外開放的 API 位址，app.py 會停下並提示改用這裡啟動。
+
+gateway 會在本機另一個埠啟動 streamlit run app.py (並設定 WATERMARK_GATEWAY=1)，
+/api/ 開頭的請求去掉前綴後轉給內部 API，其餘 (含 Streamlit 的 WebSocket) 原樣轉給 Streamlit。一般請求改成 Connection: close，
+同一條連線上的下一個請求才會重新判斷要轉給誰；WebSocket 升級的連線則維持到任一端關閉。
+"""
+
+import argparse
+import logging
+import os
+import socket
+import socketserver
+import ssl
+import subprocess
+import sys
+import threading
+
+from . import config
+
+log = logging.getLogger(__name__)
+
+API_PREFIX = "/api"
+MAX_HEAD_BYTES = 64 * 1024
+CHUNK_SIZE = 64 * 1024
+
+
+class Gateway(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address: tuple[str, int], streamlit: tuple[str, int], api: tuple[str, int]):
+        super().__init__(address, GatewayHandler)
+        self.streamlit = streamlit
+        self.api = api
+        self.tls: ssl.SSLContext | None = None
+
+
+def _read_head(sock: socket.socket) -> tuple[bytes, bytes]:
+    """讀到空行為止，回傳 (請求行與標頭, 已讀到的 body 開頭)。"""
+    data = b""
+    while b"\r\n\r\n" not in data:
+        if len(data) > MAX_HEAD_BYTES:
+            raise ValueError("Request head too large")
+        chunk = sock.recv(CHUNK_SIZE)
+        if not chunk:
+            raise ConnectionError("Client closed before sending a request")
+        data += chunk
+    head, rest = data.split(b"\r\n\r\n", 1)
+    return head, rest
+
+
+def route(head: bytes, streamlit: tuple[str, int], api: tuple[str, int]) -> tuple[tuple[str, int], bytes]:
+    """決定轉送對象並改寫請求行與 Connection 標頭。"""
+    request_line, *headers = head.split(b"\r\n")
+    method, target, version = request_line.split(b" ", 2)
+    backend = streamlit
+    prefix = API_PREFIX.encode()
+    if target == prefix or target.startswith(prefix + b"/") or target.startswith(prefix + b"?"):
+        backend, target = api, target[len(prefix):]
+        if not target.startswith(b"/"):
+            target = b"/" + target
+    upgrade = any(h.lower().startswith(b"upgrade:") for h in headers)
+    if not upgrade:
+        headers = [h for h in headers if not h.lower().startswith((b"connection:", b"keep-alive:"))]
+        headers.append(b"Connection: close")
+    return backend, b"\r\n".join([b" ".join([method, target, version]), *headers]) + b"\r\n\r\n"
+
+
+def _pipe(source: socket.socket, target: socket.socket) -> None:
+    try:
+        while chunk := source.recv(CHUNK_SIZE):
+            target.sendall(chunk)
+    except OSError:
+        pass
+    finally:
+        try:
+            target.shutdown(socket.SHUT_WR)
+        except OSError:
+            pass
+
+
+class GatewayHandler(socketserver.BaseRequestHandler):
+    server: Gateway
+
+    def handle(self):
+        client = self.request
+        try:
+            if self.server.tls is not None:
+                # 交握放在各連線的執行緒，慢速的客戶端不會卡住 accept
+                client = self.server.tls.wrap_socket(client, server_side=True)
+            head, rest = _read_head(client)
+            address, head = route(head, self.server.streamlit, self.server.api)
+        except (ValueError, ConnectionError, OSError) as e:
+            log.debug("Bad request from %s: %s", self.client_address[0], e)
+            return
+        try:
+            backend = socket.create_connection(address)
+        except OSError:
+            client.sendall(b"HTTP/1.1 502 Bad Gateway\r\nContent-Length: 0\r\nConnection: close\r\n\r\n")
+            return
+        with backend:
+            backend.sendall(head + rest)
+            upstream = threading.Thread(target=_pipe, args=(client, backend), daemon=True)
+            upstream.start()
+            _pipe(backend, client)
+            upstream.join(timeout=1)
+
+
+def _loopback(host: str) -> str:
+    return "127.0.0.1" if host in ("", "0.0.0.0") else host
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m watermark.gateway", description="Streamlit 與內部 API 的同源入口")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--app", default="app.py", help="Streamlit 腳本")
+    parser.add_argument("--streamlit-port", type=int, default=8501, help="Streamlit 在本機使用的埠")
+    parser.add_argument("--certfile", help="TLS 憑證 (PEM)；未指定時以 HTTP 提供，由前方的代理處理 TLS")
+    parser.add_argument("--keyfile", help="TLS 私鑰 (PEM)")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    streamlit = subprocess.Popen([
+        sys.executable, "-m", "streamlit", "run", args.app, "--server.address", "127.0.0.1",
+        "--server.port", str(args.streamlit_port), "--server.headless", "true",
+    ], env={**os.environ, config.GATEWAY_ENV: "1"})
+    server = Gateway((args.host, args.port), ("127.0.0.1", args.streamlit_port),
+                     (_loopback(config.API_HOST), config.API_PORT))
+    if args.certfile:
+        server.tls = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+        server.tls.load_cert_chain(args.certfile, args.keyfile)
+    threading.Thread(target=server.serve_forever, name="gateway", daemon=True).start()
+    log.info("Gateway listening on %s:%s", args.host, args.port)
+    try:
+        return streamlit.wait()
+    except KeyboardInterrupt:
+        streamlit.terminate()
+        return streamlit.wait()
+    finally:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,74 @@
+"""Gemini generateContent 的請求內容與呼叫。
+
+所有呼叫共用同一個 requests.Session：連線池讓 TLS 連線保持 keep-alive，
+不必每張圖重新握手。重試與限流在 pipeline 處理，這裡不另外重試。
+"""
+
+import os
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from . import config
+
+# 壓測時可指向本機替身 (python -m watermark.stub_server)
+GEMINI_BASE_URL = os.environ.get("GEMINI_BASE_URL", "https://generativelanguage.googleapis.com")
+# 嘗試使用較新的模型 (雖然仍可能被鎖住圖片輸出)
+MODEL_IMAGE_EDIT = "gemini-2.0-flash-exp"
+PROMPT = "Inpaint all text overlays and visual artifacts to restore the underlying background. Return a clean, high-quality image."
+
+SAFETY_SETTINGS = [
+    {"category": "HARM_CATEGORY_HARASSMENT", "threshold": "BLOCK_NONE"},
+    {"category": "HARM_CATEGORY_HATE_SPEECH", "threshold": "BLOCK_NONE"},
+    {"category": "HARM_CATEGORY_SEXUALLY_EXPLICIT", "threshold": "BLOCK_NONE"},
+    {"category": "HARM_CATEGORY_DANGEROUS_CONTENT", "threshold": "BLOCK_NONE"},
+]
+
+
+def build_payload(image_b64: str, mime_type: str = "image/png") -> dict:
+    return {
+        "contents": [{
+            "parts": [
+                {"text": PROMPT},
+                {"inlineData": {"mimeType": mime_type, "data": image_b64}},
+            ]
+        }],
+        "safetySettings": SAFETY_SETTINGS,
+        "generationConfig": {"responseModalities": ["IMAGE"]},
+    }
+
+
+def _session() -> requests.Session:
+    # 同時進行的請求不超過 MAX_CONCURRENCY，連線池至少要容納這麼多條
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(config.MAX_CONCURRENCY, 10), max_retries=0)
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+SESSION = _session()
+
+
+def generate_content(api_key: str, payload: dict, timeout: float = 120) -> requests.Response:
+    url = f"{GEMINI_BASE_URL}/v1beta/models/{MODEL_IMAGE_EDIT}:generateContent"
+    # API Key 放在標頭而非網址，避免出現在連線記錄與例外訊息中
+    return SESSION.post(url, headers={"x-goog-api-key": api_key}, json=payload, timeout=timeout)
+
+
+def find_image_part(data: dict) -> dict | None:
+    """回傳回應中第一個含圖片的 inlineData，沒有則為 None。"""
+    candidates = data.get("candidates") or [{}]
+    parts = (candidates[0].get("content") or {}).get("parts") or []
+    return next((p["inlineData"] for p in parts if "inlineData" in p), None)
+
+
+def describe_failure(data: dict) -> str:
+    """沒有圖片的成功回應：安全過濾、NO_IMAGE 或其他結束原因。"""
+    block = (data.get("promptFeedback") or {}).get("blockReason")
+    if block:
+        return f"Blocked by safety filter: {block}"
+    reason = ((data.get("candidates") or [{}])[0]).get("finishReason")
+    if reason and reason not in ("STOP", "NO_IMAGE"):
+        return f"Generation stopped: {reason}"
+    return (data.get("error") or {}).get("message") or "NO_IMAGE"
@@ -0,0 +1,508 @@
+"""伺服器端的工作佇列 (SQLite) 與背景處理執行緒。
+
+批次狀態存在伺服器上，瀏覽器重新整理或斷線後可用工作 ID 取回結果；
+上傳的原圖與處理結果以檔案存放在 JOBS_DIR/<工作 ID>/，資料庫只存狀態。
+"""
+
+import json
+import logging
+import shutil
+import sqlite3
+import threading
+import time
+import uuid
+from collections.abc import Callable
+from typing import BinaryIO
+from contextlib import contextmanager
+from dataclasses import dataclass
+from pathlib import Path
+
+import numpy as np
+
+from . import config, dedupe, frames, mask, metrics, preprocess
+from .mask import SharedMask
+from .pipeline import ModelError, Pipeline, Result
+
+log = logging.getLogger(__name__)
+
+UPLOAD_CHUNK_SIZE = 1 << 20
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    session TEXT NOT NULL DEFAULT '',
+    engine TEXT NOT NULL,
+    status TEXT NOT NULL,          -- uploading / queued / preparing / running
+    masks TEXT NOT NULL DEFAULT '[]',
+    created_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS items (
+    job_id TEXT NOT NULL REFERENCES jobs(id) ON DELETE CASCADE,
+    idx INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    mime_type TEXT NOT NULL,
+    status TEXT NOT NULL,          -- pending / running / done / error
+    mask INTEGER,
+    dup_of INTEGER,                -- 近似重複：沿用同工作中這個 idx 的結果
+    clip_masks INTEGER,            -- 動畫/影片各段實際使用的不同遮罩數
+    output_mime TEXT,
+    cached INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    error_status INTEGER,
+    started_at REAL,
+    finished_at REAL,
+    PRIMARY KEY (job_id, idx)
+);
+CREATE INDEX IF NOT EXISTS items_pending ON items(status, job_id);
+"""
+
+# 舊版資料庫缺少的欄位：(資料表, 欄位, 定義)
+MIGRATIONS = [
+    ("jobs", "session", "TEXT NOT NULL DEFAULT ''"),
+    ("items", "dup_of", "INTEGER"),
+    ("items", "clip_masks", "INTEGER"),
+]
+
+
+@dataclass
+class Task:
+    job_id: str
+    idx: int
+    name: str
+    mime_type: str
+    engine: str
+    mask: int | None
+
+
+class JobStore:
+    def __init__(self, root: str | Path):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.root / "jobs.sqlite3", check_same_thread=False, isolation_level=None)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA foreign_keys=ON")
+        self._db.executescript(SCHEMA)
+        for table, column, definition in MIGRATIONS:
+            if column not in {r["name"] for r in self._db.execute(f"PRAGMA table_info({table})")}:
+                self._db.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+        # 上次程序結束時還在處理的項目重新排隊；代表圖已結束的重複圖改為獨立處理
+        self._db.execute("UPDATE items SET status = 'pending', started_at = NULL WHERE status = 'running'")
+        self._db.execute("UPDATE items SET dup_of = NULL WHERE status = 'pending' AND dup_of IS NOT NULL AND EXISTS"
+                         " (SELECT 1 FROM items AS rep WHERE rep.job_id = items.job_id AND rep.idx = items.dup_of"
+                         " AND rep.status IN ('done', 'error'))")
+        self._db.execute("UPDATE jobs SET status = 'queued' WHERE status = 'preparing'")
+
+    # 共用同一個連線：查詢結果要在持鎖時讀完，游標帶出鎖外會和其他執行緒的語句交錯
+    def _query(self, sql: str, params=()) -> list[sqlite3.Row]:
+        with self._lock:
+            return self._db.execute(sql, params).fetchall()
+
+    def _query_one(self, sql: str, params=()) -> sqlite3.Row | None:
+        with self._lock:
+            return self._db.execute(sql, params).fetchone()
+
+    def _execute(self, sql: str, params=()) -> int:
+        """執行寫入語句，回傳影響的列數。"""
+        with self._lock:
+            return self._db.execute(sql, params).rowcount
+
+    @contextmanager
+    def _transaction(self, mode: str = ""):
+        with self._lock:
+            self._db.execute(f"BEGIN {mode}")
+            try:
+                yield self._db
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+            self._db.execute("COMMIT")
+
+    def close(self) -> None:
+        """關閉資料庫連線；呼叫前要先停止使用這個 store 的 JobWorker。"""
+        with self._lock:
+            self._db.close()
+
+    def _dir(self, job_id: str) -> Path:
+        return self.root / job_id
+
+    def input_path(self, job_id: str, idx: int) -> Path:
+        return self._dir(job_id) / f"in_{idx}"
+
+    def output_path(self, job_id: str, idx: int) -> Path:
+        return self._dir(job_id) / f"out_{idx}"
+
+    # --- 建立與上傳 ---
+
+    def create_job(self, session: str, engine: str, items: list[tuple[str, str]]) -> str:
+        job_id = uuid.uuid4().hex
+        self._dir(job_id).mkdir()
+        with self._transaction() as db:
+            db.execute("INSERT INTO jobs (id, session, engine, status, created_at) VALUES (?, ?, ?, 'uploading', ?)",
+                       (job_id, session, engine, time.time()))
+            db.executemany("INSERT INTO items (job_id, idx, name, mime_type, status) VALUES (?, ?, ?, ?, 'pending')",
+                           [(job_id, i, name, mime) for i, (name, mime) in enumerate(items)])
+        return job_id
+
+    def save_input(self, job_id: str, idx: int, data: bytes | BinaryIO, length: int | None = None) -> bool:
+        """data 為串流時分段讀 length 位元組寫到暫存檔 (上傳的影片可能很大)，讀完整才換成原圖。"""
+        if self._query_one("SELECT 1 FROM items WHERE job_id = ? AND idx = ?", (job_id, idx)) is None:
+            return False
+        path = self.input_path(job_id, idx)
+        # 同一張重傳時各自寫自己的暫存檔
+        tmp = path.with_name(f"{path.name}.{uuid.uuid4().hex}.tmp")
+        try:
+            with tmp.open("wb") as f:
+                if isinstance(data, bytes):
+                    f.write(data)
+                else:
+                    remaining = length or 0
+                    while remaining > 0:
+                        chunk = data.read(min(UPLOAD_CHUNK_SIZE, remaining))
+                        if not chunk:
+                            raise ConnectionError("Upload ended before Content-Length bytes")
+                        f.write(chunk)
+                        remaining -= len(chunk)
+            tmp.replace(path)
+        except Exception:
+            tmp.unlink(missing_ok=True)
+            raise
+        return True
+
+    def start_job(self, job_id: str) -> bool:
+        """所有原圖都上傳後才排入佇列。"""
+        rows = self._query("SELECT idx FROM items WHERE job_id = ?", (job_id,))
+        if not rows or not all(self.input_path(job_id, r["idx"]).exists() for r in rows):
+            return False
+        self._execute("UPDATE jobs SET status = 'queued' WHERE id = ? AND status = 'uploading'", (job_id,))
+        return True
+
+    # --- 背景處理 ---
+
+    def claim_queued_job(self) -> str | None:
+        """取出下一個待準備的工作：沒有工作正在準備的使用者優先，其次是最早排入的工作。"""
+        with self._transaction("IMMEDIATE") as db:
+            row = db.execute(
+                "SELECT id FROM jobs WHERE status = 'queued' ORDER BY EXISTS (SELECT 1 FROM jobs AS busy"
+                " WHERE busy.session = jobs.session AND busy.status = 'preparing'), created_at LIMIT 1").fetchone()
+            if row is not None:
+                db.execute("UPDATE jobs SET status = 'preparing' WHERE id = ?", (row["id"],))
+        return row["id"] if row else None
+
+    def set_masks(self, job_id: str, masks: list[SharedMask], assignment: dict[int, int]) -> None:
+        for n, shared in enumerate(masks):
+            np.save(self._dir(job_id) / f"mask_{n}.npy", shared.mask)
+        with self._transaction() as db:
+            db.executemany("UPDATE items SET mask = ? WHERE job_id = ? AND idx = ?",
+                           [(n, job_id, idx) for idx, n in assignment.items()])
+            db.execute("UPDATE jobs SET status = 'running', masks = ? WHERE id = ?",
+                       (json.dumps([m.box for m in masks]), job_id))
+
+    def set_duplicates(self, job_id: str, duplicates: dict[int, int]) -> None:
+        with self._transaction() as db:
+            db.executemany("UPDATE items SET dup_of = ? WHERE job_id = ? AND idx = ?",
+                           [(rep, job_id, idx) for idx, rep in duplicates.items()])
+
+    def load_mask(self, job_id: str, n: int) -> SharedMask | None:
+        row = self._query_one("SELECT masks FROM jobs WHERE id = ?", (job_id,))
+        path = self._dir(job_id) / f"mask_{n}.npy"
+        if row is None or not path.exists():
+            return None
+        return SharedMask(np.load(path), tuple(json.loads(row["masks"])[n]))
+
+    def session_backlog(self) -> dict[str, tuple[int, int]]:
+        """各使用者在處理中工作裡的 (待處理, 處理中) 項目數。"""
+        rows = self._query(
+            "SELECT jobs.session, SUM(items.status = 'pending' AND items.dup_of IS NULL) AS pending, SUM(items.status = 'running') AS running"
+            " FROM items JOIN jobs ON jobs.id = items.job_id"
+            " WHERE jobs.status = 'running' AND items.status IN ('pending', 'running') GROUP BY jobs.session")
+        return {r["session"]: (r["pending"], r["running"]) for r in rows}
+
+    def claim_item(self, session: str) -> Task | None:
+        """取出該使用者的下一個項目：剩餘張數最少的工作優先，讓小批次不必排在大批次後面。"""
+        with self._transaction("IMMEDIATE") as db:
+            job = db.execute(
+                "SELECT items.job_id, COUNT(*) AS remaining FROM items JOIN jobs ON jobs.id = items.job_id"
+                " WHERE items.status = 'pending' AND items.dup_of IS NULL AND jobs.status = 'running' AND jobs.session = ?"
+                " GROUP BY items.job_id ORDER BY remaining, MIN(jobs.created_at) LIMIT 1", (session,)).fetchone()
+            row = None
+            if job is not None:
+                row = db.execute(
+                    "SELECT items.job_id, idx, name, mime_type, engine, mask FROM items JOIN jobs ON jobs.id = items.job_id"
+                    " WHERE items.job_id = ? AND items.status = 'pending' AND dup_of IS NULL ORDER BY idx LIMIT 1",
+                    (job["job_id"],)).fetchone()
+            if row is not None:
+                db.execute("UPDATE items SET status = 'running', started_at = ? WHERE job_id = ? AND idx = ?",
+                           (time.time(), row["job_id"], row["idx"]))
+        return Task(**row) if row else None
+
+    def claim_duplicates(self, task: Task) -> list[Task]:
+        """取出沿用 task 結果的所有重複圖。"""
+        with self._transaction("IMMEDIATE") as db:
+            rows = db.execute(
+                "SELECT items.job_id, idx, name, mime_type, engine, mask FROM items JOIN jobs ON jobs.id = items.job_id"
+                " WHERE items.job_id = ? AND dup_of = ? AND items.status = 'pending'", (task.job_id, task.idx)).fetchall()
+            db.executemany("UPDATE items SET status = 'running', started_at = ? WHERE job_id = ? AND idx = ?",
+                           [(time.time(), r["job_id"], r["idx"]) for r in rows])
+        return [Task(**r) for r in rows]
+
+    def complete_item(self, task: Task, data: bytes | Path, mime_type: str, cached: bool,
+                      clip_masks: int | None = None) -> None:
+        """data 為 Path 時是已寫好的暫存檔 (動畫、影片)，直接搬成結果檔。"""
+        if isinstance(data, Path):
+            data.replace(self.output_path(task.job_id, task.idx))
+        else:
+            self.output_path(task.job_id, task.idx).write_bytes(data)
+        self._execute("UPDATE items SET status = 'done', output_mime = ?, cached = ?, clip_masks = ?, error = NULL,"
+                      " error_status = NULL, finished_at = ? WHERE job_id = ? AND idx = ?",
+                      (mime_type, int(cached), clip_masks, time.time(), task.job_id, task.idx))
+        metrics.ITEMS.inc(status="done")
+
+    def fail_item(self, task: Task, status: int, message: str) -> None:
+        self._execute("UPDATE items SET status = 'error', error = ?, error_status = ?, finished_at = ?"
+                      " WHERE job_id = ? AND idx = ?", (message, status, time.time(), task.job_id, task.idx))
+        metrics.ITEMS.inc(status="error")
+
+    def retry_item(self, job_id: str, idx: int) -> bool:
+        return self._execute("UPDATE items SET status = 'pending', dup_of = NULL, error = NULL, error_status = NULL"
+                             " WHERE job_id = ? AND idx = ? AND status IN ('done', 'error')", (job_id, idx)) > 0
+
+    # --- 查詢 ---
+
+    def get_job(self, job_id: str) -> dict | None:
+        job = self._query_one("SELECT * FROM jobs WHERE id = ?", (job_id,))
+        if job is None:
+            return None
+        items = self._query("SELECT idx, name, mime_type, status, dup_of, output_mime, cached, clip_masks, error,"
+                            " error_status, started_at, finished_at FROM items WHERE job_id = ? ORDER BY idx", (job_id,))
+        finished = sum(1 for i in items if i["status"] in ("done", "error"))
+        status = job["status"]
+        if status == "running" and finished == len(items):
+            status = "done"
+        return {
+            "jobId": job_id,
+            "engine": job["engine"],
+            "status": status,
+            "total": len(items),
+            "finished": finished,
+            "items": [{
+                "index": i["idx"],
+                "name": i["name"],
+                "mimeType": i["mime_type"],
+                "status": i["status"],
+                "duplicateOf": i["dup_of"],
+                "outputMimeType": i["output_mime"],
+                "cached": bool(i["cached"]),
+                # 動畫/影片的遮罩是分段估計、不是逐格追蹤；大於 1 表示浮水印在片中換過位置
+                "clipMasks": i["clip_masks"],
+                "error": i["error"],
+                "errorStatus": i["error_status"],
+                "startedAt": i["started_at"],
+                "finishedAt": i["finished_at"],
+            } for i in items],
+        }
+
+    def get_result(self, job_id: str, idx: int) -> tuple[Path, str] | None:
+        row = self._query_one("SELECT output_mime FROM items WHERE job_id = ? AND idx = ? AND status = 'done'",
+                              (job_id, idx))
+        if row is None:
+            return None
+        return self.output_path(job_id, idx), row["output_mime"]
+
+    def purge(self, max_age_hours: float) -> None:
+        """刪除過期的工作；排隊、準備中或還有項目在處理的工作不刪，放棄上傳的工作照刪。"""
+        cutoff = time.time() - max_age_hours * 3600
+        expired = [r["id"] for r in self._query(
+            "SELECT id FROM jobs WHERE created_at < ? AND status NOT IN ('queued', 'preparing') AND NOT"
+            " (status = 'running' AND EXISTS (SELECT 1 FROM items WHERE items.job_id = jobs.id"
+            " AND items.status IN ('pending', 'running')))", (cutoff,))]
+        for job_id in expired:
+            self._execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+            shutil.rmtree(self._dir(job_id), ignore_errors=True)
+
+
+class JobWorker:
+    """在背景執行緒處理佇列中的工作，與瀏覽器連線無關。"""
+
+    def __init__(self, store: JobStore, pipeline: Pipeline, threads: int, claim: Callable[[], Task | None],
+                 prepare_threads: int = 1):
+        self.store = store
+        self.pipeline = pipeline
+        self.threads = threads
+        self.prepare_threads = max(1, prepare_threads)
+        self.claim = claim
+        self._wake = threading.Condition()
+        self._stopped = False
+        self._threads: list[threading.Thread] = []
+
+    def start(self) -> "JobWorker":
+        # 只由第一個準備執行緒定期清除過期工作
+        self._threads = [
+            *(threading.Thread(target=self._prepare_loop, args=(n == 0,), name=f"job-prepare-{n}", daemon=True)
+              for n in range(self.prepare_threads)),
+            *(threading.Thread(target=self._item_loop, name=f"job-worker-{n}", daemon=True)
+              for n in range(self.threads)),
+        ]
+        for thread in self._threads:
+            thread.start()
+        return self
+
+    def stop(self, timeout: float | None = None) -> None:
+        """讓背景執行緒在目前的項目處理完後結束，並等它們結束 (最多 timeout 秒)；
+        之後才能安全地刪除工作資料夾或關閉 store。"""
+        self._stopped = True
+        self.notify()
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for thread in self._threads:
+            thread.join(None if deadline is None else max(0.0, deadline - time.monotonic()))
+
+    def notify(self) -> None:
+        with self._wake:
+            self._wake.notify_all()
+
+    def _sleep(self) -> None:
+        with self._wake:
+            self._wake.wait(1)
+
+    def _prepare_loop(self, purge: bool) -> None:
+        last_purge = 0.0
+        while not self._stopped:
+            try:
+                if purge and time.time() - last_purge > 3600:
+                    last_purge = time.time()
+                    self.store.purge(config.JOB_TTL_HOURS)
+                job_id = self.store.claim_queued_job()
+            except Exception:
+                # 資料庫暫時出錯時不能讓執行緒結束，否則之後的工作永遠停在 queued
+                log.exception("Claiming a queued job failed")
+                self._sleep()
+                continue
+            if job_id is None:
+                self._sleep()
+                continue
+            try:
+                self._prepare(job_id)
+            except Exception:
+                log.exception("Preparing job %s failed", job_id)
+                self.store.set_masks(job_id, [], {})
+            self.notify()
+
+    def _prepare(self, job_id: str) -> None:
+        """讀一次縮圖，找出近似重複的圖並估計共用遮罩。動畫與影片各自估計遮罩，不參與這兩步。"""
+        job = self.store.get_job(job_id)
+        thumbs, prints = [], []
+        if job["total"] > 1:
+            for item in job["items"]:
+                path = self.store.input_path(job_id, item["index"])
+                if frames.is_animated(path, item["mimeType"]):
+                    continue
+                data = path.read_bytes()
+                try:
+                    thumb = preprocess.load_thumbnail(data)
+                    width, height = preprocess.image_size(data)
+                except OSError:
+                    continue
+                thumbs.append((item["index"], thumb))
+                prints.append(dedupe.fingerprint(item["index"], thumb, width * height))
+        if config.DEDUPE_MAX_DISTANCE >= 0:
+            self.store.set_duplicates(job_id, dedupe.group(prints, config.DEDUPE_MAX_DISTANCE))
+        self._estimate_masks(job_id, thumbs)
+
+    def _estimate_masks(self, job_id: str, thumbs: list[tuple[int, np.ndarray]]) -> None:
+        """依長寬比分組，同組夠多張時估計共用遮罩，之後只處理遮罩附近的區域。
+        只有確實帶著這個浮水印的圖套用遮罩，其餘 (以及估不出遮罩的組) 照常整張處理。"""
+        groups: dict[float, list[tuple[int, np.ndarray]]] = {}
+        for idx, thumb in thumbs:
+            groups.setdefault(mask.aspect_key(thumb.shape[1], thumb.shape[0]), []).append((idx, thumb))
+
+        masks, assignment = [], {}
+        for members in groups.values():
+            if len(members) < config.MASK_MIN_IMAGES:
+                continue
+            shared = mask.estimate([thumb for _, thumb in members])
+            if shared is None:
+                continue
+            matched = [idx for idx, thumb in members if mask.matches(shared, thumb)]
+            if len(matched) >= config.MASK_MIN_IMAGES:
+                assignment.update((idx, len(masks)) for idx in matched)
+                masks.append(shared)
+        self.store.set_masks(job_id, masks, assignment)
+
+    def _item_loop(self) -> None:
+        while not self._stopped:
+            try:
+                task = self.claim()
+            except Exception:
+                log.exception("Claiming an item failed")
+                self._sleep()
+                continue
+            if task is None:
+                self._sleep()
+                continue
+            self._run(task)
+
+    def _run(self, task: Task) -> None:
+        """_process 之外漏出的錯誤 (例如寫入資料庫失敗) 也把項目標成失敗，
+        不讓它永遠停在 running，也不讓處理執行緒就此結束。"""
+        try:
+            with metrics.ITEM_SECONDS.time(engine=task.engine):
+                self._process(task)
+        except Exception as e:
+            log.exception("Processing failed for %s/%s", task.job_id, task.idx)
+            try:
+                self._fail(task, 500, str(e))
+            except Exception:
+                log.exception("Cannot mark %s/%s as failed", task.job_id, task.idx)
+
+    def _process(self, task: Task) -> None:
+        source = self.store.input_path(task.job_id, task.idx)
+        if frames.is_animated(source, task.mime_type):
+            return self._process_clip(task, source)
+        try:
+            with metrics.stage("read"):
+                data = source.read_bytes()
+            shared = self.store.load_mask(task.job_id, task.mask) if task.mask is not None else None
+            result = self.pipeline.process(data, task.mime_type, task.engine, shared)
+        except ModelError as e:
+            self._fail(task, e.status, str(e))
+        except Exception as e:
+            log.exception("Processing failed for %s/%s", task.job_id, task.idx)
+            self._fail(task, 500, str(e))
+        else:
+            self.store.complete_item(task, result.data, result.mime_type, result.cached)
+            for dup in self.store.claim_duplicates(task):
+                self._reuse(dup, result)
+
+    def _process_clip(self, task: Task, source: Path) -> None:
+        """逐格寫到暫存檔，完成後再換成結果檔，整段片子不經過記憶體。"""
+        tmp = self.store.output_path(task.job_id, task.idx).with_suffix(".tmp")
+        try:
+            clip = self.pipeline.process_animation(source, tmp, task.mime_type, task.engine)
+        except ModelError as e:
+            tmp.unlink(missing_ok=True)
+            self._fail(task, e.status, str(e))
+        except Exception as e:
+            tmp.unlink(missing_ok=True)
+            log.exception("Processing failed for %s/%s", task.job_id, task.idx)
+            self._fail(task, 500, str(e))
+        else:
+            self.store.complete_item(task, tmp, clip.mime_type, False, clip.masks)
+
+    def _reuse(self, task: Task, result: Result) -> None:
+        try:
+            data = self.store.input_path(task.job_id, task.idx).read_bytes()
+            reused = self.pipeline.reuse(result, data, task.mime_type)
+        except ModelError as e:
+            self.store.fail_item(task, e.status, str(e))
+        except Exception as e:
+            # 只讓這張重複圖失敗，同一代表圖的其他重複圖照常沿用結果
+            log.exception("Reusing a result failed for %s/%s", task.job_id, task.idx)
+            self.store.fail_item(task, 500, str(e))
+        else:
+            self.store.complete_item(task, reused.data, reused.mime_type, reused.cached)
+
+    def _fail(self, task: Task, status: int, message: str) -> None:
+        # 代表圖失敗時重複圖也視為失敗，可個別重試 (重試時改為獨立處理)
+        for t in [task, *self.store.claim_duplicates(task)]:
+            self.store.fail_item(t, status, message)
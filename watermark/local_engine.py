@@ -0,0 +1,121 @@
+"""本機 OpenCV 修補引擎：偵測浮水印遮罩後以 cv2.inpaint 修補。
+
+對單純的半透明文字或標誌只需數毫秒，不佔用 API 配額。
+同樣的形態學特徵也用來快速判斷一張圖是否有浮水印 (watermark_score)。
+函式都是模組層級，才能交給 ProcessPoolExecutor 在其他程序執行。
+"""
+
+import cv2
+import numpy as np
+
+from . import preprocess
+
+METHODS = {"telea": cv2.INPAINT_TELEA, "ns": cv2.INPAINT_NS}
+# 偵測遮罩時的工作解析度 (最長邊)：邊緣密度等門檻依這個解析度調校，
+# 大圖先縮到這裡偵測再把遮罩放大，結果才不會隨原圖解析度改變
+DETECT_SIDE = 960
+
+
+def detect_mask(rgb: np.ndarray) -> np.ndarray:
+    """回傳與 rgb 同尺寸的 uint8 遮罩 (255 = 要修補)；在 DETECT_SIDE 的縮圖上偵測。"""
+    height, width = rgb.shape[:2]
+    small = preprocess.resize(rgb, *preprocess.fit(width, height, DETECT_SIDE))
+    mask = _detect_mask(small)
+    if small.shape[:2] == (height, width):
+        return mask
+    return np.where(cv2.resize(mask, (width, height), interpolation=cv2.INTER_LINEAR) > 0, 255, 0).astype(np.uint8)
+
+
+def _detect_mask(rgb: np.ndarray) -> np.ndarray:
+    """1. top-hat / black-hat 取出比周圍亮或暗的細小結構 (文字筆畫、標誌)
+    2. Otsu 門檻二值化
+    3. 將筆畫橫向連成區塊，只保留邊緣密度與尺寸像文字/標誌的區塊
+    """
+    gray = cv2.cvtColor(rgb, cv2.COLOR_RGB2GRAY)
+    height, width = gray.shape
+    k = max(3, (min(height, width) // 30) | 1)
+    kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (k, k))
+    contrast = cv2.max(cv2.morphologyEx(gray, cv2.MORPH_TOPHAT, kernel),
+                       cv2.morphologyEx(gray, cv2.MORPH_BLACKHAT, kernel))
+    otsu, _ = cv2.threshold(contrast, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    _, strokes = cv2.threshold(contrast, max(otsu, 20), 255, cv2.THRESH_BINARY)
+
+    edges = cv2.Canny(gray, 50, 150)
+    regions = cv2.morphologyEx(strokes, cv2.MORPH_CLOSE, cv2.getStructuringElement(cv2.MORPH_RECT, (k * 3, k)))
+    count, labels, stats, _ = cv2.connectedComponentsWithStats(regions)
+    keep = np.zeros(count, bool)
+    for i in range(1, count):
+        x, y, w, h, area = stats[i]
+        if area < k * k or w * h > 0.25 * width * height or h > height / 4:
+            continue
+        edge_density = np.count_nonzero(edges[y:y + h, x:x + w]) / (w * h)
+        keep[i] = edge_density > 0.04
+    mask = np.where(keep[labels], strokes, 0).astype(np.uint8)
+    return cv2.dilate(mask, np.ones((3, 3), np.uint8), iterations=2)
+
+
+def watermark_score(rgb: np.ndarray) -> float:
+    """0~1 的浮水印/文字疊加分數：排成一列、大小相近的細筆畫字元越多分數越高。
+
+    1. top-hat / black-hat 取出比周圍亮或暗的細小結構，只留對比明顯高於整張圖的部分
+    2. 連通元件中挑出尺寸、填滿率像字元的候選
+    3. 高度相近、垂直中心對齊、間距小的候選連成一列，三個以上才算文字
+    """
+    gray = cv2.cvtColor(rgb, cv2.COLOR_RGB2GRAY)
+    height, width = gray.shape
+    k = max(3, (min(height, width) // 30) | 1)
+    kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (k, k))
+    best = 0
+    for op in (cv2.MORPH_TOPHAT, cv2.MORPH_BLACKHAT):
+        contrast = cv2.morphologyEx(gray, op, kernel)
+        _, strokes = cv2.threshold(contrast, max(20.0, float(contrast.mean() + 3 * contrast.std())), 255,
+                                   cv2.THRESH_BINARY)
+        count, _, stats, _ = cv2.connectedComponentsWithStats(strokes)
+        chars = sorted((x, y, w, h) for x, y, w, h, area in stats[1:]
+                       if max(4, height / 80) <= h <= height / 5 and w <= h * 4 and area >= 8
+                       and 0.12 <= area / (w * h) <= 0.9)
+
+        # 以 union-find 把同一列的字元連起來；chars 依 x 排序，間距太大即可提早結束
+        parent = list(range(len(chars)))
+
+        def find(i: int) -> int:
+            while parent[i] != i:
+                parent[i] = parent[parent[i]]
+                i = parent[i]
+            return i
+
+        for a, (xa, ya, wa, ha) in enumerate(chars):
+            for b in range(a + 1, len(chars)):
+                xb, yb, wb, hb = chars[b]
+                tall = max(ha, hb)
+                if xb - (xa + wa) > 1.5 * tall:
+                    break
+                if tall / min(ha, hb) <= 1.8 and abs((ya + ha / 2) - (yb + hb / 2)) <= 0.4 * tall:
+                    parent[find(a)] = find(b)
+
+        lines: dict[int, int] = {}
+        for i in range(len(chars)):
+            lines[find(i)] = lines.get(find(i), 0) + 1
+        best = max(best, sum(n for n in lines.values() if n >= 3))
+    return min(1.0, best / 10)
+
+
+def score_image(image: bytes) -> float:
+    """以縮圖計算分數，讓不同解析度的圖用同一個門檻。"""
+    return watermark_score(preprocess.load_thumbnail(image))
+
+
+def inpaint(rgb: np.ndarray, mask: np.ndarray, method: str = "telea", radius: int = 3) -> np.ndarray:
+    if not mask.any():
+        return rgb
+    bgr = cv2.cvtColor(rgb, cv2.COLOR_RGB2BGR)
+    return cv2.cvtColor(cv2.inpaint(bgr, mask, radius, METHODS[method]), cv2.COLOR_BGR2RGB)
+
+
+def remove_watermark(image: bytes, method: str = "telea", radius: int = 3) -> bytes | None:
+    """偵測不到浮水印時回傳 None，由呼叫端回報失敗，而不是把原圖當成處理結果。"""
+    rgb = preprocess.decode(image)
+    found = detect_mask(rgb)
+    if not found.any():
+        return None
+    return preprocess.encode(inpaint(rgb, found, method, radius))
@@ -0,0 +1,147 @@
+"""整批共用的浮水印遮罩估計。
+
+同一批圖片的浮水印通常在相同位置：把同比例的圖片縮到同一個格點後，
+逐像素取梯度的中位數 (背景內容互相抵銷，只剩浮水印的邊緣)，
+再乘上梯度方向在各張圖之間的一致程度，即可得到共用遮罩。
+
+N 個隨機方向的平均長度約為 1/sqrt(N)，張數少時背景也會顯得「一致」，
+因此一致性門檻隨張數調整，並拒絕零散、範圍接近整張圖的遮罩；
+估出遮罩後再逐張比對梯度方向 (matches)，沒有這個浮水印的圖改為單張處理。
+"""
+
+import hashlib
+from dataclasses import dataclass, field
+
+import cv2
+import numpy as np
+
+from .preprocess import Box
+
+GRID = 256  # 估計時的長邊解析度
+# 一致性門檻 = CONSISTENCY_SIGMAS / sqrt(張數)，限制在 [MIN_CONSISTENCY, MAX_CONSISTENCY]
+CONSISTENCY_SIGMAS = 2.0
+MIN_CONSISTENCY, MAX_CONSISTENCY = 0.3, 0.9
+MIN_COMPONENT = 16  # 小於此面積 (格點像素) 的連通區塊視為雜訊
+MAX_BOX_AREA = 0.25  # 遮罩外框超過畫面的這個比例就不是單一浮水印，不值得只處理局部
+MIN_FILL = 0.15  # 遮罩佔外框的最低比例，太低表示零散分布
+MIN_AGREEMENT = 0.3  # 單張圖在遮罩上與共用梯度方向的平均一致度，低於此值視為沒有這個浮水印
+
+
+@dataclass(frozen=True)
+class SharedMask:
+    mask: np.ndarray  # 格點解析度的 uint8 遮罩
+    box: tuple[float, float, float, float]  # 正規化的 (x0, y0, x1, y1)
+    # 估計時各格點的共用梯度 (gx, gy)，matches 比對單張圖用；不寫入工作資料夾
+    gradient: np.ndarray | None = field(default=None, compare=False, repr=False)
+
+    @property
+    def key(self) -> str:
+        return hashlib.sha256(self.mask.tobytes()).hexdigest()[:16]
+
+    def resize(self, width: int, height: int) -> np.ndarray:
+        return cv2.resize(self.mask, (width, height), interpolation=cv2.INTER_LINEAR)
+
+    def roi(self, width: int, height: int, margin: float) -> Box:
+        x0, y0, x1, y1 = self.box
+        mx, my = margin * width, margin * height
+        left, top = max(0, int(x0 * width - mx)), max(0, int(y0 * height - my))
+        right, bottom = min(width, int(np.ceil(x1 * width + mx))), min(height, int(np.ceil(y1 * height + my)))
+        return Box(left, top, right - left, bottom - top)
+
+
+def aspect_key(width: int, height: int) -> float:
+    return round(width / height, 2)
+
+
+def _grid_size(aspect: float) -> tuple[int, int]:
+    return (GRID, max(1, round(GRID / aspect))) if aspect >= 1 else (max(1, round(GRID * aspect)), GRID)
+
+
+def _gradients(images: list[np.ndarray], size: tuple[int, int]) -> tuple[np.ndarray, np.ndarray]:
+    stack = np.stack([
+        cv2.cvtColor(cv2.resize(img, size, interpolation=cv2.INTER_AREA), cv2.COLOR_RGB2GRAY)
+        for img in images
+    ]).astype(np.float32)
+    gx = np.stack([cv2.Sobel(g, cv2.CV_32F, 1, 0, ksize=3) for g in stack])
+    gy = np.stack([cv2.Sobel(g, cv2.CV_32F, 0, 1, ksize=3) for g in stack])
+    return gx, gy
+
+
+def estimate(images: list[np.ndarray]) -> SharedMask | None:
+    """images 需為同比例的 RGB 陣列；找不到一致的浮水印時回傳 None。"""
+    height, width = images[0].shape[:2]
+    gx, gy = _gradients(images, _grid_size(width / height))
+    median = np.stack([np.median(gx, axis=0), np.median(gy, axis=0)], axis=-1)
+    magnitude = np.hypot(median[..., 0], median[..., 1])
+
+    # 各張圖梯度單位向量的平均長度：方向一致時接近 1，隨機背景接近 0
+    norm = np.hypot(gx, gy) + 1e-6
+    consistency = np.hypot((gx / norm).mean(axis=0), (gy / norm).mean(axis=0))
+
+    score = magnitude * consistency
+    if score.max() <= 0:
+        return None
+    score8 = (score / score.max() * 255).astype(np.uint8)
+    _, mask = cv2.threshold(score8, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    threshold = min(MAX_CONSISTENCY, max(MIN_CONSISTENCY, CONSISTENCY_SIGMAS / np.sqrt(len(images))))
+    mask[consistency < threshold] = 0
+    mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, np.ones((5, 5), np.uint8))
+    mask = cv2.dilate(mask, np.ones((3, 3), np.uint8), iterations=2)
+
+    count, labels, stats, _ = cv2.connectedComponentsWithStats(mask)
+    mask = np.where(np.isin(labels, [i for i in range(1, count) if stats[i, cv2.CC_STAT_AREA] >= MIN_COMPONENT]),
+                    255, 0).astype(np.uint8)
+    if not mask.any():
+        return None
+    box = _bounds(mask)
+    box_area = (box[2] - box[0]) * (box[3] - box[1])
+    if box_area > MAX_BOX_AREA or np.count_nonzero(mask) / mask.size < MIN_FILL * box_area:
+        return None
+    return SharedMask(mask, box, median)
+
+
+def matches(shared: SharedMask, image: np.ndarray) -> bool:
+    """image 在遮罩上的梯度方向與估計時的共用方向大致相同，才表示它也有這個浮水印。"""
+    if shared.gradient is None:
+        return True
+    gh, gw = shared.mask.shape
+    gx, gy = _gradients([image], (gw, gh))
+    ref = shared.gradient[shared.mask > 0]
+    weight = np.hypot(ref[:, 0], ref[:, 1])
+    if weight.sum() <= 0:
+        return False
+    own = np.stack([gx[0][shared.mask > 0], gy[0][shared.mask > 0]], axis=-1)
+    cosine = (own * ref).sum(axis=1) / (np.hypot(own[:, 0], own[:, 1]) * weight + 1e-6)
+    return float((cosine * weight).sum() / weight.sum()) >= MIN_AGREEMENT
+
+
+def _bounds(grid: np.ndarray) -> tuple[float, float, float, float]:
+    gh, gw = grid.shape
+    ys, xs = np.nonzero(grid)
+    return float(xs.min() / gw), float(ys.min() / gh), float((xs.max() + 1) / gw), float((ys.max() + 1) / gh)
+
+
+def from_mask(full: np.ndarray) -> SharedMask | None:
+    """把單張圖的原尺寸遮罩 (local_engine.detect_mask) 轉成格點解析度的 SharedMask；遮罩為空時回傳 None。"""
+    height, width = full.shape[:2]
+    gw, gh = _grid_size(width / height)
+    grid = cv2.resize(full, (gw, gh), interpolation=cv2.INTER_AREA)
+    grid = np.where(grid > 0, 255, 0).astype(np.uint8)
+    if not grid.any():
+        return None
+    return SharedMask(grid, _bounds(grid))
+
+
+def overlap(a: SharedMask, b: SharedMask) -> float:
+    """兩個遮罩在格點上的 IoU；格點大小不同 (長寬比不同) 時為 0。"""
+    if a.mask.shape != b.mask.shape:
+        return 0.0
+    union = np.count_nonzero((a.mask > 0) | (b.mask > 0))
+    return np.count_nonzero((a.mask > 0) & (b.mask > 0)) / union if union else 0.0
+
+
+def blend(crop: np.ndarray, cleaned: np.ndarray, crop_mask: np.ndarray) -> np.ndarray:
+    """遮罩邊緣羽化後混合，遮罩外保留原圖像素。"""
+    alpha = cv2.GaussianBlur(cv2.dilate(crop_mask, np.ones((5, 5), np.uint8)), (0, 0), 3)
+    alpha = (alpha.astype(np.float32) / 255)[:, :, None]
+    return (crop * (1 - alpha) + cleaned * alpha).astype(np.uint8)
@@ -0,0 +1,162 @@
+"""程序內的處理統計，以 Prometheus 文字格式輸出 (GET /metrics)，也供 Streamlit 統計面板讀取。
+
+只需要計數器與直方圖，因此不另外引入 prometheus_client。
+各階段耗時一律記在 watermark_stage_seconds{stage=...}：
+伺服器端 read / preprocess / rate_limit / model / retry_wait / decode / assemble / local / detect / encode / mask，
+瀏覽器回報的 upload / download / render。
+"""
+
+import threading
+import time
+from collections.abc import Callable
+from contextlib import contextmanager
+
+# 秒；涵蓋本機處理的毫秒級到 Gemini 重試後的數十秒
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+Labels = tuple[tuple[str, str], ...]
+
+
+def _labels(labels: dict[str, str]) -> Labels:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _format(labels: Labels, extra: Labels = ()) -> str:
+    pairs = labels + extra
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in pairs) + "}"
+
+
+class Counter:
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        self._values: dict[Labels, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = _labels(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def values(self) -> dict[Labels, float]:
+        with self._lock:
+            return dict(self._values)
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        lines += [f"{self.name}{_format(k)} {v:g}" for k, v in sorted(self.values().items())]
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, buckets: tuple[float, ...] = BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = buckets
+        self._series: dict[Labels, list] = {}  # [各 bucket 計數..., 總和, 次數]
+        self._lock = threading.Lock()
+
+    def observe(self, seconds: float, **labels: str) -> None:
+        key = _labels(labels)
+        with self._lock:
+            series = self._series.setdefault(key, [0] * len(self.buckets) + [0.0, 0])
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    series[i] += 1
+            series[-2] += seconds
+            series[-1] += 1
+
+    @contextmanager
+    def time(self, **labels: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def summary(self) -> dict[Labels, dict]:
+        """各序列的次數、平均與由 bucket 估計的 p50/p95 (秒)。"""
+        with self._lock:
+            series = {k: list(v) for k, v in self._series.items()}
+        out = {}
+        for key, values in series.items():
+            count, total = values[-1], values[-2]
+
+            def quantile(q: float) -> float | None:
+                return next((b for b, n in zip(self.buckets, values) if n >= q * count), None)
+
+            out[key] = {"count": count, "mean": total / count if count else 0.0,
+                        "p50": quantile(0.5), "p95": quantile(0.95)}
+        return out
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = sorted((k, list(v)) for k, v in self._series.items())
+        for key, values in series:
+            for bound, n in zip(self.buckets, values):
+                lines.append(f"{self.name}_bucket{_format(key, (('le', f'{bound:g}'),))} {n}")
+            lines.append(f"{self.name}_bucket{_format(key, (('le', '+Inf'),))} {values[-1]}")
+            lines.append(f"{self.name}_sum{_format(key)} {values[-2]:.6f}")
+            lines.append(f"{self.name}_count{_format(key)} {values[-1]}")
+        return lines
+
+
+STAGE_SECONDS = Histogram("watermark_stage_seconds", "Time spent per processing stage.")
+ITEM_SECONDS = Histogram("watermark_item_seconds", "End-to-end processing time per image on the server.")
+ITEMS = Counter("watermark_items_total", "Images finished, by status.")
+GEMINI_REQUESTS = Counter("watermark_gemini_requests_total", "Gemini generateContent calls, by HTTP status.")
+RETRIES = Counter("watermark_retries_total", "Gemini calls retried, by HTTP status.")
+CACHE = Counter("watermark_cache_requests_total", "Result cache lookups, by result.")
+FRAMES = Counter("watermark_frames_total", "Animation and video frames, by whether the cleaned region was reused.")
+
+REGISTRY: list[Counter | Histogram] = [STAGE_SECONDS, ITEM_SECONDS, ITEMS, GEMINI_REQUESTS, RETRIES, CACHE, FRAMES]
+
+# 輸出時才取值的量 (佇列長度、目前併發上限...)：名稱 → (說明, 回傳 {labels: 值} 的函式)
+_gauges: dict[str, tuple[str, Callable[[], dict[Labels, float]]]] = {}
+
+CLIENT_STAGES = frozenset({"upload", "download", "render"})
+
+
+def register_gauge(name: str, help: str, read: Callable[[], dict[Labels, float]]) -> None:
+    _gauges[name] = (help, read)
+
+
+def stage(name: str):
+    return STAGE_SECONDS.time(stage=name)
+
+
+def record_client_spans(spans: dict[str, list[float]]) -> None:
+    """瀏覽器回報的耗時；只接受已知的階段名稱，避免任意標籤撐大記憶體。"""
+    for name, values in spans.items():
+        if name in CLIENT_STAGES:
+            for seconds in values[:1000]:
+                STAGE_SECONDS.observe(max(0.0, float(seconds)), stage=name)
+
+
+def snapshot() -> dict:
+    """統計面板用的摘要。"""
+    def by(counter: Counter, label: str) -> dict[str, float]:
+        return {dict(k).get(label, ""): v for k, v in counter.values().items()}
+
+    cache = by(CACHE, "result")
+    lookups = sum(cache.values())
+    return {
+        "items": by(ITEMS, "status"),
+        "gemini": by(GEMINI_REQUESTS, "status"),
+        "retries": sum(RETRIES.values().values()),
+        "cache_hit_rate": cache.get("hit", 0) / lookups if lookups else None,
+        "stages": {dict(k)["stage"]: v for k, v in sorted(STAGE_SECONDS.summary().items())},
+    }
+
+
+def render() -> str:
+    lines = []
+    for metric in REGISTRY:
+        lines += metric.render()
+    for name, (help, read) in sorted(_gauges.items()):
+        lines += [f"# HELP {name} {help}", f"# TYPE {name} gauge"]
+        lines += [f"{name}{_format(k)} {v:g}" for k, v in sorted(read().items())]
+    return "\n".join(lines) + "\n"
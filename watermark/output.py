@@ -0,0 +1,73 @@
+"""輸出編碼：依來源格式 (或設定的 OUTPUT_FORMAT) 重新編碼結果。
+
+引擎與快取內部一律使用 PNG，但把 JPEG 照片存成 PNG 往往大上好幾倍。
+這裡在最後一步改回來源格式，JPEG 沿用來源的品質估計值，並保留 ICC 色彩描述檔與 EXIF。
+大圖的結果只有工作解析度，在這裡才疊回原圖 (preprocess.composite)，原尺寸的影像只編碼這一次。
+在行程池中執行，以多核心平行編碼。
+"""
+
+import io
+
+from PIL import Image
+
+from . import preprocess
+
+# Pillow 存檔格式；不在表內的來源 (BMP、GIF...) 輸出 PNG
+FORMATS = {"image/png": "PNG", "image/jpeg": "JPEG", "image/webp": "WEBP"}
+ALIASES = {"png": "image/png", "jpeg": "image/jpeg", "jpg": "image/jpeg", "webp": "image/webp"}
+
+# libjpeg 標準亮度量化表 (品質 50)，用來反推來源 JPEG 的品質
+_STD_LUMINANCE_SUM = sum([
+    16, 11, 10, 16, 24, 40, 51, 61, 12, 12, 14, 19, 26, 58, 60, 55,
+    14, 13, 16, 24, 40, 57, 69, 56, 14, 17, 22, 29, 51, 87, 80, 62,
+    18, 22, 37, 56, 68, 109, 103, 77, 24, 35, 55, 64, 81, 104, 113, 92,
+    49, 64, 78, 87, 103, 121, 120, 101, 72, 92, 95, 98, 112, 100, 103, 99,
+])
+EXIF_ORIENTATION = 0x0112
+
+
+def target_mime(source_mime: str, output_format: str) -> str:
+    """output_format 為 "source" 時沿用來源格式，否則為 png / jpeg / webp。"""
+    if output_format != "source":
+        return ALIASES[output_format]
+    return source_mime if source_mime in FORMATS else "image/png"
+
+
+def jpeg_quality(img: Image.Image) -> int | None:
+    tables = getattr(img, "quantization", None)
+    if not tables or 0 not in tables:
+        return None
+    scale = sum(tables[0]) * 100 / _STD_LUMINANCE_SUM
+    quality = 5000 / scale if scale > 100 else (200 - scale) / 2
+    return max(1, min(100, round(quality)))
+
+
+def encode_output(result: bytes, source: bytes, mime_type: str, quality: int = 0, composite: bool = False) -> bytes:
+    """把 result 編碼成 mime_type；quality 為 0 時依來源估計 (無法估計時用 90)。
+    composite 為 True 時 result 是工作解析度的結果，先把修改量疊回原圖再編碼。"""
+    params = {}
+    with Image.open(io.BytesIO(source)) as src:
+        if quality <= 0:
+            quality = (jpeg_quality(src) if src.format == "JPEG" else None) or 90
+        if src.info.get("icc_profile"):
+            params["icc_profile"] = src.info["icc_profile"]
+        exif = src.getexif()
+        if exif:
+            # 處理前已依 EXIF 轉正，避免檢視器再轉一次
+            exif[EXIF_ORIENTATION] = 1
+            params["exif"] = exif.tobytes()
+
+    fmt = FORMATS[mime_type]
+    if fmt == "JPEG":
+        params.update(quality=quality, optimize=True, progressive=True)
+    elif fmt == "WEBP":
+        params.update(quality=quality, method=4)
+
+    buf = io.BytesIO()
+    if composite:
+        merged = preprocess.composite(preprocess.decode(source), preprocess.decode(result))
+        Image.fromarray(merged).save(buf, fmt, **params)
+    else:
+        with Image.open(io.BytesIO(result)) as img:
+            img.convert("RGB").save(buf, fmt, **params)
+    return buf.getvalue()
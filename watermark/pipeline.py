@@ -0,0 +1,327 @@
+"""單張圖片的處理流程：快取 → 前處理/分塊 → Gemini (或本機引擎) → 組合。
+
+動畫與影片由 frames 模組逐格處理，每批影格的遮罩區域再交回這裡的 clean_regions。
+"""
+
+import base64
+import logging
+import multiprocessing
+import random
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import nullcontext
+from dataclasses import dataclass
+from pathlib import Path
+
+import cv2
+import numpy as np
+import requests
+
+from . import config, frames, gemini, local_engine, mask, metrics, output, preprocess
+from .cache import ResultCache, cache_key
+from .mask import SharedMask
+from .ratelimit import RETRYABLE_STATUS, RateController, backoff_delay, retry_after_seconds
+
+log = logging.getLogger(__name__)
+
+
+class ModelError(Exception):
+    """Gemini 沒有回傳圖片；保留原始狀態碼與回應內容以便轉發給呼叫端。"""
+
+    def __init__(self, status: int, data: dict, retry_after: str | None = None):
+        if status == 200:
+            message = gemini.describe_failure(data)
+        else:
+            message = (data.get("error") or {}).get("message") or f"HTTP {status}"
+        super().__init__(message)
+        self.status = status
+        self.data = data
+        self.retry_after = retry_after
+
+    @property
+    def local_fallback_ok(self) -> bool:
+        """API 拒絕生成 (200 但沒有圖片) 或被限流時，可改用本機引擎。"""
+        return self.status in (200, 429)
+
+    @property
+    def retryable(self) -> bool:
+        return self.status in RETRYABLE_STATUS
+
+
+@dataclass
+class Result:
+    data: bytes
+    mime_type: str
+    cached: bool = False
+    composite: bool = False  # data 為工作解析度的結果，輸出時才把修改量疊回原圖
+
+
+# gemini：只用 API；local：只用本機 OpenCV；auto：API 拒絕或限流時改用本機
+ENGINES = ("gemini", "local", "auto")
+
+
+class Pipeline:
+    """有 limiter 時依 RateController 排隊並自動重試 (API 伺服器與 CLI 都會傳入)；
+    limiter 為 None 時每次只呼叫一次 Gemini、不限流也不重試，錯誤直接拋給呼叫端。"""
+
+    def __init__(self, api_key: str, cache: ResultCache, local_pool: Executor, limiter: RateController | None = None):
+        self.api_key = api_key
+        self.cache = cache
+        self.local_pool = local_pool
+        self.limiter = limiter
+
+    def process(self, image: bytes, mime_type: str, engine: str = "gemini", mask: SharedMask | None = None) -> Result:
+        result = self._clean(image, mime_type, engine, mask)
+        # 結果仍偵測得到浮水印 (或無法解碼) 時略過快取重新生成；本機引擎結果固定，重試無意義。
+        # 快取裡的結果不一定通過檢查 (重試用完仍沒通過的也在)，因此命中快取時同樣要檢查，
+        # 只有確認通過過的結果才略過；重試按鈕因此會真的重新生成
+        for _ in range(config.VERIFY_RETRIES if engine != "local" else 0):
+            if self._verified(result):
+                break
+            log.info("Watermark still detected in result, regenerating")
+            result = self._clean(image, mime_type, engine, mask, refresh=True)
+        return self._encode(result, image, mime_type)
+
+    def _verified(self, result: Result) -> bool:
+        """result 已偵測不到浮水印；通過的結果以其內容為鍵在快取記一筆空紀錄，之後命中同一份結果時不必再檢查。"""
+        key = cache_key(result.data, "", f"verified/{config.WATERMARK_THRESHOLD}")
+        if self.cache.contains(key):
+            return True
+        try:
+            with metrics.stage("detect"):
+                score = self.local_pool.submit(local_engine.score_image, result.data).result()
+        except OSError as e:
+            log.warning("Cannot decode the result to check it: %s", e)
+            return False
+        if score >= config.WATERMARK_THRESHOLD:
+            return False
+        self.cache.put(key, b"", "application/octet-stream")
+        return True
+
+    def detect(self, images: list[bytes]) -> list[float | None]:
+        """各圖的浮水印分數 (無法解碼為 None)，在行程池中平行計算。"""
+        futures = [self.local_pool.submit(local_engine.score_image, image) for image in images]
+        scores = []
+        for future in futures:
+            try:
+                scores.append(future.result())
+            except OSError:
+                scores.append(None)
+        return scores
+
+    def _clean(self, image: bytes, mime_type: str, engine: str, mask: SharedMask | None = None,
+               refresh: bool = False) -> Result:
+        if mask is not None:
+            return self._process_roi(image, engine, mask, refresh)
+        if engine == "local":
+            return self._local(image)
+        try:
+            # auto 模式被限流時直接改用本機引擎，不在這裡等待重試
+            return self._remote(image, mime_type, refresh, retry_throttled=engine != "auto")
+        except ModelError as e:
+            if engine != "auto" or not e.local_fallback_ok:
+                raise
+            log.info("Gemini unavailable (%s), falling back to local engine", e)
+            return self._local(image)
+
+    def _process_roi(self, image: bytes, engine: str, shared: SharedMask, refresh: bool = False) -> Result:
+        """只把共用遮罩周圍的區域送去處理，再貼回原圖的遮罩範圍。"""
+        key = cache_key(image, f"{gemini.PROMPT}\0roi:{shared.key}", f"{gemini.MODEL_IMAGE_EDIT}/{engine}")
+        hit = None if refresh else self.cache.get(key)
+        if hit is not None:
+            return Result(*hit, cached=True)
+
+        try:
+            with metrics.stage("decode"):
+                rgb = preprocess.decode(image)
+        except OSError as e:
+            raise ModelError(422, {"error": {"message": f"Cannot decode image: {e}"}}) from e
+        height, width = rgb.shape[:2]
+        box = shared.roi(width, height, config.MASK_ROI_MARGIN)
+        region = (slice(box.y, box.y + box.h), slice(box.x, box.x + box.w))
+        crop, crop_mask = rgb[region], shared.resize(width, height)[region]
+        cleaned = self._clean_region(crop, crop_mask, engine, refresh)
+
+        with metrics.stage("assemble"):
+            merged = rgb.copy()
+            merged[region] = mask.blend(crop, cleaned, crop_mask)
+            result = Result(preprocess.encode(merged), "image/png")
+        self.cache.put(key, result.data, result.mime_type)
+        return result
+
+    def _clean_region(self, crop: np.ndarray, crop_mask: np.ndarray, engine: str, refresh: bool = False) -> np.ndarray:
+        if engine != "local":
+            try:
+                out = self._remote(preprocess.encode(crop, "image/jpeg"), "image/jpeg", refresh,
+                                   retry_throttled=engine != "auto")
+            except ModelError as e:
+                if engine != "auto" or not e.local_fallback_ok:
+                    raise
+                log.info("Gemini unavailable (%s), inpainting the masked region locally", e)
+            else:
+                with metrics.stage("decode"):
+                    cleaned = preprocess.decode(out.data)
+                    if out.composite:
+                        return preprocess.composite(crop, cleaned)
+                    return preprocess.resize(cleaned, crop.shape[1], crop.shape[0])
+        # 已知遮罩，本機引擎直接修補，不必重新偵測
+        future = self.local_pool.submit(local_engine.inpaint, crop, crop_mask,
+                                        config.LOCAL_INPAINT_METHOD, config.LOCAL_INPAINT_RADIUS)
+        with metrics.stage("local"):
+            return future.result()
+
+    def clean_regions(self, crops: list[np.ndarray], crop_mask: np.ndarray, engine: str) -> list[np.ndarray]:
+        """平行處理一批同尺寸的區域：本機引擎交給行程池，Gemini 由執行緒送出 (併發仍受 limiter 控制)。"""
+        if engine == "local":
+            futures = [self.local_pool.submit(local_engine.inpaint, crop, crop_mask, config.LOCAL_INPAINT_METHOD,
+                                              config.LOCAL_INPAINT_RADIUS) for crop in crops]
+            with metrics.stage("local"):
+                return [future.result() for future in futures]
+        with ThreadPoolExecutor(max(1, min(len(crops), config.MAX_CONCURRENCY))) as threads:
+            return list(threads.map(lambda crop: self._clean_region(crop, crop_mask, engine), crops))
+
+    def process_animation(self, source: Path, target: Path, mime_type: str, engine: str = "gemini") -> frames.ClipResult:
+        """動畫或影片：逐格處理後寫到 target。"""
+        try:
+            return frames.process_clip(source, target, mime_type,
+                                       lambda crops, crop_mask: self.clean_regions(crops, crop_mask, engine))
+        except (OSError, ValueError, cv2.error) as e:
+            raise ModelError(422, {"error": {"message": f"Cannot process animation: {e}"}}) from e
+
+    def reuse(self, result: Result, image: bytes, mime_type: str) -> Result:
+        """把代表圖的結果套用到近似重複的圖：縮放到該圖的尺寸，再依該圖的格式編碼。"""
+        try:
+            width, height = preprocess.image_size(image)
+            cleaned = preprocess.resize(preprocess.decode(result.data), width, height)
+        except OSError as e:
+            raise ModelError(422, {"error": {"message": f"Cannot decode image: {e}"}}) from e
+        return self._encode(Result(preprocess.encode(cleaned), "image/png", cached=True), image, mime_type)
+
+    def _encode(self, result: Result, source: bytes, source_mime: str) -> Result:
+        """快取內存的是 PNG，最後才依來源格式重新編碼 (在行程池中平行執行)。"""
+        target = output.target_mime(source_mime, config.OUTPUT_FORMAT)
+        future = self.local_pool.submit(output.encode_output, result.data, source, target, config.OUTPUT_QUALITY,
+                                        result.composite)
+        try:
+            with metrics.stage("encode"):
+                return Result(future.result(), target, result.cached)
+        except OSError as e:
+            raise ModelError(422, {"error": {"message": f"Cannot encode output: {e}"}}) from e
+
+    def _remote(self, image: bytes, mime_type: str, refresh: bool = False, retry_throttled: bool = True) -> Result:
+        if not preprocess.needs_plan(image):
+            return self._generate(image, mime_type, refresh, retry_throttled)
+        # 大圖快取的是工作解析度的結果 (與原圖疊合留到 _encode)，因此與原圖直送的結果分開存放
+        key = cache_key(image, gemini.PROMPT, f"{gemini.MODEL_IMAGE_EDIT}/work")
+        hit = None if refresh else self.cache.get(key)
+        if hit is not None:
+            return Result(*hit, cached=True, composite=True)
+
+        with metrics.stage("preprocess"):
+            plan = preprocess.make_plan(image)
+            parts = [preprocess.encode(part, "image/jpeg") for part in plan.parts()] if plan else []
+        if plan is None:
+            return self._generate(image, mime_type, refresh, retry_throttled)
+
+        if len(parts) == 1:
+            # 不分塊時模型的輸出就是工作解析度的結果，不必解碼再編碼
+            out = self._generate(parts[0], "image/jpeg", refresh, retry_throttled)
+            result = Result(out.data, out.mime_type, composite=True)
+            self.cache.put(key, result.data, result.mime_type)
+            return result
+
+        # 分塊平行送出 (併發仍受 limiter 控制)，且各自快取，某塊被限流時重試整張圖不會重複付費
+        def generate(part: bytes) -> np.ndarray:
+            out = self._generate(part, "image/jpeg", refresh, retry_throttled)
+            with metrics.stage("decode"):
+                return preprocess.decode(out.data)
+
+        with ThreadPoolExecutor(max(1, min(len(parts), config.MAX_CONCURRENCY))) as threads:
+            outputs = list(threads.map(generate, parts))
+        with metrics.stage("assemble"):
+            result = Result(preprocess.encode(preprocess.assemble(plan, outputs)), "image/png", composite=True)
+        self.cache.put(key, result.data, result.mime_type)
+        return result
+
+    def _generate(self, image: bytes, mime_type: str, refresh: bool = False, retry_throttled: bool = True) -> Result:
+        key = cache_key(image, gemini.PROMPT, gemini.MODEL_IMAGE_EDIT)
+        hit = None if refresh else self.cache.get(key)
+        if hit is not None:
+            return Result(*hit, cached=True)
+
+        payload = gemini.build_payload(base64.b64encode(image).decode(), mime_type)
+        # MAX_RETRIES 為總嘗試次數，設為 0 或負數時仍至少呼叫一次
+        attempts = max(1, config.MAX_RETRIES)
+        for attempt in range(attempts):
+            try:
+                part = self._call(payload)
+                break
+            except ModelError as e:
+                if self.limiter is None or not e.retryable:
+                    raise
+                hint = retry_after_seconds(e.retry_after, e.data)
+                delay = hint + random.random() if hint is not None else backoff_delay(attempt)
+                if e.status == 429 and not retry_throttled:
+                    # 仍要讓其他請求一起降速，只是這一張不等待
+                    self.limiter.on_throttle(delay)
+                    raise
+                if attempt == attempts - 1:
+                    raise
+                metrics.RETRIES.inc(status=str(e.status))
+                if e.status == 429:
+                    # 冷卻期間的等待記在下一次取得 slot 的 rate_limit 階段
+                    self.limiter.on_throttle(delay)
+                else:
+                    with metrics.stage("retry_wait"):
+                        time.sleep(delay)
+
+        result = Result(base64.b64decode(part["data"]), part.get("mimeType", "image/png"))
+        self.cache.put(key, result.data, result.mime_type)
+        return result
+
+    def _call(self, payload: dict) -> dict:
+        with self.limiter.slot() if self.limiter else nullcontext():
+            try:
+                with metrics.stage("model"):
+                    response = gemini.generate_content(self.api_key, payload)
+            except requests.RequestException as e:
+                metrics.GEMINI_REQUESTS.inc(status="network")
+                raise ModelError(502, {"error": {"message": str(e)}}) from e
+        try:
+            data = response.json()
+        except ValueError:
+            data = {"error": {"message": f"HTTP {response.status_code}"}}
+
+        part = gemini.find_image_part(data) if response.ok else None
+        metrics.GEMINI_REQUESTS.inc(status="no_image" if response.ok and part is None else str(response.status_code))
+        if part is None:
+            raise ModelError(response.status_code, data, response.headers.get("Retry-After"))
+        if self.limiter:
+            self.limiter.on_success()
+        return part
+
+    def _local(self, image: bytes) -> Result:
+        method = config.LOCAL_INPAINT_METHOD
+        key = cache_key(image, "", f"opencv-{method}")
+        hit = self.cache.get(key)
+        if hit is not None:
+            return Result(*hit, cached=True)
+
+        future = self.local_pool.submit(local_engine.remove_watermark, image, method, config.LOCAL_INPAINT_RADIUS)
+        try:
+            with metrics.stage("local"):
+                data = future.result()
+        except OSError as e:
+            raise ModelError(422, {"error": {"message": f"Cannot decode image: {e}"}}) from e
+        if data is None:
+            raise ModelError(422, {"error": {"message": "No watermark detected by the local engine"}})
+        result = Result(data, "image/png")
+        self.cache.put(key, result.data, result.mime_type)
+        return result
+
+
+def create_pipeline(api_key: str, limiter: RateController | None = None) -> Pipeline:
+    cache = ResultCache(config.CACHE_DIR, config.CACHE_MAX_BYTES)
+    # spawn：避免在多執行緒的程序中 fork
+    local_pool = ProcessPoolExecutor(config.LOCAL_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    return Pipeline(api_key, cache, local_pool, limiter)
@@ -0,0 +1,154 @@
+"""送給模型前的解析度處理與大圖分塊。
+
+模型實際只在約 MODEL_MAX_SIDE 的解析度上作畫，原圖再大也只是增加上傳量。
+因此先把圖縮到 MODEL_MAX_SIDE 單次送出；只有最長邊超過 TILE_MIN_SIDE 的超大圖，
+才縮到 TILE_MAX_SIDE 並切成重疊的分塊 (浮水印文字縮到 1024 會糊掉)。
+模型回傳後只把「修改量」放大回原尺寸疊加到原圖上 (composite)，未被修改的區域保留原始細節；
+這一步放在最後的輸出編碼一起做，不另外產生一份原尺寸的 PNG。
+"""
+
+import io
+from dataclasses import dataclass
+
+import cv2
+import numpy as np
+from PIL import ExifTags, Image, ImageOps
+
+from . import config
+
+
+@dataclass(frozen=True)
+class Box:
+    x: int
+    y: int
+    w: int
+    h: int
+
+
+@dataclass
+class Plan:
+    work: np.ndarray  # 工作解析度 RGB
+    tiles: list[Box]  # 工作解析度上的分塊位置
+
+    def parts(self) -> list[np.ndarray]:
+        return [self.work[b.y:b.y + b.h, b.x:b.x + b.w] for b in self.tiles]
+
+
+def decode(data: bytes) -> np.ndarray:
+    with Image.open(io.BytesIO(data)) as img:
+        return np.asarray(ImageOps.exif_transpose(img).convert("RGB"))
+
+
+def encode(arr: np.ndarray, mime_type: str = "image/png", quality: int = 92) -> bytes:
+    buf = io.BytesIO()
+    fmt = "JPEG" if mime_type == "image/jpeg" else "PNG"
+    Image.fromarray(arr).save(buf, fmt, quality=quality)
+    return buf.getvalue()
+
+
+def resize(arr: np.ndarray, width: int, height: int) -> np.ndarray:
+    if arr.shape[1] == width and arr.shape[0] == height:
+        return arr
+    shrinking = width * height < arr.shape[0] * arr.shape[1]
+    return cv2.resize(arr, (width, height), interpolation=cv2.INTER_AREA if shrinking else cv2.INTER_CUBIC)
+
+
+def fit(width: int, height: int, max_side: int) -> tuple[int, int]:
+    scale = min(1.0, max_side / max(width, height))
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def tile_boxes(width: int, height: int, size: int, overlap: int) -> list[Box]:
+    """以 size 為上限切出互相重疊 overlap 的分塊，並平均分配分塊大小。"""
+    def spans(length: int) -> list[tuple[int, int]]:
+        if length <= size:
+            return [(0, length)]
+        count = -(-(length - overlap) // (size - overlap))
+        step = (length - size) / (count - 1)
+        return [(round(i * step), size) for i in range(count)]
+
+    return [Box(x, y, w, h) for y, h in spans(height) for x, w in spans(width)]
+
+
+def needs_plan(data: bytes) -> bool:
+    """只讀檔頭判斷是否超過模型解析度；無法辨識的檔案直接送出。"""
+    try:
+        return max(image_size(data)) > config.MODEL_MAX_SIDE
+    except OSError:
+        return False
+
+
+def work_size(width: int, height: int) -> tuple[int, int]:
+    """送給模型的工作解析度：一般縮到 MODEL_MAX_SIDE，超大圖縮到 TILE_MAX_SIDE 再分塊。"""
+    limit = config.TILE_MAX_SIDE if max(width, height) > config.TILE_MIN_SIDE else config.MODEL_MAX_SIDE
+    return fit(width, height, limit)
+
+
+def make_plan(data: bytes) -> Plan | None:
+    """不需處理 (已在模型解析度內或無法解碼) 時回傳 None，直接送出原始檔案。"""
+    try:
+        original = decode(data)
+    except OSError:
+        return None
+    height, width = original.shape[:2]
+    if max(width, height) <= config.MODEL_MAX_SIDE:
+        return None
+    work_w, work_h = work_size(width, height)
+    work = resize(original, work_w, work_h)
+    return Plan(work, tile_boxes(work_w, work_h, config.MODEL_MAX_SIDE, config.TILE_OVERLAP))
+
+
+def _feather(box: Box, width: int, height: int, overlap: int) -> np.ndarray:
+    """分塊的融合權重：與其他分塊相鄰的邊在重疊區內線性淡出。"""
+    def ramp(length: int, start_open: bool, end_open: bool) -> np.ndarray:
+        w = np.ones(length, np.float32)
+        n = min(overlap, length // 2)
+        if n > 0:
+            edge = (np.arange(n, dtype=np.float32) + 1) / (n + 1)
+            if start_open:
+                w[:n] = edge
+            if end_open:
+                w[-n:] = edge[::-1]
+        return w
+
+    wx = ramp(box.w, box.x > 0, box.x + box.w < width)
+    wy = ramp(box.h, box.y > 0, box.y + box.h < height)
+    return wy[:, None] * wx[None, :]
+
+
+def assemble(plan: Plan, outputs: list[np.ndarray]) -> np.ndarray:
+    """把模型輸出的分塊融合回工作解析度。"""
+    work_h, work_w = plan.work.shape[:2]
+    acc = np.zeros((work_h, work_w, 3), np.float32)
+    weight = np.zeros((work_h, work_w, 1), np.float32)
+    for box, out in zip(plan.tiles, outputs):
+        w = _feather(box, work_w, work_h, config.TILE_OVERLAP)[:, :, None]
+        acc[box.y:box.y + box.h, box.x:box.x + box.w] += resize(out, box.w, box.h).astype(np.float32) * w
+        weight[box.y:box.y + box.h, box.x:box.x + box.w] += w
+    return np.clip(acc / np.maximum(weight, 1e-6) + 0.5, 0, 255).astype(np.uint8)
+
+
+def composite(original: np.ndarray, cleaned: np.ndarray) -> np.ndarray:
+    """把工作解析度的修改量放大疊加到原圖；以 int16 計算，原尺寸只多佔兩份記憶體。"""
+    height, width = original.shape[:2]
+    work = resize(original, cleaned.shape[1], cleaned.shape[0])
+    delta = resize(cleaned.astype(np.int16) - work.astype(np.int16), width, height)
+    return np.clip(original.astype(np.int16) + delta, 0, 255).astype(np.uint8)
+
+
+def image_size(data: bytes) -> tuple[int, int]:
+    """只讀檔頭取得轉正後的 (寬, 高)，不解碼像素。"""
+    with Image.open(io.BytesIO(data)) as img:
+        width, height = img.size
+        if img.getexif().get(ExifTags.Base.Orientation) in (5, 6, 7, 8):
+            return height, width
+        return width, height
+
+
+def load_thumbnail(data: bytes, max_side: int = 320) -> np.ndarray:
+    """解碼為縮圖；JPEG 會直接以較低解析度解碼，省下記憶體與時間。"""
+    with Image.open(io.BytesIO(data)) as img:
+        img.draft("RGB", (max_side, max_side))
+        img = ImageOps.exif_transpose(img).convert("RGB")
+        img.thumbnail((max_side, max_side))
+        return np.asarray(img)
@@ -0,0 +1,117 @@
+"""伺服器端的速率控制：令牌桶 + AIMD 併發上限 + 共用冷卻。
+
+所有 Gemini 呼叫都在伺服器端：API 伺服器的 JobWorker 與 CLI 各自持有一個 RateController，
+由 Pipeline 在送出前排隊、遇到限流時冷卻並重試；瀏覽器只呼叫 /api，不再直接呼叫 Gemini，也沒有前端的速率控制。
+"""
+
+import random
+import threading
+import time
+from contextlib import contextmanager
+from email.utils import parsedate_to_datetime
+
+from . import metrics
+
+# 可重試的 HTTP 狀態碼；其餘錯誤 (400/401/403/404...) 直接失敗
+RETRYABLE_STATUS = frozenset({408, 429, 500, 502, 503, 504})
+BACKOFF_BASE = 2.0
+BACKOFF_MAX = 32.0
+
+
+class TokenBucket:
+    def __init__(self, rate_per_minute: float, capacity: int):
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.rate = rate_per_minute / 60
+        self.last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def take(self) -> None:
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.rate)
+                self.last = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                delay = (1 - self.tokens) / self.rate
+            time.sleep(delay)
+
+
+class RateController:
+    def __init__(self, rate_per_minute: float, burst: int, max_concurrency: int):
+        self.bucket = TokenBucket(rate_per_minute, burst)
+        self.max_concurrency = max_concurrency
+        self.limit = float(max_concurrency)
+        self.in_flight = 0
+        self.cooldown_until = 0.0
+        self._cond = threading.Condition()
+
+    def acquire(self) -> None:
+        with self._cond:
+            while self.in_flight >= int(self.limit):
+                self._cond.wait()
+            self.in_flight += 1
+        while True:
+            pause = self.cooldown_until - time.monotonic()
+            if pause > 0:
+                time.sleep(pause)
+                continue
+            self.bucket.take()
+            if time.monotonic() >= self.cooldown_until:
+                return
+
+    def release(self) -> None:
+        with self._cond:
+            self.in_flight -= 1
+            self._cond.notify_all()
+
+    @contextmanager
+    def slot(self):
+        with metrics.stage("rate_limit"):
+            self.acquire()
+        try:
+            yield
+        finally:
+            self.release()
+
+    # 加法增加：每次成功約在一個「併發窗口」後把上限加一
+    def on_success(self) -> None:
+        with self._cond:
+            self.limit = min(self.max_concurrency, self.limit + 1 / self.limit)
+            self._cond.notify_all()
+
+    # 乘法減少：同一次冷卻期間內的多個 429 只減半一次
+    def on_throttle(self, delay: float) -> None:
+        with self._cond:
+            now = time.monotonic()
+            if now >= self.cooldown_until:
+                self.limit = max(1.0, self.limit / 2)
+            self.cooldown_until = max(self.cooldown_until, now + delay)
+
+
+def backoff_delay(attempt: int) -> float:
+    """指數退避 + 抖動 (equal jitter)。"""
+    exp = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt)
+    return exp / 2 + random.random() * exp / 2
+
+
+def retry_after_seconds(header: str | None, data: dict) -> float | None:
+    """讀取伺服器提示的等待時間：Retry-After 標頭或 google.rpc.RetryInfo 的 retryDelay。"""
+    if header:
+        try:
+            return max(0.0, float(header))
+        except ValueError:
+            pass
+        try:
+            return max(0.0, parsedate_to_datetime(header).timestamp() - time.time())
+        except (TypeError, ValueError):
+            pass
+    for detail in (data.get("error") or {}).get("details") or []:
+        if str(detail.get("@type", "")).endswith("google.rpc.RetryInfo"):
+            try:
+                return float(str(detail.get("retryDelay", "")).rstrip("s"))
+            except ValueError:
+                return None
+    return None
@@ -0,0 +1,46 @@
+"""跨使用者的公平排程。
+
+整個程序共用一組處理執行緒與 Gemini 配額，若依建立順序處理，
+一個 500 張的批次會讓其他人全部排在後面。這裡以加權公平佇列 (WFQ) 挑選下一個項目：
+每個使用者 (session) 有一個虛擬時間，每處理一張就加上 1/權重，
+總是從虛擬時間最小的使用者取件；同一使用者內剩餘張數最少的工作優先。
+"""
+
+import threading
+
+from . import config
+from .jobs import JobStore, Task
+
+
+class FairScheduler:
+    def __init__(self, store: JobStore, weights: dict[str, float] | None = None, max_running: int | None = None):
+        self.store = store
+        self.weights = weights or {}
+        self.max_running = max_running or config.SESSION_MAX_RUNNING
+        self._lock = threading.Lock()
+        self._vtime: dict[str, float] = {}
+
+    def claim(self) -> Task | None:
+        with self._lock:
+            backlog = self.store.session_backlog()
+            waiting = {s for s, (pending, _) in backlog.items() if pending}
+            if not waiting:
+                self._vtime.clear()
+                return None
+
+            # 閒置的使用者不累積額度：回來時從目前最小的虛擬時間開始
+            for session in list(self._vtime):
+                if session not in waiting:
+                    del self._vtime[session]
+            floor = min(self._vtime.values(), default=0.0)
+            for session in waiting:
+                self._vtime.setdefault(session, floor)
+
+            # 有其他人在等時，單一使用者不能佔滿所有處理執行緒
+            eligible = [s for s in waiting if backlog[s][1] < self.max_running] if len(waiting) > 1 else list(waiting)
+            for session in sorted(eligible or waiting, key=lambda s: (self._vtime[s], s)):
+                task = self.store.claim_item(session)
+                if task is not None:
+                    self._vtime[session] += 1 / self.weights.get(session, 1.0)
+                    return task
+            return None
@@ -0,0 +1,546 @@
+// 伺服器設定 (Python 會自動替換成實際值)
+const SERVER_CONFIG = {};
+// 內部 API 位址：未指定時為同源的 /api (由 watermark.gateway 轉送)
+const API_BASE = SERVER_CONFIG.apiBase || `${new URL(document.baseURI).origin}/api`;
+// 這個 Streamlit session 的 API 權杖；下載連結無法帶標頭，改放在網址參數
+const API_TOKEN = SERVER_CONFIG.token || '';
+// 批次交給伺服器端的工作佇列處理 (速率限制與重試都在伺服器)
+const UPLOAD_CONCURRENCY = 4;
+const POLL_INTERVAL_MS = 1000;
+// 匯入後以縮圖做浮水印偵測，只預先勾選疑似有浮水印的圖；每次請求送出的縮圖數
+const DETECT_BATCH_SIZE = 16;
+// 工作 ID 存在 localStorage，重新整理後可接回同一個批次
+const JOB_STORAGE_KEY = 'watermarkJobId';
+// 這個瀏覽器的識別碼，伺服器依此在多位使用者之間公平排程
+// 縮圖最長邊 (像素)；原圖以 File/Blob 保存，送出時才編碼
+const THUMB_MAX_SIZE = 320;
+// 選擇格線的虛擬化：只渲染可視範圍上下各 OVERSCAN_ROWS 列
+const TILE_GAP = 16;
+const OVERSCAN_ROWS = 2;
+
+// 狀態變數
+let pendingItems = [];
+let results = [];
+let selectedCount = 0;
+let batchEngine = 'gemini';
+let currentJobId = null;
+let jobFollower = null;
+let seenItems = [];
+let visibleRange = null;
+// 瀏覽器端各階段耗時 (秒)，定期回報給伺服器的 /metrics
+let clientSpans = {};
+
+// 國際化字串 (繁體中文)
+const i18n = {
+    processing: "正在處理",
+    analyzing: "分析中",
+    aiRemoving: "AI 正在移除浮水印並修補背景...",
+    analyzingMask: "正在分析整批圖片的浮水印位置...",
+    unsupportedFormat: "不支援的檔案格式，請上傳圖片或影片",
+    readFailed: "檔案讀取失敗",
+    apiKeyInvalid: "API Key 無效或環境錯誤",
+    apiNoImage: "API 拒絕生成影像 (可能涉及敏感內容或版權)",
+    uploading: "正在上傳圖片",
+    jobExpired: "找不到先前的批次 (可能已過期)",
+    readingFiles: "正在讀取圖片...",
+    detecting: "正在偵測浮水印...",
+    detected: (count, total) => `已自動勾選 ${count} / ${total} 張疑似有浮水印的圖片`,
+    success: "成功",
+    failed: "失敗"
+};
+
+const dropZone = document.getElementById('drop-zone');
+const fileInput = document.getElementById('file-input');
+const uploadSection = document.getElementById('upload-section');
+const selectionSection = document.getElementById('selection-section');
+const selectionGrid = document.getElementById('selection-grid');
+const selectionSpacer = document.getElementById('selection-spacer');
+const selectionWindow = document.getElementById('selection-window');
+const progressSection = document.getElementById('progress-section');
+const resultsSection = document.getElementById('results-section');
+const progressBar = document.getElementById('progress-bar');
+const progressTitle = document.getElementById('progress-title');
+const progressDetail = document.getElementById('progress-detail');
+const progressCount = document.getElementById('progress-count');
+const resultsGrid = document.getElementById('results-grid');
+const toast = document.getElementById('toast');
+const selectedCountSpan = document.getElementById('selected-count');
+const downloadAllBtn = document.getElementById('download-all-btn');
+
+function showToast(msg, isError = false) {
+    toast.textContent = msg;
+    toast.style.backgroundColor = isError ? '#ef4444' : '#1e293b';
+    toast.style.borderColor = isError ? '#b91c1c' : '#334155';
+    toast.classList.replace('opacity-0', 'opacity-100');
+    setTimeout(() => toast.classList.replace('opacity-100', 'opacity-0'), 3000);
+}
+
+const wait = (ms) => new Promise(res => setTimeout(res, ms));
+
+// 內部 API 請求；非 2xx 時拋出帶狀態碼的錯誤
+async function api(path, options = {}) {
+    const headers = { ...options.headers, 'X-Session-Token': API_TOKEN };
+    const response = await fetch(`${API_BASE}${path}`, { ...options, headers });
+    if (!response.ok) {
+        const data = await response.json().catch(() => ({}));
+        const err = new Error(data.error?.message || `HTTP ${response.status}`);
+        err.status = response.status;
+        throw err;
+    }
+    return response;
+}
+
+const apiJson = (path, method, body) => api(path, { method, headers: { 'Content-Type': 'application/json' }, body: JSON.stringify(body) });
+
+async function timed(stage, fn) {
+    const start = performance.now();
+    try { return await fn(); }
+    finally { (clientSpans[stage] ||= []).push((performance.now() - start) / 1000); }
+}
+
+function flushSpans() {
+    if (!Object.keys(clientSpans).length) return;
+    const spans = clientSpans;
+    clientSpans = {};
+    apiJson('/metrics/client', 'POST', { spans }).catch(() => {});
+}
+
+function saveJobId(jobId) {
+    try {
+        if (jobId) localStorage.setItem(JOB_STORAGE_KEY, jobId);
+        else localStorage.removeItem(JOB_STORAGE_KEY);
+    } catch (e) { /* 沙箱內可能無法使用 localStorage */ }
+}
+
+function loadJobId() {
+    try { return localStorage.getItem(JOB_STORAGE_KEY); } catch (e) { return null; }
+}
+
+// 拖放與檔案選擇事件
+dropZone.onclick = () => fileInput.click();
+fileInput.onchange = e => handleFiles(e.target.files);
+dropZone.ondragover = (e) => { e.preventDefault(); dropZone.classList.add('drop-zone-active'); };
+dropZone.ondragleave = () => dropZone.classList.remove('drop-zone-active');
+dropZone.ondrop = (e) => { e.preventDefault(); dropZone.classList.remove('drop-zone-active'); handleFiles(e.dataTransfer.files); };
+
+async function handleFiles(files) {
+    if (!files || files.length === 0) return;
+    dropZone.innerHTML = `<div class="loader mx-auto mb-4"></div><p class="text-slate-300">${i18n.readingFiles}</p>`;
+    dropZone.style.pointerEvents = 'none';
+    pendingItems.forEach(item => URL.revokeObjectURL(item.thumb));
+    pendingItems = [];
+    try {
+        for (let file of files) {
+            const isImage = file.type.startsWith('image/') || /\.(jpg|jpeg|png|webp|gif|bmp)$/i.test(file.name);
+            const isVideo = file.type.startsWith('video/');
+            if (isImage || isVideo) {
+                pendingItems.push({ 
+                    id: `img_${Date.now()}_${Math.random()}`, 
+                    type: isVideo ? 'video' : 'image', 
+                    name: file.name,
+                    mimeType: file.type || "image/png", 
+                    thumb: await (isVideo ? makeVideoThumbnail(file) : makeThumbnail(file)), 
+                    original: file, 
+                    selected: true 
+                });
+            }
+        }
+        if (pendingItems.length > 0) { renderSelectionGrid(); detectWatermarks(pendingItems); }
+        else { showToast(i18n.unsupportedFormat, true); location.reload(); }
+    } catch (err) { console.error(err); showToast(err.message || i18n.readFailed, true); setTimeout(() => location.reload(), 2000); }
+}
+
+// 匯入時縮小一次，回傳縮圖的 object URL；瀏覽器無法解碼時直接用原檔
+async function makeThumbnail(file) {
+    let bitmap;
+    try { bitmap = await createImageBitmap(file); }
+    catch (e) { return URL.createObjectURL(file); }
+    const scale = Math.min(1, THUMB_MAX_SIZE / Math.max(bitmap.width, bitmap.height));
+    const canvas = document.createElement('canvas');
+    canvas.width = Math.max(1, Math.round(bitmap.width * scale));
+    canvas.height = Math.max(1, Math.round(bitmap.height * scale));
+    canvas.getContext('2d').drawImage(bitmap, 0, 0, canvas.width, canvas.height);
+    bitmap.close();
+    const blob = await new Promise(res => canvas.toBlob(res, 'image/jpeg', 0.8));
+    return URL.createObjectURL(blob);
+}
+
+// 影片取第一秒附近的一格當縮圖；瀏覽器無法解碼時用深色底圖
+async function makeVideoThumbnail(file) {
+    const video = document.createElement('video');
+    const src = URL.createObjectURL(file);
+    const canvas = document.createElement('canvas');
+    try {
+        video.muted = true;
+        video.preload = 'auto';
+        video.src = src;
+        await new Promise((res, rej) => { video.onloadeddata = res; video.onerror = rej; });
+        video.currentTime = Math.min(1, video.duration / 2 || 0);
+        await new Promise(res => { video.onseeked = res; });
+        const scale = Math.min(1, THUMB_MAX_SIZE / Math.max(video.videoWidth, video.videoHeight));
+        canvas.width = Math.max(1, Math.round(video.videoWidth * scale));
+        canvas.height = Math.max(1, Math.round(video.videoHeight * scale));
+        canvas.getContext('2d').drawImage(video, 0, 0, canvas.width, canvas.height);
+    } catch (e) {
+        canvas.width = THUMB_MAX_SIZE;
+        canvas.height = Math.round(THUMB_MAX_SIZE * 9 / 16);
+        const ctx = canvas.getContext('2d');
+        ctx.fillStyle = '#1e293b';
+        ctx.fillRect(0, 0, canvas.width, canvas.height);
+    } finally {
+        video.removeAttribute('src');
+        URL.revokeObjectURL(src);
+    }
+    const blob = await new Promise(res => canvas.toBlob(res, 'image/jpeg', 0.8));
+    return URL.createObjectURL(blob);
+}
+
+// 偵測失敗時維持全選；使用者已手動勾選過的圖不會被覆蓋
+async function detectWatermarks(items) {
+    showToast(i18n.detecting, false);
+    try {
+        for (let start = 0; start < items.length; start += DETECT_BATCH_SIZE) {
+            const batch = items.slice(start, start + DETECT_BATCH_SIZE);
+            const thumbs = await Promise.all(batch.map(async item => (await fetch(item.thumb)).blob()));
+            const response = await api('/detect', {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/octet-stream', 'X-Image-Sizes': thumbs.map(b => b.size).join(',') },
+                body: new Blob(thumbs),
+            });
+            const { watermarked } = await response.json();
+            if (items !== pendingItems) return;
+            batch.forEach((item, i) => {
+                if (!item.touched && item.selected !== watermarked[i]) {
+                    item.selected = watermarked[i];
+                    selectedCount += item.selected ? 1 : -1;
+                }
+            });
+            visibleRange = null;
+            renderVisibleTiles();
+            updateSelectedCount();
+        }
+        showToast(i18n.detected(selectedCount, items.length), false);
+    } catch (e) {
+        console.error(e);
+    }
+}
+
+function renderSelectionGrid() {
+    uploadSection.classList.add('hidden');
+    selectionSection.classList.remove('hidden');
+    selectedCount = pendingItems.filter(i => i.selected).length;
+    selectionGrid.scrollTop = 0;
+    visibleRange = null;
+    renderVisibleTiles();
+    updateSelectedCount();
+}
+
+// 欄數與列高對應 Tailwind 的斷點 (grid-cols-2/md:4/lg:5、h-32/md:h-40)
+function gridLayout() {
+    const width = window.innerWidth;
+    const cols = width >= 1024 ? 5 : width >= 768 ? 4 : 2;
+    const rowHeight = (width >= 768 ? 160 : 128) + TILE_GAP;
+    return { cols, rowHeight };
+}
+
+function renderVisibleTiles() {
+    const { cols, rowHeight } = gridLayout();
+    const totalRows = Math.ceil(pendingItems.length / cols);
+    selectionSpacer.style.height = `${Math.max(0, totalRows * rowHeight - TILE_GAP)}px`;
+
+    const top = selectionGrid.scrollTop;
+    const firstRow = Math.max(0, Math.floor(top / rowHeight) - OVERSCAN_ROWS);
+    const lastRow = Math.min(totalRows, Math.ceil((top + selectionGrid.clientHeight) / rowHeight) + OVERSCAN_ROWS);
+    const key = `${cols}:${firstRow}:${lastRow}`;
+    if (key === visibleRange) return;
+    visibleRange = key;
+
+    selectionWindow.style.transform = `translateY(${firstRow * rowHeight}px)`;
+    const end = Math.min(pendingItems.length, lastRow * cols);
+    let html = '';
+    for (let index = firstRow * cols; index < end; index++) html += tileHtml(pendingItems[index], index);
+    selectionWindow.innerHTML = html;
+}
+
+function tileHtml(item, index) {
+    return `<div class="relative group"><label class="cursor-pointer block relative"><input type="checkbox" class="custom-checkbox hidden" data-index="${index}" ${item.selected ? 'checked' : ''}><div class="glass rounded-xl overflow-hidden border-2 border-transparent transition-all h-32 md:h-40 flex flex-col relative"><img src="${item.thumb}" decoding="async" class="w-full h-full object-cover opacity-80 group-hover:opacity-100 transition"><div class="check-icon absolute top-2 right-2 w-6 h-6 bg-rose-500 rounded-full flex items-center justify-center text-white shadow-lg transform scale-0 transition-transform duration-200"><svg xmlns="http://www.w3.org/2000/svg" class="h-4 w-4" fill="none" viewBox="0 0 24 24" stroke="currentColor"><path stroke-linecap="round" stroke-linejoin="round" stroke-width="3" d="M5 13l4 4L19 7" /></svg></div><div class="absolute bottom-0 left-0 right-0 bg-black/60 p-1 text-[10px] text-center truncate text-white backdrop-blur-sm">${item.name}</div></div></label></div>`;
+}
+
+let scrollFrame = 0;
+const scheduleTiles = () => {
+    if (scrollFrame) return;
+    scrollFrame = requestAnimationFrame(() => { scrollFrame = 0; renderVisibleTiles(); });
+};
+selectionGrid.addEventListener('scroll', scheduleTiles, { passive: true });
+window.addEventListener('resize', () => { if (pendingItems.length) scheduleTiles(); });
+
+// 勾選只更新該筆資料與計數，不重建格線
+selectionWindow.addEventListener('change', e => {
+    const index = Number(e.target.dataset.index);
+    if (Number.isNaN(index)) return;
+    toggleSelection(index, e.target.checked);
+});
+
+function toggleSelection(index, isChecked) {
+    const item = pendingItems[index];
+    if (item.selected === isChecked) return;
+    item.selected = isChecked;
+    item.touched = true;
+    selectedCount += isChecked ? 1 : -1;
+    updateSelectedCount();
+}
+
+function updateSelectedCount() {
+    const count = selectedCount;
+    selectedCountSpan.textContent = count;
+    document.getElementById('start-process-btn').disabled = count === 0;
+    document.getElementById('start-process-btn').classList.toggle('opacity-50', count === 0);
+}
+
+function setAllSelected(isSelected) {
+    pendingItems.forEach(i => { i.selected = isSelected; i.touched = true; });
+    selectedCount = isSelected ? pendingItems.length : 0;
+    selectionWindow.querySelectorAll('input[data-index]').forEach(cb => cb.checked = isSelected);
+    updateSelectedCount();
+}
+
+document.getElementById('select-all-btn').onclick = () => setAllSelected(true);
+document.getElementById('deselect-all-btn').onclick = () => setAllSelected(false);
+
+document.getElementById('start-process-btn').onclick = async () => {
+    const selectedItems = pendingItems.filter(i => i.selected);
+    if (selectedItems.length === 0) return;
+    batchEngine = document.getElementById('engine-select').value;
+    selectionSection.classList.add('hidden');
+    progressSection.classList.remove('hidden');
+    resultsSection.classList.add('hidden');
+    downloadAllBtn.classList.add('hidden');
+    try {
+        await processSelectedItems(selectedItems);
+    } catch (e) {
+        console.error("上傳錯誤:", e);
+        showToast(e.message, true);
+        progressSection.classList.add('hidden');
+        selectionSection.classList.remove('hidden');
+    }
+};
+
+// 建立工作 → 上傳原圖 → 開始處理，之後由伺服器在背景處理
+async function processSelectedItems(items) {
+    resetResults();
+    resultsSection.classList.remove('hidden');
+    items.forEach((item, i) => addPendingCard(i));
+
+    progressTitle.textContent = i18n.uploading;
+    progressDetail.textContent = '';
+    updateProgress(0, items.length);
+    const meta = items.map(item => ({ name: item.name, mimeType: item.mimeType }));
+    const { jobId } = await (await apiJson('/jobs', 'POST', { engine: batchEngine, items: meta })).json();
+
+    let next = 0;
+    let uploaded = 0;
+    const uploader = async () => {
+        while (next < items.length) {
+            const i = next++;
+            const item = items[i];
+            await timed('upload', () => api(`/jobs/${jobId}/items/${i}`, {
+                method: 'PUT',
+                headers: { 'Content-Type': item.mimeType || 'application/octet-stream' },
+                body: item.original,
+            }));
+            updateProgress(++uploaded, items.length);
+        }
+    };
+    await Promise.all(Array.from({ length: Math.min(UPLOAD_CONCURRENCY, items.length) }, uploader));
+    await api(`/jobs/${jobId}/start`, { method: 'POST' });
+    flushSpans();
+    saveJobId(jobId);
+    await followJob(jobId);
+}
+
+function resetResults() {
+    results.forEach(r => r?.url && URL.revokeObjectURL(r.url));
+    results = [];
+    seenItems = [];
+    resultsGrid.innerHTML = '';
+}
+
+function updateProgress(done, total) {
+    progressCount.textContent = `${done}/${total}`;
+    progressBar.style.width = `${total ? (done / total) * 100 : 0}%`;
+}
+
+// 輪詢工作狀態直到全部完成；斷線時持續重試，重新連上後從伺服器的狀態接續。
+// 重試單張時再排一輪輪詢，前一輪結束後才開始，不會同時有兩個迴圈
+function followJob(jobId) {
+    currentJobId = jobId;
+    jobFollower = (jobFollower || Promise.resolve()).then(() => pollJob(jobId));
+    return jobFollower;
+}
+
+async function pollJob(jobId) {
+    progressSection.classList.remove('hidden');
+    progressTitle.textContent = i18n.processing;
+    for (;;) {
+        let job;
+        try {
+            job = await (await api(`/jobs/${jobId}`)).json();
+        } catch (e) {
+            if (e.status === 404) {
+                saveJobId(null);
+                showToast(i18n.jobExpired, true);
+                progressSection.classList.add('hidden');
+                return;
+            }
+            await wait(POLL_INTERVAL_MS);
+            continue;
+        }
+        progressDetail.textContent = job.status === 'queued' || job.status === 'preparing' ? i18n.analyzingMask : i18n.aiRemoving;
+        updateProgress(job.finished, job.total);
+        await renderJobItems(jobId, job.items);
+        if (job.status === 'done') break;
+        await wait(POLL_INTERVAL_MS);
+    }
+
+    if (results.some(r => r && r.cleaned)) downloadAllBtn.classList.remove('hidden');
+    setTimeout(() => progressSection.classList.add('hidden'), 1000);
+}
+
+// 只更新狀態有變化的卡片；完成的項目下載一次結果
+async function renderJobItems(jobId, items) {
+    for (const item of items) {
+        const i = item.index;
+        if (seenItems[i] === item.status) continue;
+        seenItems[i] = item.status;
+        if (item.status === 'done') {
+            try {
+                const blob = await timed('download', async () => (await api(`/jobs/${jobId}/items/${i}/result`)).blob());
+                if (results[i]?.url) URL.revokeObjectURL(results[i].url);
+                const sourceType = item.outputMimeType?.startsWith('video/') ? 'video' : 'image';
+                results[i] = { name: item.name, mimeType: item.outputMimeType, cleaned: blob, url: URL.createObjectURL(blob), sourceType };
+                await timed('render', () => {
+                    addResultCard(i, item.name, results[i].url);
+                    return getResultCard(i).querySelector('img')?.decode().catch(() => {});
+                });
+            } catch (e) {
+                seenItems[i] = null;  // 下次輪詢再試
+            }
+        } else if (item.status === 'error') {
+            const errMsg = itemErrorMessage(item);
+            results[i] = { name: item.name, mimeType: item.mimeType, cleaned: null, error: errMsg, sourceType: item.mimeType?.startsWith('video/') ? 'video' : 'image' };
+            addResultCard(i, item.name, null, errMsg);
+        } else {
+            addPendingCard(i);
+        }
+    }
+    flushSpans();
+}
+
+function itemErrorMessage(item) {
+    const isAuthError = item.errorStatus === 400 || item.errorStatus === 403 || (item.error || '').includes("key");
+    if (isAuthError) return i18n.apiKeyInvalid;
+    if (item.error === 'NO_IMAGE') return i18n.apiNoImage;
+    return item.error;
+}
+
+// ZIP 由伺服器邊處理邊串流打包，瀏覽器只負責下載
+downloadAllBtn.onclick = () => {
+    if (!currentJobId || !results.some(r => r && r.cleaned)) {
+        showToast("沒有可下載的圖片", true);
+        return;
+    }
+    const link = document.createElement('a');
+    link.href = `${API_BASE}/jobs/${currentJobId}/archive?token=${encodeURIComponent(API_TOKEN)}`;
+    link.download = 'watermark_removed_images.zip';
+    document.body.appendChild(link);
+    link.click();
+    link.remove();
+    showToast("下載已開始", false);
+};
+
+function getResultCard(index) {
+    let div = document.getElementById(`result-card-${index}`);
+    if (!div) {
+        div = document.createElement('div');
+        div.id = `result-card-${index}`;
+        div.className = 'result-card glass rounded-2xl overflow-hidden';
+        resultsGrid.appendChild(div);
+    }
+    return div;
+}
+
+function addPendingCard(index, label = i18n.analyzing) {
+    getResultCard(index).innerHTML = `
+        <div class="h-48 flex items-center justify-center bg-slate-800/50 flex-col gap-2">
+            <div class="loader"></div>
+            <div class="text-[10px] text-slate-400">${label}</div>
+        </div>
+    `;
+}
+
+function extensionFor(mimeType) {
+    return { 'image/jpeg': 'jpg', 'image/webp': 'webp', 'image/gif': 'gif', 'video/webm': 'webm', 'video/mp4': 'mp4' }[mimeType] || 'png';
+}
+
+function addResultCard(index, name, cleanedUrl, error) {
+    const div = getResultCard(index);
+
+    if (cleanedUrl) { 
+        div.innerHTML = `
+            <div class="relative group h-48">
+                ${results[index]?.sourceType === 'video'
+                    ? `<video src="${cleanedUrl}" class="w-full h-full object-cover" autoplay loop muted playsinline></video>`
+                    : `<img src="${cleanedUrl}" class="w-full h-full object-cover">`}
+                <div class="absolute inset-0 bg-black/50 opacity-0 group-hover:opacity-100 transition flex items-center justify-center gap-2">
+                    <a href="${cleanedUrl}" download="${name}_Clean.${extensionFor(results[index]?.mimeType)}" class="bg-white text-slate-900 px-3 py-1.5 rounded-lg text-xs font-bold hover:bg-slate-200 shadow-xl transform scale-95 hover:scale-100 transition flex items-center gap-1">
+                        下載
+                    </a>
+                    <button onclick="reprocessItem(${index})" class="bg-slate-700 text-white p-1.5 rounded-lg hover:bg-slate-600 shadow-xl transform scale-95 hover:scale-100 transition" title="重新處理">
+                        重試
+                    </button>
+                </div>
+            </div>
+            <div class="p-4 flex justify-between items-center text-[10px]">
+                <span class="truncate max-w-[60%]">${name}</span>
+                <span class="text-emerald-400 font-bold flex items-center gap-1">
+                    ${i18n.success}
+                </span>
+            </div>`; 
+    }
+    else { 
+        div.innerHTML = `
+            <div class="p-6 text-center text-red-400 text-[10px] h-48 flex items-center justify-center border border-red-500/20 bg-red-500/10 flex-col gap-3">
+                <div>${error || i18n.failed}</div>
+                <button onclick="reprocessItem(${index})" class="bg-red-500/20 hover:bg-red-500/30 text-red-300 px-3 py-1 rounded-lg transition text-xs flex items-center gap-1 cursor-pointer">
+                    重試
+                </button>
+            </div>`; 
+    }
+}
+
+async function reprocessItem(index) {
+    if (!currentJobId || !document.getElementById(`result-card-${index}`)) return;
+
+    addPendingCard(index, '重新處理中...');
+    try {
+        await api(`/jobs/${currentJobId}/items/${index}/retry`, { method: 'POST' });
+    } catch (e) {
+        showToast(e.message, true);
+        seenItems[index] = null;
+        return;
+    }
+    seenItems[index] = 'pending';
+    await followJob(currentJobId);
+}
+
+document.getElementById('reset-btn').onclick = () => { saveJobId(null); location.reload(); };
+
+// 重新整理後接回上一個未清除的批次
+const savedJobId = loadJobId();
+if (savedJobId) {
+    uploadSection.classList.add('hidden');
+    resultsSection.classList.remove('hidden');
+    followJob(savedJobId).then(() => {
+        if (!results.length) uploadSection.classList.remove('hidden');
+    });
+}
@@ -0,0 +1,200 @@
+"""本機的 Gemini generateContent 替身，用來壓測與重現錯誤情境，不消耗配額。
+
+    python -m watermark.stub_server --port 8600 --latency 2 --throttle 0.1
+    GEMINI_BASE_URL=http://127.0.0.1:8600 streamlit run app.py
+
+收到的圖片原樣回傳 (echo)；依設定的機率注入 429、NO_IMAGE 與安全過濾，
+也可用 --rpm 模擬每分鐘配額。GET /stats 取得各種回應的次數，POST /stats/reset 歸零。
+"""
+
+import argparse
+import json
+import logging
+import random
+import re
+import threading
+import time
+from collections import Counter, deque
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+log = logging.getLogger(__name__)
+
+GENERATE_PATH = re.compile(r"/v1beta/models/([\w.-]+):generateContent")
+
+
+@dataclass
+class StubOptions:
+    latency: float = 1.0  # 平均延遲 (秒)
+    jitter: float = 0.2  # 延遲的標準差，相對於平均延遲的比例
+    throttle: float = 0.0  # 回 429 的機率
+    no_image: float = 0.0  # 回 200 但沒有圖片 (finishReason NO_IMAGE) 的機率
+    blocked: float = 0.0  # 被安全過濾 (promptFeedback.blockReason) 的機率
+    rpm: float = 0.0  # 大於 0 時，超過每分鐘請求數也回 429
+    retry_after: float = 1.0  # 429 時建議的重試秒數，0 表示不帶提示
+    seed: int | None = None
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address: tuple[str, int], options: StubOptions):
+        super().__init__(address, StubHandler)
+        self.options = options
+        self.stats: Counter[str] = Counter()
+        self._random = random.Random(options.seed)
+        self._window: deque[float] = deque()
+        self._lock = threading.Lock()
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def decide(self) -> tuple[str, float]:
+        """決定這次請求的結果與延遲。"""
+        opts = self.options
+        with self._lock:
+            now = time.monotonic()
+            while self._window and now - self._window[0] > 60:
+                self._window.popleft()
+            delay = max(0.0, self._random.gauss(opts.latency, opts.latency * opts.jitter))
+            if opts.rpm and len(self._window) >= opts.rpm:
+                return "quota", 0.0
+            self._window.append(now)
+            roll = self._random.random()
+            for outcome, chance in (("throttled", opts.throttle), ("no_image", opts.no_image),
+                                    ("blocked", opts.blocked)):
+                if roll < chance:
+                    return outcome, delay
+                roll -= chance
+            return "ok", delay
+
+    def snapshot(self) -> dict[str, int]:
+        with self._lock:
+            return dict(self.stats)
+
+    def reset_stats(self) -> None:
+        with self._lock:
+            self.stats.clear()
+
+    def count(self, outcome: str) -> None:
+        with self._lock:
+            self.stats[outcome] += 1
+            self.stats["requests"] += 1
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    server: StubServer
+
+    def log_message(self, format, *args):
+        log.debug("%s - " + format, self.address_string(), *args)
+
+    def do_GET(self):
+        if self.path != "/stats":
+            return self._send_json(404, {"error": {"code": 404, "message": "Not found"}})
+        self._send_json(200, self.server.snapshot())
+
+    def do_POST(self):
+        path = self.path.split("?", 1)[0]
+        if path == "/stats/reset":
+            self.server.reset_stats()
+            return self._send_json(204, None)
+        if not GENERATE_PATH.fullmatch(path):
+            return self._send_json(404, {"error": {"code": 404, "message": "Not found"}})
+
+        try:
+            length = int(self.headers.get("Content-Length") or 0)
+            parts = json.loads(self.rfile.read(length))["contents"][0]["parts"]
+            image = next(p["inlineData"] for p in parts if "inlineData" in p)
+        except (ValueError, KeyError, IndexError, TypeError, StopIteration):
+            self.server.count("bad_request")
+            return self._send_json(400, {"error": {"code": 400, "message": "Invalid payload",
+                                                   "status": "INVALID_ARGUMENT"}})
+        if not self.headers.get("x-goog-api-key") and "key=" not in self.path:
+            self.server.count("bad_request")
+            return self._send_json(400, {"error": {"code": 400, "message": "API key not valid.",
+                                                   "status": "INVALID_ARGUMENT"}})
+
+        outcome, delay = self.server.decide()
+        time.sleep(delay)
+        self.server.count(outcome)
+        if outcome in ("throttled", "quota"):
+            return self._send_throttled()
+        if outcome == "no_image":
+            return self._send_json(200, {"candidates": [{
+                "content": {"parts": [{"text": "I can't edit this image."}], "role": "model"},
+                "finishReason": "NO_IMAGE",
+            }]})
+        if outcome == "blocked":
+            return self._send_json(200, {"promptFeedback": {"blockReason": "SAFETY"}})
+        self._send_json(200, {"candidates": [{
+            "content": {"parts": [{"inlineData": image}], "role": "model"},
+            "finishReason": "STOP",
+        }]})
+
+    def _send_throttled(self):
+        retry_after = self.server.options.retry_after
+        error = {"code": 429, "message": "Resource has been exhausted (e.g. check quota).",
+                 "status": "RESOURCE_EXHAUSTED"}
+        headers = {}
+        if retry_after:
+            error["details"] = [{"@type": "type.googleapis.com/google.rpc.RetryInfo", "retryDelay": f"{retry_after}s"}]
+            headers["Retry-After"] = str(max(1, round(retry_after)))
+        self._send_json(429, {"error": error}, headers)
+
+    def _send_json(self, status: int, obj, headers: dict | None = None):
+        body = json.dumps(obj).encode() if obj is not None else b""
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        if body:
+            self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def start_stub_server(options: StubOptions, host: str = "127.0.0.1", port: int = 0) -> StubServer:
+    """在背景執行緒啟動；port 為 0 時自動挑選可用的埠。"""
+    server = StubServer((host, port), options)
+    threading.Thread(target=server.serve_forever, name="gemini-stub", daemon=True).start()
+    return server
+
+
+def add_options(parser: argparse.ArgumentParser) -> None:
+    """替身的參數，壓測工具 (bench) 共用。"""
+    defaults = StubOptions()
+    parser.add_argument("--latency", type=float, default=defaults.latency, help="平均延遲 (秒)")
+    parser.add_argument("--jitter", type=float, default=defaults.jitter, help="延遲標準差 (相對比例)")
+    parser.add_argument("--throttle", type=float, default=defaults.throttle, help="回 429 的機率")
+    parser.add_argument("--no-image", type=float, default=defaults.no_image, help="回 NO_IMAGE 的機率")
+    parser.add_argument("--blocked", type=float, default=defaults.blocked, help="被安全過濾的機率")
+    parser.add_argument("--rpm", type=float, default=defaults.rpm, help="每分鐘配額 (0 為不限)")
+    parser.add_argument("--retry-after", type=float, default=defaults.retry_after, help="429 建議的重試秒數")
+    parser.add_argument("--seed", type=int)
+
+
+def options_from_args(args: argparse.Namespace) -> StubOptions:
+    return StubOptions(latency=args.latency, jitter=args.jitter, throttle=args.throttle, no_image=args.no_image,
+                       blocked=args.blocked, rpm=args.rpm, retry_after=args.retry_after, seed=args.seed)
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(prog="python -m watermark.stub_server", description="Gemini API 本機替身")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8600)
+    add_options(parser)
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    server = StubServer((args.host, args.port), options_from_args(args))
+    log.info("Gemini stub listening on %s", server.base_url)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()